@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+下载器端到端基准测试
+用 hls_server.SyntheticHLSServer 在本机模拟 HLS 源，对每个场景完整执行 M3U8Downloader.run()，
+统计 切片/秒、MB/秒、切片耗时 p50/p99、内存峰值 (RSS) 和合并收尾耗时，并校验输出内容。
+不需要联网，可在 CI 中作为性能回归门禁。
+
+每个用例在独立子进程中运行，RSS 峰值不受服务器和其他用例影响。
+
+用法:
+    python3 benchmarks/bench_downloader.py
+    python3 benchmarks/bench_downloader.py --scenarios baseline,aes --modes stream --json result.json
+    # CI: 与基线相比 MB/s 下降超过 20% 或输出校验失败时以非零状态退出
+    python3 benchmarks/bench_downloader.py --baseline baseline.json --tolerance 0.2
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from core.downloader import M3U8Downloader
+from hls_server import SyntheticHLSServer
+
+MB = 1024 * 1024
+
+# 场景: SyntheticHLSServer 参数
+SCENARIOS = {
+    "baseline": dict(latency=0.01, jitter=0.02),
+    "aes": dict(latency=0.01, jitter=0.02, encrypt=True),
+    "aes-rotate": dict(latency=0.01, jitter=0.02, encrypt=True, key_rotation=10),
+    "jitter": dict(latency=0.02, jitter=0.2),
+    "lossy": dict(latency=0.01, jitter=0.02, error_rate=0.03),
+    "stall": dict(latency=0.01, jitter=0.02, stall_rate=0.02, stall_time=8.0),
+    "capped": dict(latency=0.01, jitter=0.02, connection_bandwidth=4 * MB, total_bandwidth=32 * MB),
+    # 三个各自限速的源，主列表通过冗余子流指向另外两个
+    "mirrors": dict(latency=0.01, jitter=0.02, connection_bandwidth=4 * MB, total_bandwidth=32 * MB, mirrors=2),
+    # 单文件 HLS: 各切片是同一文件中相接的字节范围，相邻切片合并为一个 Range 请求
+    "single-file": dict(latency=0.01, jitter=0.02, single_file=True),
+    # fMP4 单文件: EXT-X-MAP 初始化段是同一文件开头的字节范围，输出必须以它开头
+    "fmp4": dict(latency=0.01, jitter=0.02, single_file=True, fmp4=True),
+    # 少量超大切片 + 单连接限速: 大切片拆成多个并行 Range 请求
+    "large": dict(segments=4, segment_size=32 * MB, latency=0.01, connection_bandwidth=4 * MB),
+}
+
+
+class TimedDownloader(M3U8Downloader):
+    """记录每个切片 (含重试) 耗时和最后一个切片完成时间的下载器"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.segment_times = []
+        self.last_segment_done = None
+        self._times_lock = threading.Lock()
+
+    def _process_segment(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super()._process_segment(*args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            with self._times_lock:
+                self.segment_times.append(end - start)
+                self.last_segment_done = end
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(MB), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def peak_rss_mb():
+    """
+    本进程的 RSS 峰值 (MB)
+    Linux 的 ru_maxrss 会保留 exec 之前 (即 spawn 出子进程的父进程) 的峰值，把服务器占用的内存也算进来，
+    因此优先读取只属于当前地址空间的 VmHWM
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_download(url, mode, max_workers, hedge_percentile, work_dir, result_queue):
+    """子进程: 执行一次完整下载并回传指标"""
+    downloader = TimedDownloader(url, output_dir=work_dir, max_workers=max_workers, merge_mode=mode,
+                                 hedge_percentile=hedge_percentile)
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        start = time.perf_counter()
+        path, error = downloader.run()
+        end = time.perf_counter()
+    result_queue.put({
+        "path": path,
+        "error": error,
+        "log_tail": log.getvalue()[-2000:],
+        "elapsed": end - start,
+        "merge": end - downloader.last_segment_done if downloader.last_segment_done else 0.0,
+        "segment_times": downloader.segment_times,
+        "sha1": file_sha1(path) if path else None,
+        "hedges_fired": downloader.hedging.fired,
+        "hedges_won": downloader.hedging.won,
+        "peak_rss_mb": peak_rss_mb(),
+    })
+
+
+def run_case(scenario, mode, args, work_dir):
+    # 场景可以指定自己的切片数和大小
+    server_kwargs = dict(dict(segments=args.segments, segment_size=args.segment_kb * 1024, seed=args.seed),
+                         **SCENARIOS[scenario])
+    segments = server_kwargs["segments"]
+    mirror_count = server_kwargs.pop("mirrors", 0)
+    ctx = multiprocessing.get_context("spawn")
+    with contextlib.ExitStack() as stack:
+        mirrors = [stack.enter_context(SyntheticHLSServer(**server_kwargs)) for _ in range(mirror_count)]
+        server = stack.enter_context(
+            SyntheticHLSServer(redundant_urls=[m.base_url for m in mirrors], **server_kwargs)
+        )
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_download, args=(server.master_url, mode, args.max_workers, args.hedge_percentile,
+                                                       work_dir, queue))
+        proc.start()
+        result = queue.get()
+        proc.join()
+        expected = server.expected_sha1()
+        nbytes = server.expected_bytes
+        faults_injected = sum(s.errors_injected + s.stalls_injected for s in [server] + mirrors)
+
+    if result["path"]:
+        Path(result["path"]).unlink(missing_ok=True)
+    times = result["segment_times"]
+    ok = result["sha1"] == expected
+    if not ok:
+        print(f"\n❌ {scenario}/{mode} 输出校验失败: {result['error']}\n{result['log_tail']}")
+    return {
+        "scenario": scenario,
+        "mode": mode,
+        "ok": ok,
+        "segments": segments,
+        "bytes": nbytes,
+        "elapsed": round(result["elapsed"], 3),
+        "segments_per_s": round(segments / result["elapsed"], 2),
+        "mb_per_s": round(nbytes / MB / result["elapsed"], 2),
+        "p50_ms": round(percentile(times, 50) * 1000, 1),
+        "p99_ms": round(percentile(times, 99) * 1000, 1),
+        "peak_rss_mb": round(result["peak_rss_mb"], 1),
+        "merge_s": round(result["merge"], 3),
+        "faults_injected": faults_injected,
+        "hedges": f"{result['hedges_won']}/{result['hedges_fired']}",
+    }
+
+
+def compare_baseline(results, baseline_path, tolerance):
+    """与基线结果比较 MB/s，返回回归的用例描述列表"""
+    baseline = {
+        (r["scenario"], r["mode"]): r
+        for r in json.loads(Path(baseline_path).read_text(encoding="utf-8"))["results"]
+    }
+    regressions = []
+    for r in results:
+        base = baseline.get((r["scenario"], r["mode"]))
+        if base and r["mb_per_s"] < base["mb_per_s"] * (1 - tolerance):
+            regressions.append(f"{r['scenario']}/{r['mode']}: {r['mb_per_s']} MB/s (基线 {base['mb_per_s']} MB/s)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下载器端到端基准测试 (本地模拟 HLS 源)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"逗号分隔的场景 (默认全部: {','.join(SCENARIOS)})")
+    parser.add_argument("--modes", default="stream,concat", help="逗号分隔的合并方式 (默认: stream,concat)")
+    parser.add_argument("--segments", type=int, default=200, help="切片数 (默认: 200)")
+    parser.add_argument("--segment-kb", type=int, default=256, help="单个切片大小 KB (默认: 256)")
+    parser.add_argument("--max-workers", type=int, default=32, help="下载器并发上限 (默认: 32)")
+    parser.add_argument("--hedge-percentile", type=float, default=95,
+                        help="下载器的对冲请求分位数，0 表示关闭 (默认: 95)")
+    parser.add_argument("--seed", type=int, default=0, help="延迟/错误注入的随机数种子")
+    parser.add_argument("--json", help="把结果写入 JSON 文件 (可作为之后的 --baseline)")
+    parser.add_argument("--baseline", help="基线 JSON 文件，MB/s 回归超过容差时以非零状态退出")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的 MB/s 下降比例 (默认: 0.2)")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+
+    print(f"合成 HLS 源: {args.segments} 个切片 x {args.segment_kb} KB, 并发上限 {args.max_workers}")
+    header = (f"{'场景':<12}{'模式':<8}{'切片/s':>9}{'MB/s':>9}{'p50 ms':>9}{'p99 ms':>9}"
+              f"{'RSS MB':>9}{'合并 s':>9}{'注入故障':>9}{'对冲胜/发':>10}  结果")
+    print(header)
+    results = []
+    # get_download_dir 只允许用户主目录下的路径
+    with tempfile.TemporaryDirectory(dir=Path.home()) as work_dir:
+        for scenario in scenarios:
+            for mode in modes:
+                r = run_case(scenario, mode, args, work_dir)
+                results.append(r)
+                print(f"{scenario:<12}{mode:<8}{r['segments_per_s']:>9}{r['mb_per_s']:>9}{r['p50_ms']:>9}"
+                      f"{r['p99_ms']:>9}{r['peak_rss_mb']:>9}{r['merge_s']:>9}{r['faults_injected']:>9}{r['hedges']:>10}  "
+                      f"{'✅' if r['ok'] else '❌'}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"args": vars(args), "results": results}, indent=2, ensure_ascii=False),
+                                   encoding="utf-8")
+        print(f"💾 结果已写入 {args.json}")
+
+    failed = [f"{r['scenario']}/{r['mode']}" for r in results if not r["ok"]]
+    regressions = compare_baseline(results, args.baseline, args.tolerance) if args.baseline else []
+    for item in failed:
+        print(f"❌ 输出校验失败: {item}")
+    for item in regressions:
+        print(f"❌ 性能回归: {item}")
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+线程版与异步下载引擎对比
+对同一个本地模拟 HLS 源分别执行 M3U8Downloader.run() 和 AsyncM3U8Downloader.run()，
+统计 切片/秒、MB/秒、内存峰值 (RSS) 和线程数峰值，并校验输出内容。
+高延迟、切片多的场景下，异步引擎的在途请求数不受线程数限制。
+
+用法:
+    python3 benchmarks/bench_engines.py
+    python3 benchmarks/bench_engines.py --scenarios high-latency --concurrency 2000 --json engines.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_downloader import file_sha1, peak_rss_mb
+from core.async_downloader import AsyncM3U8Downloader
+from core.downloader import M3U8Downloader
+from hls_server import SyntheticHLSServer
+
+MB = 1024 * 1024
+
+# 场景: SyntheticHLSServer 参数
+SCENARIOS = {
+    "baseline": dict(segments=200, segment_size=256 * 1024, latency=0.01, jitter=0.02),
+    "aes": dict(segments=200, segment_size=256 * 1024, latency=0.01, jitter=0.02, encrypt=True),
+    # 小切片 + 每个请求 200ms 首字节延迟：吞吐取决于同时在途的请求数
+    "high-latency": dict(segments=2000, segment_size=32 * 1024, latency=0.2, jitter=0.05),
+}
+ENGINES = ("thread", "async")
+
+
+def sample_threads(stop, peak):
+    while not stop.wait(0.05):
+        peak[0] = max(peak[0], threading.active_count())
+
+
+def run_download(engine, url, args, work_dir, result_queue):
+    """子进程: 用指定引擎执行一次完整下载并回传指标"""
+    stop, peak = threading.Event(), [threading.active_count()]
+    sampler = threading.Thread(target=sample_threads, args=(stop, peak), daemon=True)
+    sampler.start()
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        start = time.perf_counter()
+        if engine == "thread":
+            path, error = M3U8Downloader(url, output_dir=work_dir, max_workers=args.max_workers).run()
+        else:
+            downloader = AsyncM3U8Downloader(url, output_dir=work_dir, max_concurrency=args.concurrency)
+            path, error = asyncio.run(downloader.run())
+        elapsed = time.perf_counter() - start
+    stop.set()
+    result_queue.put({
+        "path": path,
+        "error": error,
+        "log_tail": log.getvalue()[-2000:],
+        "elapsed": elapsed,
+        "sha1": file_sha1(path) if path else None,
+        "peak_threads": peak[0],
+        "peak_rss_mb": peak_rss_mb(),
+    })
+
+
+def run_case(scenario, engine, args, work_dir):
+    server_kwargs = dict(SCENARIOS[scenario], seed=args.seed)
+    ctx = multiprocessing.get_context("spawn")
+    with SyntheticHLSServer(**server_kwargs) as server:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_download, args=(engine, server.master_url, args, work_dir, queue))
+        proc.start()
+        result = queue.get()
+        proc.join()
+        expected = server.expected_sha1()
+        nbytes = server.expected_bytes
+
+    if result["path"]:
+        Path(result["path"]).unlink(missing_ok=True)
+    ok = result["sha1"] == expected
+    if not ok:
+        print(f"\n❌ {scenario}/{engine} 输出校验失败: {result['error']}\n{result['log_tail']}")
+    segments = server_kwargs["segments"]
+    return {
+        "scenario": scenario,
+        "engine": engine,
+        "ok": ok,
+        "segments": segments,
+        "bytes": nbytes,
+        "elapsed": round(result["elapsed"], 3),
+        "segments_per_s": round(segments / result["elapsed"], 2),
+        "mb_per_s": round(nbytes / MB / result["elapsed"], 2),
+        "peak_rss_mb": round(result["peak_rss_mb"], 1),
+        "peak_threads": result["peak_threads"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="线程版 / 异步下载引擎对比 (本地模拟 HLS 源)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"逗号分隔的场景 (默认全部: {','.join(SCENARIOS)})")
+    parser.add_argument("--engines", default=",".join(ENGINES), help="逗号分隔的引擎 (默认: thread,async)")
+    parser.add_argument("--max-workers", type=int, default=32, help="线程版的并发上限 (默认: 32)")
+    parser.add_argument("--concurrency", type=int, default=1000, help="异步引擎的在途请求上限 (默认: 1000)")
+    parser.add_argument("--seed", type=int, default=0, help="延迟注入的随机数种子")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS] + [e for e in engines if e not in ENGINES]
+    if unknown:
+        parser.error(f"未知场景或引擎: {', '.join(unknown)}")
+
+    print(f"线程版并发上限 {args.max_workers}，异步引擎在途请求上限 {args.concurrency}")
+    print(f"{'场景':<14}{'引擎':<8}{'切片/s':>9}{'MB/s':>9}{'耗时 s':>9}{'RSS MB':>9}{'线程峰值':>9}  结果")
+    results = []
+    # get_download_dir 只允许用户主目录下的路径
+    with tempfile.TemporaryDirectory(dir=Path.home()) as work_dir:
+        for scenario in scenarios:
+            for engine in engines:
+                r = run_case(scenario, engine, args, work_dir)
+                results.append(r)
+                print(f"{scenario:<14}{engine:<8}{r['segments_per_s']:>9}{r['mb_per_s']:>9}{r['elapsed']:>9}"
+                      f"{r['peak_rss_mb']:>9}{r['peak_threads']:>9}  {'✅' if r['ok'] else '❌'}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"args": vars(args), "results": results}, indent=2, ensure_ascii=False),
+                                   encoding="utf-8")
+        print(f"💾 结果已写入 {args.json}")
+    if not all(r["ok"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+播放列表解析基准测试
+在合成的长媒体列表 (每 N 个切片轮换一次密钥，可选 EXT-X-BYTERANGE + EXT-X-MAP 的 fMP4 单文件) 上对比 m3u8 库与 core.playlist.Playlist:
+完整解析耗时、取到第一个切片的耗时 (调度器开始下载前需要的部分) 和内存峰值，并校验两者解析出的切片一致。
+
+用法:
+    python3 benchmarks/bench_playlist.py
+    python3 benchmarks/bench_playlist.py --segments 1000 10000 100000 --byterange
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import m3u8
+
+from core.playlist import Playlist
+
+URI = "https://cdn.example.com/vod/1080p/index.m3u8"
+
+
+def build_playlist(segments, key_every=500, byterange=False):
+    lines = ["#EXTM3U", "#EXT-X-VERSION:4", "#EXT-X-TARGETDURATION:6", "#EXT-X-MEDIA-SEQUENCE:100",
+             "#EXT-X-PLAYLIST-TYPE:VOD"]
+    offset = 0
+    if byterange:
+        # fMP4 单文件: 初始化段位于文件开头
+        lines.append('#EXT-X-MAP:URI="main.mp4",BYTERANGE="720@0"')
+        offset = 720
+    for i in range(segments):
+        if key_every and i % key_every == 0:
+            lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="https://keys.example.com/k{i // key_every}.bin",'
+                         f'IV=0x{i:032x}')
+        lines.append(f"#EXTINF:{5.005 + (i % 7) * 0.1:.3f},")
+        if byterange:
+            size = 180000 + (i % 13) * 188
+            lines.append(f"#EXT-X-BYTERANGE:{size}@{offset}")
+            offset += size
+            lines.append("main.mp4")
+        else:
+            lines.append(f"seg_{i:06d}.ts")
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def measure(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def signature(segment):
+    key = segment.key
+    init = segment.init_section
+    return (segment.uri, round(segment.duration, 3), segment.byterange, segment.media_sequence,
+            key and (key.method, key.uri, key.iv), init and (init.absolute_uri, init.byterange))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="播放列表解析基准测试")
+    parser.add_argument("--segments", type=int, nargs="+", default=[1000, 10000, 50000],
+                        help="合成媒体列表的切片数，可给多个 (默认: 1000 10000 50000)")
+    parser.add_argument("--key-every", type=int, default=500, help="每多少个切片轮换一次密钥 (默认: 500，0 表示不加密)")
+    parser.add_argument("--byterange", action="store_true", help="所有切片是同一 fMP4 文件的字节范围 (带 EXT-X-MAP 初始化段)")
+    parser.add_argument("--repeat", type=int, default=3, help="每项取最快的一次 (默认: 3)")
+    args = parser.parse_args()
+
+    print(f"{'切片数':>8}{'解析器':>10}{'完整解析 ms':>14}{'首个切片 ms':>14}{'内存峰值 MB':>14}")
+    for count in args.segments:
+        text = build_playlist(count, args.key_every, args.byterange)
+        expected = [signature(s) for s in m3u8.loads(text, uri=URI).segments]
+        parsed = Playlist(text, uri=URI)
+        assert len(parsed.segments) == count and [signature(s) for s in parsed.segments] == expected, "解析结果不一致"
+
+        def playlist_first():
+            # 下载器开始调度前需要: 切片总数、全部密钥 (预取) 和第一个切片
+            playlist = Playlist(text, uri=URI)
+            return len(playlist.segments), playlist.keys, playlist.segments[0]
+
+        cases = {
+            "m3u8": (lambda: m3u8.loads(text, uri=URI).segments,
+                     lambda: m3u8.loads(text, uri=URI).segments[0]),
+            "playlist": (lambda: list(Playlist(text, uri=URI).segments), playlist_first),
+        }
+        for name, (full, first) in cases.items():
+            full_time, peak = measure(full, args.repeat)
+            first_time, _ = measure(first, args.repeat)
+            print(f"{count:>8}{name:>10}{full_time * 1000:>14.1f}{first_time * 1000:>14.1f}{peak / 1024 / 1024:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+切片调度基准测试
+对比“一次性提交全部切片 + 按提交顺序取结果”(旧实现) 与滑动窗口 + 完成顺序统计 (当前实现)
+在合成的大播放列表上的内存峰值与耗时。网络请求用随机 sleep 模拟，不需要联网。
+
+用法:
+    python3 benchmarks/bench_scheduling.py --segments 50000
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.downloader import M3U8Downloader
+from core.merger import StreamingMerger
+from core.mirrors import MirrorSet
+
+PAYLOAD = b"\x47" * 188  # 一个 TS 包大小的假数据
+
+
+class FakeDownloader(M3U8Downloader):
+    """用随机 sleep 代替网络请求的下载器"""
+
+    def __init__(self, output_dir, max_latency):
+        super().__init__("http://bench.invalid/index.m3u8", output_dir=output_dir, max_workers=10)
+        self.max_latency = max_latency
+        self.mirrors = MirrorSet(self.url)
+
+    def _process_segment(self, segment, base_uri, temp_dir, seg_idx, merger=None, manifest=None, attempt=None):
+        time.sleep(random.random() * self.max_latency)
+        merger.add(seg_idx, PAYLOAD)
+        return None, seg_idx
+
+
+def legacy_download_segments(downloader, jobs, total_segments, base_uri, temp_dir, merger):
+    """旧实现：为每个切片创建 future，并按提交顺序等待"""
+    success_count = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=downloader.max_workers) as executor:
+        futures = [
+            executor.submit(downloader._process_segment, seg, base_uri, temp_dir, idx, merger)
+            for idx, seg in jobs
+        ]
+        for i, future in enumerate(futures):
+            try:
+                future.result()
+                success_count += 1
+            except Exception:
+                pass
+            print(f"\r进度: {i+1}/{total_segments} | 成功: {success_count}", end="", flush=True)
+    print("")
+
+
+def run_case(name, segments, max_latency, work_dir):
+    downloader = FakeDownloader(work_dir, max_latency)
+    playlist = [SimpleNamespace(uri=f"seg_{i}.ts", key=None) for i in range(segments)]
+    merger = StreamingMerger(Path(work_dir) / f"{name}.ts", work_dir)
+    jobs = ((idx, seg) for idx, seg in enumerate(playlist))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if name == "legacy":
+            legacy_download_segments(downloader, jobs, segments, "", work_dir, merger)
+        else:
+            downloader._download_segments(jobs, segments, "", work_dir, merger=merger)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    merger.close()
+
+    assert merger.is_complete(segments), f"{name}: 合并不完整"
+    return elapsed, peak, merger.peak_buffer_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="切片调度基准测试")
+    parser.add_argument("--segments", type=int, default=50000, help="合成播放列表的切片数 (默认: 50000)")
+    parser.add_argument("--latency", type=float, default=0.002, help="模拟的单个切片最大延迟，秒 (默认: 0.002)")
+    args = parser.parse_args()
+
+    print(f"合成播放列表: {args.segments} 个切片, 模拟延迟 0-{args.latency * 1000:.1f} ms, 10 个线程")
+    print(f"{'实现':<10}{'耗时 (s)':>12}{'内存峰值 (MB)':>16}{'重排缓冲峰值 (KB)':>20}")
+    # get_download_dir 只允许用户主目录下的路径
+    with tempfile.TemporaryDirectory(dir=Path.home()) as work_dir:
+        for name in ("legacy", "window"):
+            elapsed, peak, buffer_peak = run_case(name, args.segments, args.latency, work_dir)
+            print(f"{name:<10}{elapsed:>12.2f}{peak / 1024 / 1024:>16.1f}{buffer_peak / 1024:>20.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+启动耗时基准测试
+在独立子进程中用 python -X importtime 执行各入口路径需要的导入，统计本项目及其依赖的导入耗时
+(不含解释器自身启动时加载的模块)，并检查不该加载的重量级依赖是否被导入:
+    help    main.py --help                      不加载任何下载 / 解析依赖
+    m3u8    直接 m3u8 链接 (校验 + 线程下载器)    不加载 Selenium / aiohttp / httpx
+    page    网页链接 (直接请求网页这一层)         浏览器只在需要时才启动，不加载 Selenium
+    async   --engine async                      不加载 Selenium
+    enhance enhance_video.py --help             不加载 requests / Selenium
+每个场景运行多次取最快一次，超过预算 (毫秒) 或加载了禁止的模块时以非零状态退出，可在 CI 中作为门禁。
+
+用法:
+    python3 benchmarks/bench_startup.py
+    python3 benchmarks/bench_startup.py --scenarios help,m3u8 --runs 10 --json startup.json
+    # CI: 统一预算 / 与基线相比变慢超过 50% 时失败
+    python3 benchmarks/bench_startup.py --budget-ms 300
+    python3 benchmarks/bench_startup.py --baseline startup.json --tolerance 0.5
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+HEAVY = ("selenium", "webdriver_manager", "aiohttp", "httpx", "requests", "urllib3", "tenacity", "Crypto")
+
+# 场景: (导入代码, 不允许加载的顶层包, 默认预算 ms)
+SCENARIOS = {
+    "help": ("import main", HEAVY, 50),
+    "m3u8": ("import main, core.utils, core.transport, core.downloader, core.pool",
+             ("selenium", "webdriver_manager", "aiohttp", "httpx"), 400),
+    "page": ("import main, core.utils, core.extractor", ("selenium", "webdriver_manager", "aiohttp", "httpx"), 300),
+    "async": ("import main, core.utils, core.async_downloader", ("selenium", "webdriver_manager", "httpx"), 600),
+    "enhance": ("import enhance_video", HEAVY, 50),
+}
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 输出 -> [(模块, 自身 us, 累计 us, 嵌套深度)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def run_importtime(code):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                          capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"退出码 {proc.returncode}")
+    return parse_importtime(proc.stderr), wall
+
+
+def measure(scenario, runs, startup_modules):
+    """
+    运行 runs 次，取导入耗时最短的一次
+    导入耗时 = 解释器启动后新导入的顶层模块 (深度 0) 的累计耗时之和
+    """
+    code, forbidden, _ = SCENARIOS[scenario]
+    best = None
+    for _ in range(runs):
+        rows, wall = run_importtime(code)
+        top = [(name, cumulative) for name, _, cumulative, depth in rows
+               if depth == 0 and name not in startup_modules]
+        import_ms = sum(cumulative for _, cumulative in top) / 1000
+        if best is None or import_ms < best["import_ms"]:
+            loaded = {name for name, *_ in rows}
+            heaviest = sorted(((name, self_us) for name, self_us, _, _ in rows if name not in startup_modules),
+                              key=lambda item: item[1], reverse=True)[:5]
+            best = {
+                "scenario": scenario,
+                "import_ms": round(import_ms, 1),
+                "wall_ms": round(wall * 1000, 1),
+                "modules": len(loaded - startup_modules),
+                "forbidden": sorted({name.split(".")[0] for name in loaded} & set(forbidden)),
+                "heaviest": [f"{name} {self_us / 1000:.1f}" for name, self_us in heaviest],
+            }
+    return best
+
+
+def compare_baseline(results, baseline_path, tolerance):
+    """与基线比较导入耗时，返回回归的场景描述列表"""
+    baseline = {r["scenario"]: r for r in json.loads(Path(baseline_path).read_text(encoding="utf-8"))["results"]}
+    regressions = []
+    for r in results:
+        base = baseline.get(r["scenario"])
+        if base and r["import_ms"] > base["import_ms"] * (1 + tolerance):
+            regressions.append(f"{r['scenario']}: {r['import_ms']} ms (基线 {base['import_ms']} ms)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入口脚本启动 (导入) 耗时基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"逗号分隔的场景 (默认全部: {','.join(SCENARIOS)})")
+    parser.add_argument("--runs", type=int, default=5, help="每个场景运行次数，取最快一次 (默认: 5)")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="所有场景统一的导入耗时预算，单位毫秒 (默认: 按场景, 见 SCENARIOS)")
+    parser.add_argument("--json", help="把结果写入 JSON 文件 (可作为之后的 --baseline)")
+    parser.add_argument("--baseline", help="基线 JSON 文件，导入耗时增加超过容差时以非零状态退出")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="允许的导入耗时增加比例 (默认: 0.5)")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+
+    # 解释器启动时 (site 等) 已加载的模块不计入
+    startup_modules = {name for name, *_ in run_importtime("pass")[0]}
+    print(f"Python {sys.version.split()[0]}，每个场景 {args.runs} 次取最快")
+    print(f"{'场景':<10}{'导入 ms':>10}{'预算 ms':>10}{'进程 ms':>10}{'模块数':>8}  最慢的模块 (自身 ms)")
+    results = []
+    for scenario in scenarios:
+        r = measure(scenario, args.runs, startup_modules)
+        r["budget_ms"] = args.budget_ms if args.budget_ms is not None else SCENARIOS[scenario][2]
+        r["ok"] = r["import_ms"] <= r["budget_ms"] and not r["forbidden"]
+        results.append(r)
+        print(f"{scenario:<10}{r['import_ms']:>10}{r['budget_ms']:>10}{r['wall_ms']:>10}{r['modules']:>8}  "
+              f"{', '.join(r['heaviest'])}  {'✅' if r['ok'] else '❌'}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"args": vars(args), "results": results}, indent=2, ensure_ascii=False),
+                                   encoding="utf-8")
+        print(f"💾 结果已写入 {args.json}")
+
+    problems = []
+    for r in results:
+        if r["forbidden"]:
+            problems.append(f"{r['scenario']}: 加载了 {', '.join(r['forbidden'])}")
+        if r["import_ms"] > r["budget_ms"]:
+            problems.append(f"{r['scenario']}: 导入耗时 {r['import_ms']} ms 超出预算 {r['budget_ms']} ms")
+    problems += [f"性能回归 {item}" for item in
+                 (compare_baseline(results, args.baseline, args.tolerance) if args.baseline else [])]
+    for item in problems:
+        print(f"❌ {item}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
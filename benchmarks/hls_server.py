@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+本地 HLS 模拟服务器
+在后台线程中提供合成的 master / media 播放列表和切片，用于离线基准测试:
+- 切片数、切片大小可配置，内容由序号确定，可计算期望输出的校验和
+- 可选 AES-128 加密 (IV 由媒体序列号推导)，每 N 个切片轮换一次密钥
+- 注入固定延迟 + 随机抖动、按比例返回 503 或中途卡住、单连接 / 全局带宽上限
+- 切片支持 Range 请求；可选单文件模式 (媒体列表用 EXT-X-BYTERANGE 指向同一个文件中的各段)
+- 可选 fMP4 模式: 媒体列表带 EXT-X-MAP 初始化段 (单文件模式下是同一文件开头的字节范围)
+
+作为模块使用:
+    with SyntheticHLSServer(segments=200, encrypt=True) as server:
+        M3U8Downloader(server.master_url).run()
+
+单独运行 (手动调试):
+    python3 benchmarks/hls_server.py --port 8000 --segments 100 --encrypt
+"""
+
+import argparse
+import hashlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+PACKET_SIZE = 188
+CHUNK_SIZE = 64 * 1024
+VARIANT_BANDWIDTHS = (800000, 1800000, 3600000)
+
+
+class TokenBucket:
+    """带宽限制，rate 为字节/秒，突发上限为 0.1 秒的流量"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.burst = max(CHUNK_SIZE, rate / 10)
+        self._allowance = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.burst, self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= nbytes
+            delay = -self._allowance / self.rate if self._allowance < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """客户端主动断开 (如对冲请求被取消) 时不打印异常"""
+
+    daemon_threads = True
+    request_queue_size = 1024  # 异步客户端会同时发起上千个连接
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+class SyntheticHLSServer:
+    """
+    合成 HLS 源
+    路径:
+        /master.m3u8            多码率主列表 (各子流内容相同，下载器应选最高带宽；可附加指向其他服务器的冗余子流)
+        /v{n}/index.m3u8        媒体列表
+        /v{n}/seg_{idx}.ts      切片
+        /v{n}/all.ts            单文件模式下全部切片按序拼接的文件 (fMP4 模式为 all.mp4，以初始化段开头)
+        /v{n}/init.mp4          fMP4 模式 (非单文件) 的初始化段
+        /keys/key_{n}.bin       AES-128 密钥
+    """
+
+    def __init__(self, segments=100, segment_size=256 * 1024, target_duration=4, media_sequence=0,
+                 encrypt=False, key_rotation=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 stall_rate=0.0, stall_time=5.0, connection_bandwidth=0, total_bandwidth=0, redundant_urls=(),
+                 scale_variants=False, single_file=False, fmp4=False, seed=0, host="127.0.0.1", port=0):
+        """
+        :param segments: 切片数
+        :param segment_size: 单个切片的明文大小 (字节，按 TS 包大小取整)
+        :param encrypt: 是否 AES-128 加密
+        :param key_rotation: 每多少个切片轮换一次密钥，0 表示全程一个密钥
+        :param latency: 每个切片请求的固定延迟 (秒)
+        :param jitter: 额外的随机延迟上限 (秒)
+        :param error_rate: 切片请求返回 503 的概率
+        :param stall_rate: 切片响应发出第一块数据后卡住的概率 (模拟长尾请求)
+        :param stall_time: 卡住的时长 (秒)
+        :param connection_bandwidth: 单连接带宽上限 (字节/秒)，0 表示不限
+        :param total_bandwidth: 全局带宽上限 (字节/秒)，0 表示不限
+        :param redundant_urls: 其他模拟服务器的根地址，主列表中为每个子流附加指向它们的冗余子流 (模拟多 CDN)
+        :param scale_variants: 低码率子流的切片按 BANDWIDTH 比例缩小 (默认各子流内容相同)
+        :param single_file: 单文件 HLS: 切片是 all.ts 中相接的字节范围 (第一个之后省略偏移)
+        :param fmp4: 媒体列表带 EXT-X-MAP 初始化段，期望输出以初始化段开头；
+                     单文件模式下初始化段是 all.mp4 开头的字节范围，否则为单独的 init.mp4
+        :param seed: 随机数种子，保证延迟/错误注入可复现
+        :param port: 监听端口，0 表示随机空闲端口
+        """
+        self.segments = segments
+        self.segment_size = max(PACKET_SIZE, segment_size // PACKET_SIZE * PACKET_SIZE)
+        self.target_duration = target_duration
+        self.media_sequence = media_sequence
+        self.encrypt = encrypt
+        self.key_rotation = key_rotation
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_time = stall_time
+        self.connection_bandwidth = connection_bandwidth
+        self.total_bucket = TokenBucket(total_bandwidth) if total_bandwidth else None
+        self.redundant_urls = list(redundant_urls)
+        self.scale_variants = scale_variants
+        self.single_file = single_file
+        self.fmp4 = fmp4
+        self.file_name = "all.mp4" if fmp4 else "all.ts"
+        self.requests = 0
+        self.errors_injected = 0
+        self.stalls_injected = 0
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self._stats_lock = threading.Lock()
+        self._httpd = QuietHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    # ---------- 内容 ----------
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def master_url(self):
+        return f"{self.base_url}/master.m3u8"
+
+    @property
+    def media_url(self):
+        return f"{self.base_url}/v{len(VARIANT_BANDWIDTHS) - 1}/index.m3u8"
+
+    def key_index(self, idx):
+        return idx // self.key_rotation if self.key_rotation else 0
+
+    @staticmethod
+    def key_bytes(key_idx):
+        return hashlib.md5(f"bench-key-{key_idx}".encode()).digest()
+
+    def variant_segment_size(self, variant=None):
+        if variant is None or not self.scale_variants:
+            return self.segment_size
+        packets = self.segment_size // PACKET_SIZE * VARIANT_BANDWIDTHS[variant] // VARIANT_BANDWIDTHS[-1]
+        return max(1, packets) * PACKET_SIZE
+
+    def segment_plaintext(self, idx, variant=None):
+        """第 idx 个切片的明文: 以 0x47 同步字节开头的 TS 包，包内容由序号决定"""
+        body = (idx.to_bytes(4, "big") * (PACKET_SIZE // 4))[:PACKET_SIZE - 1]
+        return (b"\x47" + body) * (self.variant_segment_size(variant) // PACKET_SIZE)
+
+    def segment_payload(self, idx, variant=None):
+        data = self.segment_plaintext(idx, variant)
+        if not self.encrypt:
+            return data
+        iv = (self.media_sequence + idx).to_bytes(16, "big")
+        cipher = AES.new(self.key_bytes(self.key_index(idx)), AES.MODE_CBC, iv)
+        return cipher.encrypt(pad(data, AES.block_size))
+
+    def payload_size(self, variant=None):
+        size = self.variant_segment_size(variant)
+        return (size // 16 + 1) * 16 if self.encrypt else size
+
+    def segment_range(self, idx, variant, start, end):
+        """切片内容的 [start, end) 部分；未加密时按 TS 包直接生成，不构造整个切片"""
+        if self.encrypt:
+            return self.segment_payload(idx, variant)[start:end]
+        body = (idx.to_bytes(4, "big") * (PACKET_SIZE // 4))[:PACKET_SIZE - 1]
+        first = start // PACKET_SIZE
+        packets = -(-end // PACKET_SIZE) - first
+        return ((b"\x47" + body) * packets)[start - first * PACKET_SIZE:end - first * PACKET_SIZE]
+
+    def init_section(self):
+        """fMP4 初始化段: ftyp + 填充内容的 moov 盒子，内容固定，只用于校验输出是否以它开头"""
+        if not self.fmp4:
+            return b""
+        boxes = [b"ftypiso6\x00\x00\x02\x00iso6mp41", b"moov" + bytes(range(256)) * 4]
+        return b"".join((len(box) + 4).to_bytes(4, "big") + box for box in boxes)
+
+    def file_size(self, variant=None):
+        return len(self.init_section()) + self.payload_size(variant) * self.segments
+
+    def file_range(self, variant, start, end):
+        """单文件 all.ts / all.mp4 的 [start, end) 部分"""
+        init = self.init_section()
+        parts = [init[start:end]] if start < len(init) else []
+        start, end = max(0, start - len(init)), max(0, end - len(init))
+        size = self.payload_size(variant)
+        for idx in range(start // size, min(self.segments, -(-end // size))):
+            seg_start = idx * size
+            parts.append(self.segment_range(idx, variant, max(start, seg_start) - seg_start,
+                                            min(end, seg_start + size) - seg_start))
+        return b"".join(parts)
+
+    def expected_sha1(self):
+        """完整下载并按序拼接后的期望校验和"""
+        h = hashlib.sha1(self.init_section())
+        for idx in range(self.segments):
+            h.update(self.segment_plaintext(idx))
+        return h.hexdigest()
+
+    @property
+    def expected_bytes(self):
+        return len(self.init_section()) + self.segments * self.segment_size
+
+    def master_playlist(self):
+        lines = ["#EXTM3U"]
+        for n, bandwidth in enumerate(VARIANT_BANDWIDTHS):
+            for prefix in [""] + [url.rstrip("/") + "/" for url in self.redundant_urls]:
+                lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={640 * (n + 1)}x{360 * (n + 1)}")
+                lines.append(f"{prefix}v{n}/index.m3u8")
+        return "\n".join(lines) + "\n"
+
+    def media_playlist(self):
+        lines = [
+            "#EXTM3U",
+            f"#EXT-X-VERSION:{7 if self.fmp4 else 3}",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            f"#EXT-X-MEDIA-SEQUENCE:{self.media_sequence}",
+        ]
+        if self.fmp4 and self.single_file:
+            lines.append(f'#EXT-X-MAP:URI="{self.file_name}",BYTERANGE="{len(self.init_section())}@0"')
+        elif self.fmp4:
+            lines.append('#EXT-X-MAP:URI="init.mp4"')
+        current_key = None
+        for idx in range(self.segments):
+            if self.encrypt and self.key_index(idx) != current_key:
+                current_key = self.key_index(idx)
+                lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="/keys/key_{current_key}.bin"')
+            lines.append(f"#EXTINF:{self.target_duration:.3f},")
+            if self.single_file:
+                size = self.payload_size()
+                first = f"#EXT-X-BYTERANGE:{size}@{len(self.init_section())}"
+                lines.append(first if idx == 0 else f"#EXT-X-BYTERANGE:{size}")
+                lines.append(self.file_name)
+            else:
+                lines.append(f"seg_{idx}.ts")
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    # ---------- 服务 ----------
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="hls-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _segment_faults(self):
+        """本次切片请求的延迟、是否返回错误、是否中途卡住"""
+        with self._stats_lock:
+            self.requests += 1
+            delay = self.latency + self._random.random() * self.jitter
+            failed = self._random.random() < self.error_rate
+            stalled = not failed and self._random.random() < self.stall_rate
+            self.errors_injected += failed
+            self.stalls_injected += stalled
+        return delay, failed, stalled
+
+    def _send_body(self, handler, body, stalled=False):
+        conn_bucket = TokenBucket(self.connection_bandwidth) if self.connection_bandwidth else None
+        view = memoryview(body)
+        for start in range(0, len(view), CHUNK_SIZE):
+            chunk = view[start:start + CHUNK_SIZE]
+            if conn_bucket:
+                conn_bucket.consume(len(chunk))
+            if self.total_bucket:
+                self.total_bucket.consume(len(chunk))
+            handler.wfile.write(chunk)
+            if stalled and start == 0:
+                handler.wfile.flush()
+                time.sleep(self.stall_time)
+        with self._stats_lock:
+            self.bytes_sent += len(body)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                parts = path.strip("/").split("/")
+                if path == "/master.m3u8":
+                    return self._reply(server.master_playlist().encode(), "application/vnd.apple.mpegurl")
+                if len(parts) == 2 and parts[0] == "keys" and parts[1].startswith("key_"):
+                    key_idx = int(parts[1][4:].split(".")[0])
+                    return self._reply(server.key_bytes(key_idx), "application/octet-stream")
+                if len(parts) == 2 and parts[0].startswith("v"):
+                    if parts[1] == "index.m3u8":
+                        return self._reply(server.media_playlist().encode(), "application/vnd.apple.mpegurl")
+                    if parts[1].startswith("seg_"):
+                        idx = int(parts[1][4:].split(".")[0])
+                        if 0 <= idx < server.segments:
+                            variant = int(parts[0][1:])
+                            return self._segment(server.payload_size(variant),
+                                                 lambda start, end: server.segment_range(idx, variant, start, end))
+                    if parts[1] == server.file_name and server.single_file:
+                        variant = int(parts[0][1:])
+                        return self._segment(server.file_size(variant),
+                                             lambda start, end: server.file_range(variant, start, end))
+                    if parts[1] == "init.mp4" and server.fmp4:
+                        init = server.init_section()
+                        return self._segment(len(init), lambda start, end: init[start:end])
+                self.send_error(404)
+
+            def _segment(self, size, read):
+                delay, failed, stalled = server._segment_faults()
+                if delay:
+                    time.sleep(delay)
+                if failed:
+                    self.send_error(503)
+                    return
+                start, end = 0, size
+                byte_range = self.headers.get("Range", "")
+                if byte_range.startswith("bytes="):
+                    first, _, last = byte_range[6:].partition("-")
+                    start = int(first)
+                    end = min(size, int(last) + 1) if last else size
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+                else:
+                    self.send_response(200)
+                body = read(start, end)
+                self.send_header("Content-Type", "video/mp2t")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+                server._send_body(self, body, stalled)
+
+            def _reply(self, body, content_type):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 HLS 模拟服务器")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--segments", type=int, default=100)
+    parser.add_argument("--segment-kb", type=int, default=256)
+    parser.add_argument("--encrypt", action="store_true")
+    parser.add_argument("--key-rotation", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="秒")
+    parser.add_argument("--jitter", type=float, default=0.0, help="秒")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--stall-time", type=float, default=5.0, help="秒")
+    parser.add_argument("--single-file", action="store_true", help="切片是同一文件中相接的字节范围")
+    parser.add_argument("--fmp4", action="store_true", help="媒体列表带 EXT-X-MAP 初始化段")
+    parser.add_argument("--conn-mbps", type=float, default=0, help="单连接带宽上限 MB/s")
+    parser.add_argument("--total-mbps", type=float, default=0, help="全局带宽上限 MB/s")
+    args = parser.parse_args()
+
+    server = SyntheticHLSServer(
+        segments=args.segments, segment_size=args.segment_kb * 1024, encrypt=args.encrypt,
+        key_rotation=args.key_rotation, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        stall_rate=args.stall_rate, stall_time=args.stall_time, single_file=args.single_file, fmp4=args.fmp4,
+        connection_bandwidth=int(args.conn_mbps * 1024 * 1024), total_bandwidth=int(args.total_mbps * 1024 * 1024),
+        port=args.port,
+    ).start()
+    print(f"主列表: {server.master_url}")
+    print(f"媒体列表: {server.media_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
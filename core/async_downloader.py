@@ -0,0 +1,408 @@
+import asyncio
+import concurrent.futures
+import functools
+import inspect
+import shutil
+from urllib.parse import urljoin
+
+try:
+    import aiohttp
+except ImportError:  # 可选依赖，只有异步引擎需要
+    aiohttp = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from core.utils import HEADERS, get_download_dir, create_temp_dir, clean_dir, generate_filename
+from core.decrypter import Decrypter
+from core.keys import KeyManager
+from core.merger import StreamingMerger, TempSegmentWriter
+from core.playlist import Playlist
+from core.ranges import IncompleteBody, parse_byterange, range_header, range_skip
+from core.variants import VariantSelector
+
+
+class _SegmentSink:
+    """一次切片请求在写入线程一侧的状态，只在写入线程中使用；第一次写入时才创建写入器 (打开文件)"""
+
+    def __init__(self, open_writer, idx):
+        self.open_writer = open_writer
+        self.idx = idx
+        self.writer = None
+
+    def write(self, data, commit=False):
+        if self.writer is None:
+            self.writer = self.open_writer(self.idx)
+        if data:
+            self.writer.write(data)
+        if commit:
+            self.writer.commit()
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.abort()
+
+
+class AsyncM3U8Downloader:
+    """
+    基于 asyncio + aiohttp 的下载引擎，可嵌入已有的事件循环 (await downloader.run())
+    - 单个事件循环上同时进行上千个切片请求，不受线程数限制，适合高延迟、切片多的源
+    - 与 M3U8Downloader 相同的解密与合并语义: 流式 AES-128 增量解密；stream 模式按序写入 .part 文件
+      (乱序切片进入内存重排缓冲，超出上限溢写到磁盘)，concat 模式先写入临时文件再拼接
+    - 文件读写 (切片写入、溢写、拼接) 都交给一个专用线程按提交顺序执行，事件循环只处理网络请求与解密；
+      concat 模式同时打开的切片文件数受进程文件描述符上限约束
+    - progress_callback 可以是普通函数或协程函数，接收 (current, total)
+    - 取消 run() 所在的任务会取消全部切片请求并清理临时文件和未完成的输出
+    - EXT-X-BYTERANGE 切片逐个发出 Range 请求；EXT-X-MAP 初始化段只下载一次，写在初始化段变化处的切片之前
+    不支持的线程版功能: 断点续传、直播录制、对冲请求、多源调度、按期限选子流、ffmpeg 实时封装、
+    相邻字节范围合并请求与大切片并行拆分
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    WRITE_BYTES = 256 * 1024  # 每次交给写入线程的数据量
+    RETRIES = 3
+    MAX_OPEN_FILES = 256  # concat 模式同时写入的切片文件数上限
+    RESERVED_FDS = 64     # 文件描述符上限中留给连接和切片文件之外的部分
+
+    def __init__(self, url, output_dir=None, output_filename=None, max_concurrency=512, max_per_host=0,
+                 merge_mode="stream", max_buffer_mb=64, max_height=None, codec=None, max_bandwidth=None,
+                 timeout=30):
+        """
+        :param max_concurrency: 同时进行的切片请求数上限 (也是连接池大小)
+        :param max_per_host: 每个主机的连接数上限，0 表示只受 max_concurrency 限制
+        :param merge_mode: stream (边下载边按序写入) / concat (下载完成后拼接)
+        :param max_buffer_mb: stream 模式乱序切片的内存缓冲上限 (MB)
+        :param max_height / codec / max_bandwidth: 多码率列表的子流过滤条件，同 M3U8Downloader
+        :param timeout: 单次读取的超时时间 (秒)
+        """
+        self.url = url
+        self.download_dir = get_download_dir(custom_path=output_dir)
+        self.output_filename = output_filename
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.merge_mode = merge_mode
+        self.max_buffer_bytes = int(max_buffer_mb * 1024 * 1024)
+        self.timeout = timeout
+        self.variant_selector = VariantSelector(max_height=max_height, codec=codec, max_bandwidth=max_bandwidth)
+        self._keys = {}  # key URI -> bytes
+        self._init_sections = {}  # InitSection -> 解密后的内容
+        self._init_lock = asyncio.Lock()
+        self._io = None  # 执行文件读写的单线程池，run() 期间有效
+
+    def run_sync(self, progress_callback=None):
+        """在新的事件循环中执行下载，返回值同 M3U8Downloader.run()"""
+        return asyncio.run(self.run(progress_callback))
+
+    async def run(self, progress_callback=None):
+        """
+        执行下载流程
+        :return: (输出文件路径, None) 或 (None, 错误信息)
+        """
+        if aiohttp is None:
+            msg = "异步下载引擎需要 aiohttp: pip install aiohttp"
+            print(f"❌ {msg}")
+            return None, msg
+
+        temp_dir = create_temp_dir(self.download_dir)
+        self._io = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="async-io")
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrency, limit_per_host=self.max_per_host, ssl=False, ttl_dns_cache=300
+        )
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=self.timeout)
+        try:
+            async with aiohttp.ClientSession(headers=HEADERS, connector=connector, timeout=timeout) as session:
+                playlist, base_uri = await self._load_playlist(session, self.url)
+                segments = playlist.segments
+                if not segments:
+                    msg = "❌ 播放列表中没有切片"
+                    print(msg)
+                    return None, msg
+                await self._fetch_keys(session, playlist.keys, base_uri)
+
+                print(f"找到 {len(segments)} 个切片，开始下载 (异步引擎，最多 {self.max_concurrency} 个并发请求)...")
+                if self.merge_mode == "stream":
+                    return await self._run_streaming(session, segments, base_uri, temp_dir, progress_callback)
+                return await self._run_concat(session, segments, base_uri, temp_dir, progress_callback)
+        except asyncio.CancelledError:
+            print("\n⏹️  下载已取消")
+            raise
+        except Exception as e:
+            msg = f"下载过程出错: {str(e)}"
+            print(f"\n❌ {msg}")
+            return None, msg
+        finally:
+            # 等写入线程中剩余的操作 (取消时的 abort 等) 执行完再清理临时目录
+            self._io.shutdown(wait=True)
+            self._io = None
+            clean_dir(temp_dir)
+
+    async def _run_streaming(self, session, segments, base_uri, temp_dir, progress_callback):
+        output_path = self._output_path()
+        part_path = output_path.with_name(output_path.name + ".part")
+        merger = await self._in_io(
+            functools.partial(StreamingMerger, part_path, temp_dir, max_buffer_bytes=self.max_buffer_bytes)
+        )
+        try:
+            failed = await self._download_segments(
+                session, segments, base_uri, merger.open_segment, progress_callback
+            )
+        except BaseException:
+            await self._in_io(self._discard_output, merger, part_path)
+            raise
+        await self._in_io(merger.close)
+
+        if not merger.is_complete(len(segments)):
+            await self._in_io(part_path.unlink, True)
+            msg = f"❌ 有 {len(failed)} 个切片下载失败"
+            print(msg)
+            return None, msg
+        await self._in_io(part_path.replace, output_path)
+        if merger.spilled_count:
+            print(f"重排缓冲区已满，{merger.spilled_count} 个乱序切片曾溢写到磁盘")
+        print(f"✅ 合并完成: {output_path}")
+        return str(output_path), None
+
+    async def _run_concat(self, session, segments, base_uri, temp_dir, progress_callback):
+        def open_writer(idx):
+            return TempSegmentWriter(temp_dir / f"seg_{idx:04d}.ts", idx)
+
+        # 每个在途切片都占用一个打开的临时文件，与连接数合计不能超过进程的文件描述符上限
+        file_slots = asyncio.Semaphore(self._open_file_limit())
+        failed = await self._download_segments(
+            session, segments, base_uri, open_writer, progress_callback, file_slots=file_slots
+        )
+        if failed:
+            msg = f"❌ 有 {len(failed)} 个切片下载失败"
+            print(msg)
+            return None, msg
+
+        output_path = self._output_path()
+        ts_files = [temp_dir / f"seg_{idx:04d}.ts" for idx in range(len(segments))]
+        await self._in_io(self._merge_files, ts_files, output_path)
+        print(f"✅ 合并完成: {output_path}")
+        return str(output_path), None
+
+    async def _download_segments(self, session, segments, base_uri, open_writer, progress_callback,
+                                 file_slots=None):
+        """
+        按序创建切片任务，同时在途的任务数不超过 max_concurrency (信号量构成滑动窗口，限制重排缓冲的跨度)
+        :param file_slots: 限制同时存在的写入器数量的信号量 (写入器各占用一个打开的文件时使用)
+        :return: 失败的切片序号列表
+        """
+        total = len(segments)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = set()
+        failed = []
+        completed = 0
+
+        async def download(idx, segment, init_section):
+            nonlocal completed
+            try:
+                await self._download_segment(session, segment, base_uri, idx, open_writer, file_slots, init_section)
+            except Exception as e:
+                print(f"\n切片 {idx} 处理失败: {e}")
+                failed.append(idx)
+            finally:
+                semaphore.release()
+            completed += 1
+            await self._notify(progress_callback, completed, total)
+            print(f"\r进度: {completed}/{total} | 成功: {completed - len(failed)}", end="", flush=True)
+
+        try:
+            previous = None
+            for idx, segment in enumerate(segments):
+                # 初始化段 (EXT-X-MAP) 变化处的切片先写入初始化段
+                init_section = segment.init_section
+                head = init_section if init_section is not None and init_section != previous else None
+                previous = init_section
+                await semaphore.acquire()
+                task = asyncio.create_task(download(idx, segment, head))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        print("")  # 换行
+        return sorted(failed)
+
+    async def _download_segment(self, session, segment, base_uri, idx, open_writer, file_slots=None,
+                                init_section=None):
+        """
+        流式下载 -> 增量解密 -> 写入合并器或临时文件 (在写入线程中)，失败时指数退避重试
+        :param init_section: 需要写在切片数据之前的 InitSection
+        """
+        url = urljoin(base_uri, segment.uri)
+        span = parse_byterange(segment.byterange)
+        headers = {"Range": range_header(*span)} if span else None
+        for attempt in range(1, self.RETRIES + 1):
+            sink = None
+            slot = False
+            try:
+                async with session.get(url, headers=headers) as response:
+                    response.raise_for_status()
+                    decryptor = self._create_decryptor(segment, base_uri, idx)
+                    chunks = response.content.iter_chunked(self.CHUNK_SIZE)
+                    if span:
+                        chunks = self._iter_range(response, chunks, *span)
+                    if file_slots:
+                        await file_slots.acquire()
+                        slot = True
+                    sink = _SegmentSink(open_writer, idx)
+                    # 攒够 WRITE_BYTES 再交给写入线程，不超过该大小的切片只需切换一次线程
+                    pending = bytearray()
+                    if init_section is not None:
+                        pending += await self._init_section_data(session, init_section, segment, idx)
+                    async for chunk in chunks:
+                        pending += decryptor.update(chunk) if decryptor else chunk
+                        if len(pending) > self.WRITE_BYTES:
+                            data, pending = pending, bytearray()
+                            await self._in_io(sink.write, data)
+                    if decryptor:
+                        pending += decryptor.finalize()
+                await self._in_io(sink.write, pending, True)
+                return
+            except BaseException as e:
+                if sink is not None:
+                    # 排在已提交的写入之后执行，取消时也不会留下打开的文件
+                    await self._in_io(sink.abort)
+                if not isinstance(e, Exception) or attempt == self.RETRIES:
+                    raise
+                await asyncio.sleep(min(10, 2 ** attempt))
+            finally:
+                if slot:
+                    file_slots.release()
+
+    async def _init_section_data(self, session, init_section, segment, idx):
+        """初始化段每个只下载一次，其余切片等待同一个结果；EXT-X-MAP 之前有 AES-128 密钥时解密"""
+        async with self._init_lock:
+            data = self._init_sections.get(init_section)
+            if data is not None:
+                return data
+            span = parse_byterange(init_section.byterange)
+            headers = {"Range": range_header(*span)} if span else None
+            async with session.get(init_section.absolute_uri, headers=headers) as response:
+                response.raise_for_status()
+                chunks = response.content.iter_chunked(self.CHUNK_SIZE)
+                if span:
+                    chunks = self._iter_range(response, chunks, *span)
+                data = b"".join([chunk async for chunk in chunks])
+            key_uri = KeyManager.resolve_key(init_section.key, init_section.base_uri)
+            if key_uri:
+                iv = bytes.fromhex(init_section.key.iv.replace("0x", "")) if init_section.key.iv else None
+                sequence = getattr(segment, "media_sequence", None)
+                data = Decrypter.decrypt_aes_128(
+                    data, self._keys[key_uri], iv, sequence=idx if sequence is None else sequence
+                )
+            self._init_sections[init_section] = data
+            return data
+
+    async def _in_io(self, func, *args):
+        """在写入线程中执行文件操作；操作按提交顺序执行，同一切片的写入不会乱序"""
+        return await asyncio.get_running_loop().run_in_executor(self._io, func, *args)
+
+    def _open_file_limit(self):
+        """concat 模式同时写入的切片文件数: 不超过 MAX_OPEN_FILES，也不超过文件描述符上限扣除连接后剩下的部分"""
+        if resource is None:
+            return self.MAX_OPEN_FILES
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft == resource.RLIM_INFINITY:
+            return self.MAX_OPEN_FILES
+        return max(8, min(self.MAX_OPEN_FILES, soft - self.max_concurrency - self.RESERVED_FDS))
+
+    @staticmethod
+    async def _iter_range(response, chunks, offset, length):
+        """
+        Range 请求的响应体恰好取 length 个字节
+        服务器忽略 Range 返回 200 时跳过前 offset 个字节；返回的范围与请求不一致时抛出 ValueError
+        """
+        skip = range_skip(response.status, response.headers, offset)
+        remaining = length
+        async for chunk in chunks:
+            if skip:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk = chunk[skip:]
+                skip = 0
+            if len(chunk) >= remaining:
+                yield chunk[:remaining]
+                return
+            remaining -= len(chunk)
+            yield chunk
+        raise IncompleteBody(f"响应体不完整: 还差 {remaining} 字节")
+
+    async def _load_playlist(self, session, url):
+        print(f"解析 m3u8: {url}")
+        playlist = Playlist(await self._get_text(session, url), uri=url)
+        if not playlist.is_variant:
+            return playlist, url
+        print("检测到多级播放列表，按策略选择子流...")
+        variant = self.variant_selector.candidates(playlist, url)[0]
+        print(f"选择流: {variant.stream.uri} ({variant.label})")
+        print(f"子列表完整 URL: {variant.url}")
+        return Playlist(await self._get_text(session, variant.url), uri=variant.url), variant.url
+
+    async def _fetch_keys(self, session, keys, base_uri):
+        """并发获取列表中的所有解密密钥，每个 URI 只请求一次"""
+        uris = list(dict.fromkeys(uri for uri in (KeyManager.resolve_key(key, base_uri) for key in keys) if uri))
+        if not uris:
+            return
+        print(f"获取 {len(uris)} 个解密密钥...")
+
+        async def fetch(uri):
+            for attempt in range(1, self.RETRIES + 1):
+                try:
+                    async with session.get(uri) as response:
+                        response.raise_for_status()
+                        self._keys[uri] = await response.read()
+                        return
+                except Exception:
+                    if attempt == self.RETRIES:
+                        raise
+                    await asyncio.sleep(min(10, 2 ** attempt))
+
+        await asyncio.gather(*(fetch(uri) for uri in uris))
+
+    def _create_decryptor(self, segment, base_uri, idx):
+        key_uri = KeyManager.key_uri(segment, base_uri)
+        if not key_uri:
+            return None
+        iv = bytes.fromhex(segment.key.iv.replace("0x", "")) if segment.key.iv else None
+        # 没有 IV 时按 HLS 规范使用切片的媒体序列号
+        sequence = getattr(segment, "media_sequence", None)
+        return Decrypter.stream_aes_128(self._keys[key_uri], iv, sequence=idx if sequence is None else sequence)
+
+    @staticmethod
+    async def _get_text(session, url):
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=15)) as response:
+            response.raise_for_status()
+            return await response.text()
+
+    @staticmethod
+    async def _notify(callback, current, total):
+        if callback is None:
+            return
+        result = callback(current, total)
+        if inspect.isawaitable(result):
+            await result
+
+    def _output_path(self):
+        return self.download_dir / generate_filename(title=self.output_filename, ext=".mp4")
+
+    @staticmethod
+    def _discard_output(merger, part_path):
+        merger.close()
+        part_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _merge_files(ts_files, output_path):
+        with open(output_path, 'wb') as outfile:
+            for ts_path in ts_files:
+                with open(ts_path, 'rb') as infile:
+                    shutil.copyfileobj(infile, outfile)
@@ -0,0 +1,159 @@
+import atexit
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+from core.profiling import span
+
+USER_AGENT = ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) "
+              "Chrome/120.0.0.0 Safari/537.36")
+
+_driver_path = None
+_driver_lock = threading.Lock()
+
+
+def chromedriver_path():
+    """ChromeDriverManager().install() 每次都要检查版本 (可能联网)，进程内只做一次"""
+    global _driver_path
+    with _driver_lock:
+        if _driver_path is None:
+            _driver_path = ChromeDriverManager().install()
+        return _driver_path
+
+
+class BrowserPool:
+    """
+    复用的无头 Chrome 池
+    - 浏览器在第一次使用时启动，用完回到池中，之后的网页直接复用，省去每个网页数秒的浏览器启动
+    - 每个浏览器打开 max_pages 个网页后关闭重开；使用中出现 WebDriver 错误 (崩溃、会话失效) 时直接丢弃
+    - 同时打开的浏览器不超过 size 个，池满时等待其他网页用完
+    - 开启 Chrome 性能日志 (goog:loggingPrefs)，WebExtractor 据此监听网页发出的网络请求
+    """
+
+    def __init__(self, size=2, max_pages=50, headless=True):
+        """
+        :param size: 最多同时打开的浏览器数
+        :param max_pages: 每个浏览器打开多少个网页后重启，避免长时间运行后内存膨胀
+        :param headless: 无头模式
+        """
+        self.size = size
+        self.max_pages = max_pages
+        self.headless = headless
+        self.launched = 0   # 启动过的浏览器数
+        self.reused = 0     # 复用已启动浏览器的次数
+        self._idle = []     # [(driver, 已打开的网页数)]
+        self._alive = 0     # 已启动 (含正在使用) 的浏览器数
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def browser(self):
+        """借出一个浏览器；出现 WebDriver 错误时该浏览器被丢弃，其他异常不影响复用"""
+        driver, pages = self._acquire()
+        healthy = True
+        try:
+            yield driver
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            self._release(driver, pages + 1, healthy)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._alive -= len(idle)
+            self._cond.notify_all()
+        for driver, _ in idle:
+            self._quit(driver)
+
+    def _acquire(self):
+        while True:
+            with self._cond:
+                while not self._idle and self._alive >= self.size and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    raise RuntimeError("浏览器池已关闭")
+                if self._idle:
+                    driver, pages = self._idle.pop()
+                else:
+                    driver, pages = None, 0
+                    self._alive += 1
+            if driver is None:
+                try:
+                    with span("启动浏览器"):
+                        driver = webdriver.Chrome(service=Service(chromedriver_path()), options=self._options())
+                except BaseException:
+                    self._discard(None)
+                    raise
+                self.launched += 1
+                return driver, 0
+            # 闲置期间浏览器可能已经退出
+            try:
+                driver.current_url
+            except WebDriverException:
+                self._discard(driver)
+                continue
+            self.reused += 1
+            return driver, pages
+
+    def _release(self, driver, pages, healthy):
+        if healthy and pages < self.max_pages and not self._closed:
+            try:
+                driver.get("about:blank")  # 停止上一个网页的脚本和媒体请求
+            except WebDriverException:
+                pass
+            else:
+                with self._cond:
+                    if not self._closed:
+                        self._idle.append((driver, pages))
+                        self._cond.notify()
+                        return
+        self._discard(driver)
+
+    def _discard(self, driver):
+        with self._cond:
+            self._alive -= 1
+            self._cond.notify()
+        if driver is not None:
+            self._quit(driver)
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _options(self):
+        options = Options()
+        if self.headless:
+            options.add_argument("--headless")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        options.add_argument("--mute-audio")
+        options.add_argument(f"user-agent={USER_AGENT}")
+        # DOMContentLoaded 后即返回，之后由网络日志判断 m3u8 是否已经出现
+        options.page_load_strategy = "eager"
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        return options
+
+
+_default = {}
+_default_lock = threading.Lock()
+
+
+def default_browser_pool(headless=True):
+    """进程内共享的浏览器池 (CLI、GUI 多次运行和批量队列共用)，退出时关闭所有浏览器"""
+    with _default_lock:
+        pool = _default.get(headless)
+        if pool is None:
+            pool = _default[headless] = BrowserPool(headless=headless)
+            atexit.register(pool.close)
+        return pool
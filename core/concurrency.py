@@ -0,0 +1,183 @@
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+
+
+class HostLimiter:
+    """
+    单个主机的自适应并发控制 (AIMD)
+    - 每完成一个“窗口”(= 当前并发数) 的切片，评估一次：
+      短期延迟明显高于长期基线则乘性减小，吞吐比上个窗口明显下降则减 1，否则加 1
+    - 遇到 429 / 5xx / 超时 / 连接错误立即减半（冷却期内只减一次）
+    """
+
+    LATENCY_TOLERANCE = 2.0     # 延迟超过基线的倍数视为拥塞
+    LATENCY_BACKOFF = 0.75      # 延迟拥塞时的乘性系数
+    ERROR_BACKOFF = 0.5         # 限流/错误时的乘性系数
+    THROUGHPUT_DROP = 0.9       # 吞吐低于上个窗口的比例视为过载
+    EWMA_ALPHA = 0.3            # 短期延迟的平滑系数
+    BASELINE_ALPHA = 0.05       # 长期基线延迟的平滑系数
+
+    def __init__(self, host, initial, min_limit, max_limit):
+        self.host = host
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.peak_limit = self.limit
+        self.in_flight = 0
+        self.completed = 0
+        self.throttled = 0
+        self.total_bytes = 0
+        self.base_latency = None
+        self.latency_ewma = None
+        self._cond = threading.Condition()
+        self._last_decrease = 0.0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._window_bytes = 0
+        self._prev_throughput = None
+        self._started = time.monotonic()
+        self._limit_area = 0.0   # 并发数对时间的积分，用于计算平均并发
+        self._last_change = self._started
+
+    def acquire(self):
+        """阻塞直到该主机的在途请求数低于当前并发上限"""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, nbytes=0, error=None):
+        """
+        :param latency: 本次请求耗时 (秒)，成功时提供
+        :param nbytes: 本次下载字节数
+        :param error: 错误类型 (throttle / server / timeout / connection)，None 表示成功或无关错误
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if error:
+                self.throttled += 1
+                self._decrease(self.ERROR_BACKOFF)
+            elif latency is not None:
+                self._on_success(latency, nbytes)
+            self._cond.notify_all()
+
+    def average_limit(self):
+        with self._cond:
+            now = time.monotonic()
+            area = self._limit_area + self.limit * (now - self._last_change)
+            elapsed = now - self._started
+            return area / elapsed if elapsed > 0 else self.limit
+
+    def _on_success(self, latency, nbytes):
+        self.completed += 1
+        self.total_bytes += nbytes
+        self._window_count += 1
+        self._window_bytes += nbytes
+
+        self.latency_ewma = latency if self.latency_ewma is None else (
+            self.EWMA_ALPHA * latency + (1 - self.EWMA_ALPHA) * self.latency_ewma
+        )
+        self.base_latency = latency if self.base_latency is None else (
+            self.BASELINE_ALPHA * latency + (1 - self.BASELINE_ALPHA) * self.base_latency
+        )
+
+        if self._window_count < int(self.limit):
+            return
+
+        now = time.monotonic()
+        throughput = self._window_bytes / max(now - self._window_start, 1e-6)
+        if self.latency_ewma > self.base_latency * self.LATENCY_TOLERANCE:
+            self._decrease(self.LATENCY_BACKOFF)
+        elif self._prev_throughput and throughput < self._prev_throughput * self.THROUGHPUT_DROP:
+            self._set_limit(self.limit - 1)
+        else:
+            self._set_limit(self.limit + 1)
+
+        self._prev_throughput = throughput
+        self._window_start = now
+        self._window_count = 0
+        self._window_bytes = 0
+
+    def _decrease(self, factor):
+        now = time.monotonic()
+        cooldown = self.latency_ewma or 1.0
+        if now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+        self._set_limit(self.limit * factor)
+
+    def _set_limit(self, value):
+        now = time.monotonic()
+        self._limit_area += self.limit * (now - self._last_change)
+        self._last_change = now
+        self.limit = float(max(self.min_limit, min(value, self.max_limit)))
+        self.peak_limit = max(self.peak_limit, self.limit)
+
+
+class AdaptiveConcurrency:
+    """按主机管理 HostLimiter，线程池大小取 max_workers，实际在途请求数由各主机的控制器决定"""
+
+    def __init__(self, min_workers=2, max_workers=32, initial_workers=10):
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.initial_workers = initial_workers
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = HostLimiter(host, self.initial_workers, self.min_workers, self.max_workers)
+            return self._limiters[host]
+
+    @contextmanager
+    def slot(self, url):
+        """
+        占用一个在途请求名额，退出时根据耗时/字节数/异常调整该主机的并发数
+        用法: with concurrency.slot(url) as slot: ...; slot["bytes"] = len(content)
+        """
+        limiter = self.limiter(url)
+        limiter.acquire()
+        slot = {"bytes": 0}
+        start = time.monotonic()
+        try:
+            yield slot
+        except Exception as e:
+            limiter.release(error=self.classify_error(e))
+            raise
+        limiter.release(latency=time.monotonic() - start, nbytes=slot["bytes"])
+
+    @staticmethod
+    def classify_error(error):
+        """把异常归类为需要降速的信号，其余错误 (如 404) 返回 None"""
+        if isinstance(error, requests.exceptions.Timeout):
+            return "timeout"
+        if isinstance(error, requests.exceptions.ConnectionError):
+            return "connection"
+        status = getattr(getattr(error, "response", None), "status_code", None)
+        if status == 429:
+            return "throttle"
+        if status is not None and status >= 500:
+            return "server"
+        return None
+
+    def report(self):
+        """各主机最终稳定的并发数等统计"""
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {
+            l.host: {
+                "settled": int(l.limit),
+                "average": round(l.average_limit(), 1),
+                "peak": int(l.peak_limit),
+                "throttled": l.throttled,
+                "completed": l.completed,
+                "latency": round(l.latency_ewma, 3) if l.latency_ewma is not None else None,
+            }
+            for l in limiters
+        }
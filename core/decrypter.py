@@ -1,18 +1,94 @@
-from Crypto.Cipher import AES
+def _aes():
+    # pycryptodome 只有加密的列表才需要，第一次解密时再加载
+    from Crypto.Cipher import AES
+    return AES
+
+
+def strip_padding(data):
+    """去除 PKCS#7 填充 (HLS AES-128 切片按 PKCS#7 填充)，填充不合法时原样返回"""
+    if not data:
+        return data
+    n = data[-1]
+    if 1 <= n <= 16 and len(data) >= n and data[-n:] == bytes([n]) * n:
+        return data[:-n]
+    return data
+
 
 class Decrypter:
     @staticmethod
-    def decrypt_aes_128(content, key, iv=None):
+    def decrypt_aes_128(content, key, iv=None, sequence=None):
         """
         AES-128-CBC 解密
         :param content: 密文
         :param key: 密钥 (bytes)
         :param iv: 初始化向量 (bytes), 可选
-        :return: 明文
+        :param sequence: 切片的媒体序列号，未提供 iv 时用于生成 IV
+        :return: 明文 (已去除 PKCS#7 填充)
         """
         if not iv:
-             # 如果没有提供 IV，使用全 0 填充 (视具体实现而定，有时需要从序列号生成)
-             iv = b'\x00' * 16 
+            iv = Decrypter.iv_from_sequence(sequence or 0)
+
+        aes = _aes()
+        cipher = aes.new(key, aes.MODE_CBC, iv)
+        return strip_padding(cipher.decrypt(content))
+
+    @staticmethod
+    def iv_from_sequence(sequence):
+        """HLS 规范: EXT-X-KEY 未指定 IV 时，IV 为媒体序列号的 16 字节大端表示"""
+        return sequence.to_bytes(16, 'big')
+
+    @staticmethod
+    def stream_aes_128(key, iv=None, sequence=None):
+        """创建增量解密器，参数含义同 decrypt_aes_128"""
+        if not iv:
+            iv = Decrypter.iv_from_sequence(sequence or 0)
+        return StreamDecrypter(key, iv)
 
-        cipher = AES.new(key, AES.MODE_CBC, iv)
-        return cipher.decrypt(content)
+
+class StreamDecrypter:
+    """
+    增量 AES-128-CBC 解密
+    按 16 字节块处理任意大小的数据片段，不足一块的尾部留到下一次；
+    cipher 对象在多次调用之间保持 CBC 链 (上一块密文即下一块的 IV)，
+    输出写入可复用的缓冲区，避免每个切片分配完整大小的明文副本。
+    最后一个明文块总是留到下一次调用或 finalize()，以便去除 PKCS#7 填充。
+    """
+
+    BLOCK_SIZE = 16
+
+    def __init__(self, key, iv, buffer_size=64 * 1024):
+        aes = _aes()
+        self._cipher = aes.new(key, aes.MODE_CBC, iv)
+        self._tail = b''
+        self._held = b''
+        self._out = bytearray(buffer_size + self.BLOCK_SIZE)
+
+    def update(self, chunk):
+        """
+        解密一段密文
+        :return: 明文 memoryview，指向内部缓冲区，下一次调用前有效
+        """
+        data = self._tail + chunk if self._tail else chunk
+        usable = len(data) - len(data) % self.BLOCK_SIZE
+        self._tail = bytes(data[usable:])
+        if not usable:
+            return memoryview(b'')
+        held = len(self._held)
+        end = held + usable
+        if end > len(self._out):
+            self._out = bytearray(end)
+        out = memoryview(self._out)
+        out[:held] = self._held
+        self._cipher.decrypt(memoryview(data)[:usable], output=out[held:end])
+        self._held = bytes(out[end - self.BLOCK_SIZE:end])
+        return out[:end - self.BLOCK_SIZE]
+
+    def finalize(self):
+        """
+        结束解密，返回去除填充后的最后一块明文
+        密文长度不是 16 的整数倍时与 decrypt_aes_128 一样报错
+        """
+        if self._tail:
+            raise ValueError("Data must be padded to 16 byte boundary in CBC mode")
+        held, self._held = self._held, b''
+        return memoryview(strip_padding(held))
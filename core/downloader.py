@@ -1,173 +1,1023 @@
-import m3u8
-import requests
+import queue
+import shutil
+import tempfile
+import threading
+import time
 import concurrent.futures
 from urllib.parse import urljoin
 from pathlib import Path
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from core.utils import HEADERS, get_download_dir, create_temp_dir, clean_dir, generate_filename
+from tenacity import (
+    retry, stop_after_attempt, wait_exponential, retry_if_exception_type, retry_if_not_exception_type
+)
+from core.utils import get_download_dir, create_temp_dir, clean_dir, generate_filename
 from core.decrypter import Decrypter
+from core.merger import StreamingMerger, TempSegmentWriter, SegmentSuperseded
+from core.manifest import JobManifest
+from core.concurrency import AdaptiveConcurrency
+from core.keys import KeyManager
+from core.remuxer import FFmpegRemuxer
+from core.live import LivePlaylistFeed
+from core.hedging import HedgePolicy, SegmentAttempt, SegmentCancelled
+from core.mirrors import MirrorSet
+from core.variants import VariantSelector
+from core.transport import default_transport
+from core.segment_cache import SegmentCache, CacheCorrupted
+from core.playlist import Playlist
+from core.telemetry import new_trace
+from core.profiling import span
+from core.ranges import (
+    ChunkReader, SegmentGroup, coalesce_jobs, iter_range, parse_byterange, range_header, split_range
+)
+
+_END_OF_JOBS = object()
+_BACKOFF = wait_exponential(multiplier=1, min=2, max=10)
+
+
+def _segment_retry_wait(retry_state):
+    """还有其他可用切片源时立即换源重试，否则指数退避"""
+    mirrors = retry_state.args[0].mirrors
+    if mirrors is not None and len(mirrors) > 1 and mirrors.has_healthy():
+        return 0
+    return _BACKOFF(retry_state)
+
 
 class M3U8Downloader:
-    def __init__(self, url, output_dir=None, output_filename=None, max_workers=10):
+    WINDOW_FACTOR = 2  # 滑动窗口大小 = 线程数 * WINDOW_FACTOR
+    CHUNK_SIZE = 64 * 1024  # 流式读取切片的块大小
+    IDLE_WAIT = 0.5  # 直播模式等待新切片时的检查间隔 (秒)
+    COALESCE_BYTES = 4 * 1024 * 1024  # 字节范围相接的相邻切片合并为一个请求的大小上限
+    SPLIT_BYTES = 16 * 1024 * 1024    # 超过该大小的切片拆成多个并行 Range 请求
+    SPLIT_PARTS = 4
+    SPOOL_BYTES = 1024 * 1024         # 并行下载的分段超过该大小时写入临时文件 (远小于分段大小，在途分段不占用内存)
+    LAYOUT_PREFIX = 8  # 判断冗余子流时比较时长的开头切片数
+
+    def __init__(self, url, output_dir=None, output_filename=None, max_workers=32, min_workers=2,
+                 merge_mode="stream", max_buffer_mb=64, resume=False, remux=None, live=False,
+                 live_duration=None, hedge_percentile=95, mirrors=None, discover_mirrors=True,
+                 max_height=None, codec=None, max_bandwidth=None, deadline=None,
+                 pool=None, concurrency=None, bandwidth=None, priority=0, transport=None, http2=False,
+                 segment_cache=None, telemetry=None):
+        """
+        :param max_workers: 每个主机的并发上限（同时也是线程池大小）
+        :param min_workers: 每个主机的并发下限，实际并发数在上下限之间根据延迟/吞吐/限流自适应调整
+        :param merge_mode: 合并方式
+            - stream: 边下载边按序写入输出文件（默认）
+            - concat: 先把所有切片写入临时目录，下载完成后再拼接
+        :param max_buffer_mb: stream 模式下乱序切片的内存缓冲上限 (MB)，超出部分溢写到临时目录
+        :param resume: 若输出目录中有同一播放列表未完成的任务清单，只补齐缺失或校验失败的切片
+        :param remux: 通过 ffmpeg 实时封装的格式 (mp4 / fmp4)，None 表示直接拼接 TS；
+                      未安装 ffmpeg 时自动回退为 TS 拼接
+        :param live: 直播 / EVENT 列表录制模式，持续刷新媒体列表直到 EXT-X-ENDLIST
+        :param live_duration: 直播模式的最长录制时长 (秒)，None 表示不限
+        :param hedge_percentile: 切片耗时超过已完成切片该分位数时发出对冲请求，先完成者胜出；0 表示关闭
+        :param mirrors: 同一媒体列表在其他主机 (CDN) 上的 URL 列表，切片按各源实测吞吐分摊，出错的源自动切走
+        :param discover_mirrors: 是否把主列表中与所选子流属性相同、切片布局一致的冗余子流也作为镜像
+        :param max_height: 多码率列表的目标分辨率 (高度)，选不超过该高度的最高子流
+        :param codec: 只选 CODECS 以此开头的子流，如 avc1 / hvc1
+        :param max_bandwidth: 子流声明带宽上限 (bps)
+        :param deadline: 期望在多少秒内下载完成；会先探测各子流的实际下载速度，选能按时完成的最高码率，
+                         下载中预计超时时在切片边界切换到更低码率
+        :param pool: 多个任务共享的 SegmentPool，None 表示使用本任务私有的线程池
+        :param concurrency: 多个任务共享的 AdaptiveConcurrency，使同一主机的并发上限对所有任务生效
+        :param bandwidth: 共享的 BandwidthLimiter (令牌桶)，限制总下载速度
+        :param priority: 在共享线程池中的优先级，数值大者优先
+        :param transport: 共享的 Transport，None 表示使用进程内默认的连接池 (与 URL 校验共用，复用连接和已取到的列表)
+        :param http2: 默认连接池使用 HTTP/2 (需要 httpx[http2])
+        :param segment_cache: SegmentCache，下载切片前先查磁盘缓存，下载到的切片也写入缓存；None 表示不使用
+        :param telemetry: Telemetry，记录每个切片各阶段的耗时、字节数、重试与错误；多个任务可共享
+        """
         self.url = url
         self.max_workers = max_workers
+        self.pool = pool
+        self.priority = priority
+        self.bandwidth = bandwidth
+        self.shared_concurrency = concurrency is not None
+        self.concurrency = concurrency or AdaptiveConcurrency(
+            min_workers=min_workers, max_workers=max_workers, initial_workers=min(10, max_workers)
+        )
         self.download_dir = get_download_dir(custom_path=output_dir)
         self.output_filename = output_filename
-        self.key_cache = {}
+        self.merge_mode = merge_mode
+        self.max_buffer_bytes = int(max_buffer_mb * 1024 * 1024)
+        self.resume = resume
+        self.remux = remux
+        if remux and not FFmpegRemuxer.available():
+            print("⚠️  未找到 ffmpeg，无法实时封装为 MP4，回退为 TS 直接拼接")
+            self.remux = None
+        self.live = live
+        self.live_duration = live_duration
+        if live and resume:
+            print("⚠️  直播切片会过期，直播模式不支持断点续传")
+            self.resume = False
+        self.hedging = HedgePolicy(percentile=hedge_percentile, max_in_flight=max(2, max_workers // 4))
+        # 连接池容量覆盖普通切片和对冲请求，避免超出后新建的连接用完即丢
+        self.transport = transport or default_transport(
+            pool_size=max_workers + self.hedging.max_in_flight, http2=http2
+        )
+        self.key_manager = KeyManager(transport=self.transport)
+        self.segment_cache = segment_cache
+        self.telemetry = telemetry
+        self._job_id = None
+        self.mirror_urls = list(mirrors or [])
+        self.discover_mirrors = discover_mirrors
+        self.mirrors = None
+        self._redundant_variants = []  # _load_playlist 发现的冗余子流 [(url, playlist)]
+        self.variant_selector = VariantSelector(
+            max_height=max_height, codec=codec, max_bandwidth=max_bandwidth, deadline=None if live else deadline
+        )
+        self._job_started = None
+        self._switches = []  # 续传时恢复的中途子流切换 [(起始切片序号, 切片列表, 媒体列表 URL)]
+        self._range_pool = None
+        self._range_lock = threading.Lock()
+        self._init_at = set()       # 需要先写入初始化段 (EXT-X-MAP) 的切片序号
+        self._init_sections = {}    # InitSection -> 解密后的内容，每个初始化段只下载一次
+        self._init_lock = threading.Lock()
 
     def run(self, progress_callback=None):
         """
         执行下载流程
         :param progress_callback: 回调函数，接收 (current, total) 参数
         """
-        temp_dir = create_temp_dir(self.download_dir)
+        manifest = JobManifest.for_job(self.download_dir, self.url)
+        if self.resume and manifest.load() and manifest.has_progress():
+            print(f"🔁 发现未完成的任务，继续下载 (已完成 {manifest.completed_count()}/{manifest.total} 个切片)")
+        else:
+            self._discard_job(manifest)
+
+        temp_dir = create_temp_dir(self.download_dir, name=f"temp_{manifest.job_id}")
+        finished = False
+        result = (None, None)
+        self._job_id = manifest.job_id
+        self._job_started = time.monotonic()
         try:
-            # 1. 解析 m3u8
-            playlist, base_uri = self._load_playlist(self.url)
-            
-            # 2. 下载切片
-            print(f"找到 {len(playlist.segments)} 个切片，开始下载...")
-            ts_files = self._download_segments(playlist.segments, base_uri, temp_dir, progress_callback)
-            
-            # 3. 合并文件
-            if ts_files:
-                output_path = self._merge_files(ts_files)
-                print(f"✅ 合并完成: {output_path}")
-                return str(output_path), None
+            # 1. 解析 m3u8 (续传时直接使用上次选定的子流)
+            with span("解析播放列表"):
+                playlist, base_uri = self._load_playlist(manifest.variant_url or self.url)
+                total = len(playlist.segments)
+                switches = self._load_switches(manifest.switches, total) if manifest.switches else []
+            if not self.live and not playlist.is_endlist:
+                print("⚠️  播放列表没有 EXT-X-ENDLIST，可能是直播，只会下载当前列出的切片 (使用 --live 持续录制)")
+            if self.remux and playlist.has_init_section:
+                print("⚠️  切片是带初始化段的 fMP4 (EXT-X-MAP)，拼接结果已是 MP4，不再通过 ffmpeg 封装")
+                self.remux = None
+            if manifest.total not in (None, total) or switches is None:
+                print("⚠️  播放列表与任务清单不一致，重新开始下载")
+                self._discard_job(manifest)
+                temp_dir = create_temp_dir(self.download_dir, name=f"temp_{manifest.job_id}")
+                switches = []
+            self._switches = switches
+            with span("准备切片源"):
+                self._setup_mirrors(playlist, base_uri)
+            manifest.variant_url = base_uri
+            manifest.total = total
+            manifest.output_name = manifest.output_name or self._output_path().name
+            manifest.save(force=True)
+            with span("预取密钥"):
+                self.key_manager.prefetch_keys(playlist.keys, base_uri)
+            if self.telemetry:
+                self.telemetry.job_started(self._job_id, base_uri, total, done=manifest.completed_count())
+
+            # 2. 下载切片 + 3. 合并文件
+            print(f"找到 {total} 个切片，开始下载...")
+            if self.live:
+                result = self._run_live(playlist, base_uri, temp_dir, manifest, progress_callback)
+            elif self.merge_mode == "stream":
+                result = self._run_streaming(playlist, base_uri, temp_dir, manifest, progress_callback)
             else:
-                msg = "❌ 没有下载到任何切片，可能是视频源不可用或解密失败"
-                print(msg)
-                return None, msg
-                
+                result = self._run_concat(playlist, base_uri, temp_dir, manifest, progress_callback)
+            finished = result[0] is not None
+            return result
+
         except Exception as e:
             msg = f"下载过程出错: {str(e)}"
             print(f"\n❌ {msg}")
+            result = (None, msg)
+            return result
+        finally:
+            if self.telemetry:
+                self.telemetry.job_finished(self._job_id, *result)
+            self.key_manager.close()
+            if self._range_pool:
+                self._range_pool.shutdown(wait=False, cancel_futures=True)
+                self._range_pool = None
+            if finished or not manifest.has_progress():
+                clean_dir(temp_dir)
+                manifest.delete()
+            else:
+                manifest.save(force=True)
+                print(f"💾 下载进度已保存: {manifest.path}，使用 --resume 可继续下载")
+
+    def _run_concat(self, playlist, base_uri, temp_dir, manifest, progress_callback=None):
+        """先把切片全部写入临时目录，下载完成后统一拼接"""
+        total = len(playlist.segments)
+        ts_files = {
+            idx: Path(info["path"]) for idx, info in manifest.segments.items()
+            if info["status"] == "done" and self._segment_file_valid(info)
+        }
+        if ts_files:
+            print(f"跳过 {len(ts_files)} 个已下载的切片")
+        jobs = coalesce_jobs(self._segment_jobs(playlist, skip=ts_files, manifest=manifest), self.COALESCE_BYTES)
+
+        with span("下载切片"):
+            downloaded, failed = self._download_segments(
+                jobs, total, base_uri, temp_dir, progress_callback, manifest=manifest, done_count=len(ts_files)
+            )
+        ts_files.update(downloaded)
+
+        if failed:
+            msg = f"❌ 有 {len(failed)} 个切片下载失败"
+            print(msg)
             return None, msg
+        if not ts_files:
+            msg = "❌ 没有下载到任何切片，可能是视频源不可用或解密失败"
+            print(msg)
+            return None, msg
+
+        with span("合并切片"):
+            output_path = self._merge_files([ts_files[idx] for idx in sorted(ts_files)], manifest.output_name)
+        print(f"✅ 合并完成: {output_path}")
+        return str(output_path), None
+
+    def _run_streaming(self, playlist, base_uri, temp_dir, manifest, progress_callback=None):
+        """边下载边合并：切片按序直接追加到输出文件"""
+        total = len(playlist.segments)
+        output_path = self.download_dir / manifest.output_name
+        part_path = output_path.with_name(output_path.name + ".part")
+
+        start, resume_bytes = manifest.merged, manifest.merged_bytes
+        if start and self.remux:
+            print("⚠️  实时封装的输出无法续写，从第一个切片重新合并")
+            start, resume_bytes = 0, 0
+            manifest.mark_merged(0, 0)
+        elif start and (not part_path.exists() or part_path.stat().st_size < resume_bytes):
+            print("⚠️  未找到完整的已合并数据，从第一个切片重新合并")
+            start, resume_bytes = 0, 0
+            manifest.mark_merged(0, 0)
+        sink = FFmpegRemuxer(part_path, self.remux) if self.remux else None
+        merger = StreamingMerger(
+            part_path, temp_dir, max_buffer_bytes=self.max_buffer_bytes,
+            start_index=start, resume_bytes=resume_bytes, manifest=manifest, sink=sink
+        )
+
+        finished_idx = set(range(start))
+        for idx, info in manifest.segments.items():
+            if idx >= start and info["status"] == "spilled" and self._segment_file_valid(info):
+                merger.add_spilled(idx, info["path"], info["bytes"], info["sha1"])
+                finished_idx.add(idx)
+        if finished_idx:
+            print(f"跳过 {len(finished_idx)} 个已下载的切片")
+        jobs = coalesce_jobs(self._segment_jobs(playlist, skip=finished_idx, manifest=manifest), self.COALESCE_BYTES)
+
+        try:
+            # stream 模式边下载边合并，合并阶段只剩收尾 (写出缓冲、结束 ffmpeg 封装)
+            with span("下载切片"):
+                _, failed = self._download_segments(
+                    jobs, total, base_uri, temp_dir, progress_callback,
+                    merger=merger, manifest=manifest, done_count=len(finished_idx)
+                )
         finally:
-            clean_dir(temp_dir)
+            with span("合并收尾"):
+                merger.close()
+
+        if not merger.is_complete(total):
+            if merger.written_count == 0 and not failed:
+                msg = "❌ 没有下载到任何切片，可能是视频源不可用或解密失败"
+            else:
+                msg = f"❌ 有 {len(failed)} 个切片下载失败"
+            print(msg)
+            return None, msg
+
+        part_path.replace(output_path)
+        if merger.spilled_count:
+            print(f"重排缓冲区已满，{merger.spilled_count} 个乱序切片曾溢写到磁盘")
+        print(f"✅ 合并完成: {output_path}")
+        return str(output_path), None
+
+    def _run_live(self, playlist, base_uri, temp_dir, manifest, progress_callback=None):
+        """直播录制：持续刷新媒体列表，新切片边下载边追加到输出文件"""
+        output_path = self.download_dir / manifest.output_name
+        part_path = output_path.with_name(output_path.name + ".part")
+        sink = FFmpegRemuxer(part_path, self.remux) if self.remux else None
+        merger = StreamingMerger(part_path, temp_dir, max_buffer_bytes=self.max_buffer_bytes, sink=sink)
+        feed = LivePlaylistFeed(
+            base_uri, playlist, duration=self.live_duration, key_manager=self.key_manager, transport=self.transport
+        )
+
+        def jobs():
+            init_section = None
+            for job in feed.segments():
+                if job is not None:
+                    init_section = self._mark_init_section(*job, init_section)
+                yield job
+
+        print(f"🔴 开始录制 (列表刷新间隔约 {feed.target_duration} 秒)，按 Ctrl+C 停止")
+        feed.start()
+        try:
+            with span("录制"):
+                self._download_segments(
+                    coalesce_jobs(jobs(), self.COALESCE_BYTES), lambda: feed.known, base_uri, temp_dir,
+                    progress_callback, merger=merger, skip_failed=True
+                )
+        except KeyboardInterrupt:
+            print("\n⏹️  已停止录制")
+        finally:
+            feed.stop()
+            merger.close(skip_gaps=True)
+
+        if merger.written_count == 0:
+            part_path.unlink(missing_ok=True)
+            msg = "❌ 没有录制到任何切片"
+            print(msg)
+            return None, msg
+
+        part_path.replace(output_path)
+        print(f"✅ 录制完成: {output_path} (共 {merger.written_count} 个切片"
+              + (f"，错过 {feed.skipped} 个" if feed.skipped else "") + ")")
+        return str(output_path), None
+
+    def _segment_jobs(self, playlist, skip=(), manifest=None):
+        """
+        按序生成待下载的 (idx, segment)；设置了下载期限时可能在切片边界切换到更低码率的子流，
+        切换点记入任务清单，续传时在同一位置换到同一子流 (self._switches)
+        同时标记初始化段 (EXT-X-MAP) 变化处，已完成的切片 (skip) 中已经含有它们的初始化段
+        """
+        segments = playlist.segments
+        switches = list(self._switches)
+        selector = self.variant_selector
+        planned = 0  # 已提交切片的预计字节数
+        init_section = None
+        # 下载速度从第一个切片提交时算起，解析列表和探测子流的耗时只计入期限
+        started = time.monotonic()
+        for idx in range(len(segments)):
+            if switches and switches[0][0] == idx:
+                _, segments, url = switches.pop(0)
+                self.mirrors.drop_redundant()
+                self.key_manager.prefetch(segments[idx:], url)
+            if idx in skip:
+                init_section = segments[idx].init_section
+                continue
+            downloaded = self.mirrors.total_bytes
+            variant = selector.maybe_switch(
+                idx, downloaded, time.monotonic() - started, pending_bytes=max(0, planned - downloaded),
+                spent=started - self._job_started
+            )
+            if variant:
+                print(f"\n🔀 预计无法在期限内完成，从第 {idx} 个切片起切换到 {variant.label}")
+                segments = variant.playlist.segments
+                self.mirrors.drop_redundant()
+                self.key_manager.prefetch(segments[idx:], variant.url)
+                if manifest:
+                    manifest.mark_switch(idx, variant.url)
+            if selector.current is not None:
+                planned += (segments[idx].duration or 0) * selector.current.bytes_per_second
+            init_section = self._mark_init_section(idx, segments[idx], init_section)
+            yield idx, segments[idx]
+
+    def _mark_init_section(self, idx, segment, previous):
+        """
+        切片的初始化段与前一个切片不同 (第一个切片、不连续点后换了 EXT-X-MAP、切换了子流) 时，
+        记录需要在该切片的数据前写入初始化段
+        :return: 该切片的初始化段，作为下一个切片的 previous
+        """
+        init_section = segment.init_section
+        if init_section is not None and init_section != previous:
+            self._init_at.add(idx)
+        return init_section
+
+    def _load_switches(self, switches, total):
+        """
+        续传时重新加载上次运行中途切换到的子流
+        :param switches: 任务清单中的 [(起始切片序号, 媒体列表 URL)]
+        :return: [(起始切片序号, 切片列表, 媒体列表 URL)]；无法加载或切片数与任务不一致时返回 None
+        """
+        loaded = []
+        for idx, url in switches:
+            try:
+                response = self.transport.get(url, timeout=15, cache=True)
+                response.raise_for_status()
+                url = response.url or url
+                playlist = Playlist(response.text, uri=url)
+            except Exception as e:
+                print(f"⚠️  无法加载上次切换到的子流: {url} ({e})")
+                return None
+            if len(playlist.segments) != total:
+                return None
+            print(f"🔀 沿用上次的码率切换: 从第 {idx} 个切片起使用 {url}")
+            loaded.append((idx, playlist.segments, url))
+        return loaded
+
+    def _setup_mirrors(self, playlist, base_uri):
+        """以所选子流为主源，加入用户指定的镜像和发现的冗余子流"""
+        self.mirrors = MirrorSet(base_uri)
+        for url in self.mirror_urls:
+            self.mirrors.add_base(url)
+        if not self.live:
+            # 直播列表会滚动，冗余子流的切片无法与主列表按序号对应
+            for url, redundant in self._redundant_variants:
+                self.mirrors.add_redundant(url, redundant.segments)
+        if len(self.mirrors) > 1:
+            hosts = ", ".join(sorted({m.host for m in self.mirrors.mirrors}))
+            print(f"使用 {len(self.mirrors)} 个切片源: {hosts}")
+
+    def _discard_job(self, manifest):
+        """丢弃同一播放列表上次遗留的任务进度"""
+        if manifest.load() and manifest.output_name:
+            part_path = self.download_dir / (manifest.output_name + ".part")
+            part_path.unlink(missing_ok=True)
+        clean_dir(self.download_dir / f"temp_{manifest.job_id}")
+        manifest.reset()
+        manifest.delete()
+
+    @staticmethod
+    def _segment_file_valid(info):
+        """校验已落盘切片的大小与 sha1"""
+        path = Path(info["path"]) if info.get("path") else None
+        if not path or not path.exists() or path.stat().st_size != info["bytes"]:
+            return False
+        return JobManifest.file_checksum(path) == info["sha1"]
 
     def _load_playlist(self, url):
         """加载并解析 m3u8，处理多级列表"""
         print(f"解析 m3u8: {url}")
-        
-        import urllib3
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        
-        session = requests.Session()
-        session.verify = False
-        session.headers.update(HEADERS)
-        
-        response = session.get(url, timeout=15)
+
+        # URL 校验时已取到的列表直接命中缓存，上次运行缓存过的列表带条件请求；重定向后按最终地址解析相对路径
+        session = self.transport
+        response = session.get(url, timeout=15, cache=True)
         response.raise_for_status()
-        playlist = m3u8.loads(response.text, uri=url)
+        url = response.url or url
+        playlist = Playlist(response.text, uri=url)
         base_uri = url
 
         if playlist.is_variant:
-            print("检测到多级播放列表，选择最高带宽流...")
-            best_stream = max(playlist.playlists, key=lambda p: p.stream_info.bandwidth)
-            print(f"选择流: {best_stream.uri}")
-            
-            sub_url = urljoin(url, best_stream.uri)
-            print(f"子列表完整 URL: {sub_url}")
-            
-            sub_response = session.get(sub_url, timeout=15)
-            sub_response.raise_for_status()
-            playlist = m3u8.loads(sub_response.text, uri=sub_url)
-            base_uri = sub_url
+            print("检测到多级播放列表，按策略选择子流...")
+            master = playlist
+            variant = self.variant_selector.select(master, url, session)
+            print(f"选择流: {variant.stream.uri} ({variant.label})")
+            print(f"子列表完整 URL: {variant.url}")
+            playlist = variant.playlist
+            base_uri = variant.url
+            if self.discover_mirrors:
+                self._redundant_variants = self._find_redundant_variants(session, master, variant.stream, playlist)
             
         return playlist, base_uri
 
-    def _download_segments(self, segments, base_uri, temp_dir, progress_callback=None):
-        """并发下载切片"""
-        ts_files = []
+    @classmethod
+    def _find_redundant_variants(cls, session, master, chosen, playlist):
+        """
+        查找冗余子流：与所选子流 BANDWIDTH / RESOLUTION / CODECS 相同、URI 不同，
+        且切片数、媒体序列号、开头 LAYOUT_PREFIX 个切片的时长一致的媒体列表 (通常是同一内容在其他 CDN 上的地址)
+        只比较开头几个切片，两个列表都不必整体解析 (见 SegmentList)
+        """
+        def signature(p):
+            info = p.stream_info
+            return info.bandwidth, info.resolution, info.codecs
+
+        def layout(p):
+            head = p.segments[:cls.LAYOUT_PREFIX]
+            return len(p.segments), p.media_sequence or 0, [round(seg.duration or 0, 3) for seg in head]
+
+        expected = None
+        found = []
+        seen = {chosen.absolute_uri}
+        for candidate in master.playlists:
+            if candidate is chosen or signature(candidate) != signature(chosen) or candidate.absolute_uri in seen:
+                continue
+            seen.add(candidate.absolute_uri)
+            try:
+                response = session.get(candidate.absolute_uri, timeout=15, cache=True)
+                response.raise_for_status()
+                redundant = Playlist(response.text, uri=candidate.absolute_uri)
+            except Exception as e:
+                print(f"⚠️  冗余子流不可用，忽略: {candidate.absolute_uri} ({e})")
+                continue
+            if expected is None:
+                expected = layout(playlist)
+            if layout(redundant) != expected:
+                print(f"⚠️  冗余子流切片布局不一致，忽略: {candidate.absolute_uri}")
+                continue
+            found.append((candidate.absolute_uri, redundant))
+        if found:
+            print(f"发现 {len(found)} 个冗余子流，作为镜像源")
+        return found
+
+    def _download_segments(self, jobs, total_segments, base_uri, temp_dir, progress_callback=None,
+                           merger=None, manifest=None, done_count=0, skip_failed=False):
+        """
+        并发下载切片
+        :param jobs: (idx, segment) 的可迭代对象，按滑动窗口逐步提交，在途切片数不超过 max_workers * WINDOW_FACTOR；
+                     直播模式下暂时没有新切片时生成 None
+        :param total_segments: 切片总数；直播模式下传入返回当前已知切片数的函数
+        :param merger: StreamingMerger，提供时切片直接交给合并器，不再落盘到临时目录
+        :param manifest: JobManifest，记录每个切片的完成/失败状态
+        :param done_count: 之前已完成的切片数（续传），用于进度显示
+        :param skip_failed: 失败的切片直接在合并器中跳过（直播切片过期后无法续传）
+        :return: ({idx: 临时文件路径}, [失败的 idx])
+        """
+        ts_files = {}
         failed_segments = []
-        total_segments = len(segments)
-        success_count = 0
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = [
-                executor.submit(self._process_segment, seg, base_uri, temp_dir, idx) 
-                for idx, seg in enumerate(segments)
-            ]
-            
-            for i, future in enumerate(futures):
+        success_count = done_count
+        completed = reported = done_count
+        jobs = iter(jobs)
+        exhausted = False
+        window = self.max_workers * self.WINDOW_FACTOR
+        hedging = self.hedging if self.hedging.enabled else None
+
+        if self.pool:
+            # 共享线程池: 对冲请求以更高优先级插队，不排在普通切片后面；
+            # 切片按主源的主机派发，该主机的并发名额用满时工作线程先处理其他主机的切片，而不是阻塞在这里
+            executor = hedge_executor = None
+            limiter = self.concurrency.limiter(base_uri)
+            host_limit = lambda: int(limiter.limit)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+            hedge_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.hedging.max_in_flight, thread_name_prefix="hedge"
+            ) if hedging else None
+        in_flight = {}  # future -> SegmentAttempt
+        completions = queue.SimpleQueue()  # 完成的 future，不必每次都对整个窗口调用 concurrent.futures.wait
+        attempts = {}   # idx -> [future]，同一切片的主请求与对冲请求
+        segments = {}   # idx -> segment，对冲时重新提交
+        hedged = set()  # 已发出过对冲请求的切片，每个切片最多对冲一次
+        finished = False
+
+        def submit(idx, seg, hedge=False, avoid_mirror=None):
+            attempt = SegmentAttempt(idx, hedge=hedge)
+            attempt.avoid_mirror = avoid_mirror
+            args = (self._process_segment, seg, base_uri, temp_dir, idx, merger, manifest, attempt)
+            if self.pool:
+                future = self.pool.submit(*args, priority=self.priority + (1 if hedge else 0),
+                                          key=limiter.host, limit=host_limit)
+            else:
+                future = (hedge_executor if hedge else executor).submit(*args)
+            in_flight[future] = attempt
+            attempts.setdefault(idx, []).append(future)
+            future.add_done_callback(completions.put)
+
+        def fill_window():
+            nonlocal exhausted
+            while len(attempts) < window:
+                job = next(jobs, _END_OF_JOBS)
+                if job is _END_OF_JOBS:
+                    exhausted = True
+                    return
+                if job is None:
+                    return  # 直播: 暂时没有新切片
+                idx, seg = job
+                segments[idx] = seg
+                submit(idx, seg)
+
+        def fire_hedges(total):
+            threshold = hedging.threshold(tail=exhausted and hedging.in_tail(len(attempts), total))
+            if threshold is None:
+                return
+            running = sum(1 for idx in hedged if len(attempts[idx]) > 1)
+            # attempts 按提交顺序排列，切片大致按此顺序开始: 遇到尚未超时 (或还在排队) 的切片即可停止，
+            # 不必每完成一个切片就扫描整个窗口
+            for idx, futures in attempts.items():  # 对冲只向已有切片追加 future，不改变字典的键
+                if running >= hedging.max_in_flight:
+                    return
+                if idx in hedged:
+                    continue
+                attempt = in_flight[futures[0]]
+                if attempt.started is None or attempt.elapsed <= threshold:
+                    return
+                hedged.add(idx)
+                submit(idx, segments[idx], hedge=True, avoid_mirror=attempt.mirror)
+                hedging.fired += 1
+                running += 1
+
+        try:
+            fill_window()
+            while in_flight or not exhausted:
+                if not in_flight:
+                    time.sleep(self.IDLE_WAIT)
+                    fill_window()
+                    continue
                 try:
-                    path, seg_idx = future.result()
-                    if path:
-                        ts_files.append((seg_idx, path))
-                        success_count += 1
+                    done = [completions.get(timeout=self.IDLE_WAIT)]
+                except queue.Empty:
+                    done = []
+                while not completions.empty():
+                    done.append(completions.get_nowait())
+                total = total_segments() if callable(total_segments) else total_segments
+                for future in done:
+                    if future not in in_flight:
+                        continue  # 已被对冲请求取代
+                    attempt = in_flight.pop(future)
+                    idx = attempt.idx
+                    siblings = attempts[idx]
+                    siblings.remove(future)
+                    group = segments[idx] if isinstance(segments[idx], SegmentGroup) else None
+                    indices = group.indices if group else [idx]
+                    try:
+                        result = future.result()
+                    except Exception:
+                        if siblings:
+                            continue  # 同一切片的另一请求仍在进行
+                        # 合并请求中已经完成的切片仍然有效
+                        done = group.results if group else {}
+                        for i in indices:
+                            if i in done:
+                                if merger is None:
+                                    ts_files[i] = done[i]
+                                success_count += 1
+                                continue
+                            failed_segments.append(i)
+                            if self.telemetry:
+                                self.telemetry.segment_failed(self._job_id, i)
+                            if manifest:
+                                manifest.mark_failed(i)
+                            if skip_failed and merger:
+                                merger.skip(i)
                     else:
-                        failed_segments.append(seg_idx)
-                except Exception as e:
-                    failed_segments.append(i)
-                
-                if progress_callback:
-                    progress_callback(i + 1, total_segments)
-                print(f"\r进度: {i+1}/{total_segments} | 成功: {success_count}", end="", flush=True)
-        
+                        # 先完成者胜出，取消同一切片的其他请求
+                        for other in siblings:
+                            other.cancel()
+                            in_flight.pop(other).cancel()
+                        if hedging:
+                            hedging.observe(attempt.elapsed)
+                            if attempt.hedge:
+                                hedging.won += 1
+                        if merger is None:
+                            for path, seg_idx in (result if group else [result]):
+                                ts_files[seg_idx] = path
+                        success_count += len(indices)
+                    del attempts[idx]
+                    del segments[idx]
+                    hedged.discard(idx)
+
+                    completed += len(indices)
+                if completed != reported:
+                    # 每批完成的切片汇报一次进度，而不是每个切片都打印一次
+                    reported = completed
+                    if self.telemetry:
+                        self.telemetry.progress(self._job_id, completed, total)
+                    if progress_callback:
+                        progress_callback(completed, total)
+                    print(f"\r进度: {completed}/{total} | 成功: {success_count}", end="", flush=True)
+                fill_window()
+                if hedging and hedging.ready:
+                    fire_hedges(total)
+            finished = True
+        except BaseException:
+            # 中断时取消尚未开始的切片，只等待正在下载的几个
+            for future, attempt in in_flight.items():
+                future.cancel()
+                if self.pool:
+                    attempt.cancel()  # 共享线程池不能整体关闭，让正在下载的切片尽快退出
+            raise
+        finally:
+            # 正常结束时只剩被取消的慢请求，不必等待它们退出
+            for pool in (executor, hedge_executor):
+                if pool:
+                    pool.shutdown(wait=not finished, cancel_futures=True)
+
         print("")  # 换行
-        
+
         if failed_segments:
             print(f"⚠️  有 {len(failed_segments)} 个切片下载失败")
-        
-        ts_files.sort(key=lambda x: x[0])
-        return [path for _, path in ts_files]
+        if len(self.mirrors) > 1:
+            for m in self.mirrors.report():
+                speed = f"{m['throughput_mbps']} MB/s" if m["throughput_mbps"] is not None else "-"
+                print(f"切片源 [{m['host']}]: {m['completed']} 个切片 / {m['mb']} MB, 单连接 {speed}, 失败 {m['failures']} 次")
+        if hedging and hedging.fired:
+            print(f"对冲请求: 发出 {hedging.fired} 次，先于原请求完成 {hedging.won} 次")
+        # 共享的并发控制由调度器统一汇报
+        for host, stats in ({} if self.shared_concurrency else self.concurrency.report()).items():
+            print(f"并发控制 [{host}]: 稳定在 {stats['settled']} (平均 {stats['average']}, "
+                  f"峰值 {stats['peak']}, 限流/错误 {stats['throttled']} 次)")
+        if self.segment_cache:
+            stats = self.segment_cache.report()
+            print(f"切片缓存: 命中 {stats['hits']} 个 ({stats['hit_mb']} MB)，新增 {stats['stored']} 个，"
+                  f"淘汰 {stats['evicted']} 个，占用 {stats['size_mb']} MB")
+        for host, stats in self.transport.report().items():
+            print(f"连接复用 [{host}]: {stats['requests']} 个请求，新建 {stats['connections']} 个连接"
+                  + (f"，缓存命中 {stats['cache_hits']} 次" if stats["cache_hits"] else "")
+                  + (f"，列表未变化 (304) {stats['not_modified']} 次" if stats["not_modified"] else ""))
+        if self.telemetry:
+            for host, stats in self.telemetry.snapshot()["hosts"].items():
+                if stats["segments"]:
+                    print(f"切片耗时 [{host}]: 建连 {stats['connect_ms']} / "
+                          f"首字节 {stats['ttfb_ms']} / 传输 {stats['transfer_ms']} / 解密 {stats['decrypt_ms']} / "
+                          f"写入 {stats['write_ms']} ms (平均)，错误 {stats['errors']} 次")
+
+        return ts_files, failed_segments
 
     @retry(
         stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((requests.exceptions.RequestException, Exception)),
+        wait=_segment_retry_wait,
+        retry=retry_if_exception_type(Exception) & retry_if_not_exception_type((SegmentCancelled, SegmentSuperseded)),
         reraise=True
     )
-    def _process_segment(self, segment, base_uri, temp_dir, seg_idx):
-        """处理单个切片：下载 -> 解密 -> 保存"""
+    def _process_segment(self, segment, base_uri, temp_dir, seg_idx, merger=None, manifest=None, attempt=None):
+        """
+        处理单个切片：流式下载 -> 增量解密 -> 写入合并器或临时文件，内存占用与切片大小无关
+        :param segment: 切片，或 SegmentGroup (字节范围首尾相接的相邻切片，合并为一个 Range 请求)
+        :param attempt: SegmentAttempt，对冲请求中被取消时尽快退出
+        :return: (临时文件路径, idx)，stream 模式路径为 None；SegmentGroup 返回 [(路径, idx)]
+        """
+        group = segment if isinstance(segment, SegmentGroup) else None
+        items = group.pending() if group else [(seg_idx, segment)]
+        results = group.results if group else {}
+        mirror = None
         try:
-            seg_url = urljoin(base_uri, segment.uri)
-            
-            response = requests.get(seg_url, headers=HEADERS, timeout=15, verify=False)
-            response.raise_for_status()
-            content = response.content
-            
-            if segment.key:
-                content = self._decrypt_content(content, segment, base_uri)
+            if attempt:
+                attempt.start()
+            if self.segment_cache:
+                missing = []
+                for idx, seg in items:
+                    cached = self._process_cached_segment(seg, temp_dir, idx, merger, manifest)
+                    if cached:
+                        results[idx] = cached[0]
+                    else:
+                        missing.append((idx, seg))
+                items = missing
+            if items:
+                mirror = self.mirrors.acquire(avoid=attempt.avoid_mirror if attempt else None)
+                if attempt:
+                    attempt.mirror = mirror
+                started = time.monotonic()
+                nbytes = 0
+                for url, members in self._plan_requests(mirror, items):
+                    nbytes += self._fetch(url, members, temp_dir, merger, manifest, attempt, results)
+                self.mirrors.release(mirror, nbytes, time.monotonic() - started)
+                mirror = None
+            if attempt:
+                attempt.finish()
 
-            temp_path = temp_dir / f"seg_{seg_idx:04d}.ts"
-            with open(temp_path, 'wb') as f:
-                f.write(content)
-            return temp_path, seg_idx
-            
+            if group:
+                return [(results[idx], idx) for idx in group.indices]
+            return results[seg_idx], seg_idx
+
+        except (SegmentCancelled, SegmentSuperseded):
+            if mirror:
+                self.mirrors.release(mirror)
+            raise
         except Exception as e:
-            print(f"\n切片 {seg_idx} 处理失败: {e}")
+            if mirror:
+                # 该源进入冷却期，重试会换到其他源
+                self.mirrors.release(mirror, failed=True)
+            print(f"\n切片 {seg_idx if not group else f'{group.indices[0]}-{group.indices[-1]}'} 处理失败: {e}")
             raise
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        reraise=True
-    )
-    def _decrypt_content(self, content, segment, base_uri):
-        """解密切片内容"""
-        key_uri = segment.key.uri
-        if not key_uri.startswith('http'):
-             key_uri = urljoin(base_uri, key_uri)
-        
-        if key_uri not in self.key_cache:
-            key_resp = requests.get(key_uri, headers=HEADERS, timeout=15, verify=False)
-            key_resp.raise_for_status()
-            self.key_cache[key_uri] = key_resp.content
-        
-        key = self.key_cache[key_uri]
+    def _plan_requests(self, mirror, items):
+        """
+        按所选切片源上的地址安排请求：同一资源上字节范围首尾相接的切片合并为一个请求
+        :return: [(url, [(idx, key_segment, key_uri, 偏移, 长度)])]，普通切片的偏移和长度为 None
+        """
+        plan = []
+        for idx, segment in items:
+            url, key_segment, key_base = mirror.resolve(segment, idx)
+            key_uri = self.key_manager.key_uri(key_segment, key_base)
+            offset, length = parse_byterange(key_segment.byterange) or (None, None)
+            member = (idx, key_segment, key_uri, offset, length)
+            if plan and offset is not None and plan[-1][0] == url:
+                last = plan[-1][1][-1]
+                if last[3] is not None and last[3] + last[4] == offset:
+                    plan[-1][1].append(member)
+                    continue
+            plan.append((url, [member]))
+        return plan
+
+    def _fetch(self, url, members, temp_dir, merger, manifest, attempt, results):
+        """
+        发出一个切片请求，响应体按各切片的长度依次解密写入
+        切片超过 SPLIT_BYTES 时拆成 SPLIT_PARTS 段并行 Range 请求 (普通切片需要服务器声明 Accept-Ranges)
+        :return: 写入的字节数
+        """
+        offset = members[0][3]
+        length = None if offset is None else members[-1][3] + members[-1][4] - offset
+        parts = split_range(offset, length, self.SPLIT_PARTS) if length and length > self.SPLIT_BYTES else None
+        request_range = parts[0] if parts else (offset, length) if length is not None else None
+        headers = {"Range": range_header(*request_range)} if request_range else None
+
+        nbytes = 0
+        with self.concurrency.slot(url) as slot:
+            try:
+                with self.transport.get(url, headers=headers, timeout=15, stream=True) as response:
+                    if attempt:
+                        attempt.bind(response)
+                    response.raise_for_status()
+                    if length is None:
+                        size = int(response.headers.get("Content-Length") or 0)
+                        if size > self.SPLIT_BYTES and response.headers.get("Accept-Ranges") == "bytes":
+                            parts = split_range(0, size, self.SPLIT_PARTS)
+                    if parts:
+                        body = self._iter_parts(response, url, parts)
+                    elif length is not None:
+                        body = iter_range(response, offset, length, self.CHUNK_SIZE)
+                    else:
+                        body = response.iter_content(chunk_size=self.CHUNK_SIZE)
+                    reader = ChunkReader(body)
+                    for i, (idx, key_segment, key_uri, _, seg_length) in enumerate(members):
+                        trace = new_trace(idx, url)
+                        if i == 0:
+                            # 合并请求的建连与首字节耗时记在第一个切片上
+                            trace.update(getattr(response, "timings", None) or {})
+                        writer = self._write_segment(
+                            reader.take(seg_length), url, idx, key_segment, key_uri, temp_dir, merger, manifest,
+                            attempt, trace
+                        )
+                        results[idx] = None if merger else writer.path
+                        nbytes += writer.nbytes
+                        if self.telemetry:
+                            self.telemetry.segment_done(self._job_id, trace, hedge=bool(attempt and attempt.hedge))
+            except Exception as e:
+                # 被取消的请求 (响应被关闭) 不计为错误，也不重试
+                if attempt and attempt.cancelled and not isinstance(e, SegmentCancelled):
+                    raise SegmentCancelled(str(e)) from e
+                if self.telemetry and not isinstance(e, (SegmentCancelled, SegmentSuperseded)):
+                    self.telemetry.segment_error(self._job_id, [m[0] for m in members if m[0] not in results], url, e)
+                raise
+            slot["bytes"] = nbytes
+        return nbytes
+
+    def _write_segment(self, chunks, url, idx, key_segment, key_uri, temp_dir, merger, manifest, attempt, trace):
+        """
+        把一个切片的响应数据增量解密写入合并器或临时文件，同时写入切片缓存
+        :param trace: new_trace 创建的计时记录，累加传输 (等待数据，含限速) / 解密 / 写入耗时和字节数
+        """
+        decryptor = self._create_decryptor(key_segment, key_uri, idx) if key_uri else None
+        writer = self._open_writer(idx, temp_dir, merger, manifest)
+        # 缓存保存未解密的响应内容
+        cache_writer = self.segment_cache.writer(
+            SegmentCache.make_key(url, key_segment.byterange, key_uri)
+        ) if self.segment_cache else None
+        clock = time.perf_counter
+        try:
+            self._write_init_section(writer, key_segment, idx)
+            mark = clock()
+            for chunk in chunks:
+                if attempt:
+                    attempt.check()
+                if self.bandwidth:
+                    self.bandwidth.consume(len(chunk))
+                received = clock()
+                trace["transfer"] += received - mark
+                trace["bytes"] += len(chunk)
+                if cache_writer:
+                    cache_writer.write(chunk)
+                cached = clock()
+                data = decryptor.update(chunk) if decryptor else chunk
+                decrypted = clock()
+                trace["decrypt"] += decrypted - cached
+                writer.write(data)
+                mark = clock()
+                trace["write"] += (mark - decrypted) + (cached - received)
+            if attempt:
+                # 响应被取消时关闭后读取会提前结束，不能当作完整切片提交
+                attempt.check()
+            if decryptor:
+                writer.write(decryptor.finalize())
+        except BaseException:
+            writer.abort()
+            if cache_writer:
+                cache_writer.abort()
+            raise
+        if cache_writer:
+            cache_writer.commit()
+        writer.commit()
+        return writer
+
+    def _iter_parts(self, response, url, parts):
+        """大切片: 第一段从当前响应读取，其余各段同时发出 Range 请求，按顺序生成数据块"""
+        with self._range_lock:
+            if self._range_pool is None:
+                self._range_pool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.SPLIT_PARTS * 4, thread_name_prefix="range"
+                )
+            pool = self._range_pool
+        futures = [pool.submit(self._fetch_part, url, offset, length) for offset, length in parts[1:]]
+        try:
+            yield from iter_range(response, *parts[0], self.CHUNK_SIZE)
+            if response.status_code != 206:
+                response.close()  # 普通请求只需要第一段，剩余内容不再读取
+            for future in futures:
+                part = future.result()
+                with part:
+                    part.seek(0)
+                    yield from iter(lambda: part.read(self.CHUNK_SIZE), b"")
+        finally:
+            for future in futures:
+                if not future.cancel():
+                    future.add_done_callback(lambda f: f.exception() is None and f.result().close())
+
+    def _fetch_part(self, url, offset, length):
+        """下载大切片的一段，较大时写入临时文件"""
+        part = tempfile.SpooledTemporaryFile(max_size=self.SPOOL_BYTES)
+        try:
+            with self.transport.get(url, headers={"Range": range_header(offset, length)}, timeout=15,
+                                    stream=True) as response:
+                response.raise_for_status()
+                for chunk in iter_range(response, offset, length, self.CHUNK_SIZE):
+                    part.write(chunk)
+        except BaseException:
+            part.close()
+            raise
+        return part
+
+    def _process_cached_segment(self, segment, temp_dir, seg_idx, merger=None, manifest=None):
+        """
+        按各切片源的地址查找切片缓存，命中时解密写入合并器或临时文件
+        :return: 同 _process_segment；未命中返回 None
+        """
+        for mirror in list(self.mirrors.mirrors):
+            seg_url, key_segment, key_base = mirror.resolve(segment, seg_idx)
+            key_uri = self.key_manager.key_uri(key_segment, key_base)
+            entry = self.segment_cache.open(SegmentCache.make_key(seg_url, key_segment.byterange, key_uri))
+            if entry is None:
+                continue
+            decryptor = self._create_decryptor(key_segment, key_uri, seg_idx) if key_uri else None
+            writer = self._open_writer(seg_idx, temp_dir, merger, manifest)
+            trace = new_trace(seg_idx, seg_url)
+            started = time.perf_counter()
+            try:
+                self._write_init_section(writer, key_segment, seg_idx)
+                for chunk in entry.chunks(self.CHUNK_SIZE):
+                    writer.write(decryptor.update(chunk) if decryptor else chunk)
+                if decryptor:
+                    writer.write(decryptor.finalize())
+            except CacheCorrupted as e:
+                writer.abort()
+                print(f"\n⚠️  {e}，重新下载")
+                break
+            except BaseException:
+                writer.abort()
+                raise
+            writer.commit()
+            self.segment_cache.record(hit=True, nbytes=entry.size)
+            if self.telemetry:
+                # 命中缓存的切片只记录总耗时 (读盘 + 解密 + 写入)，不计入主机统计
+                trace.update(bytes=entry.size, transfer=time.perf_counter() - started)
+                self.telemetry.segment_done(self._job_id, trace, cached=True)
+            return (None if merger else writer.path), seg_idx
+        self.segment_cache.record(hit=False)
+        return None
+
+    def _write_init_section(self, writer, segment, seg_idx):
+        """
+        初始化段变化处的切片先写入初始化段 (fMP4 的 ftyp/moov)，合并输出和 concat 模式的切片文件都带上它
+        切片缓存只保存切片本身的响应，初始化段每个任务按 (地址, 字节范围) 下载一次
+        """
+        if seg_idx not in self._init_at or segment.init_section is None:
+            return
+        init_section = segment.init_section
+        with self._init_lock:
+            data = self._init_sections.get(init_section)
+            if data is None:
+                data = self._fetch_init_section(init_section, segment, seg_idx)
+                self._init_sections[init_section] = data
+        writer.write(data)
+
+    def _fetch_init_section(self, init_section, segment, seg_idx):
+        """下载初始化段 (与字节范围切片使用同样的 Range 请求)，EXT-X-MAP 之前有 AES-128 密钥时解密"""
+        span = parse_byterange(init_section.byterange)
+        headers = {"Range": range_header(*span)} if span else None
+        with self.transport.get(init_section.absolute_uri, headers=headers, timeout=15, stream=True) as response:
+            response.raise_for_status()
+            if span:
+                chunks = iter_range(response, *span, self.CHUNK_SIZE)
+            else:
+                chunks = response.iter_content(chunk_size=self.CHUNK_SIZE)
+            data = b"".join(chunks)
+        init_key_uri = self.key_manager.resolve_key(init_section.key, init_section.base_uri)
+        if init_key_uri:
+            # 按规范此时 EXT-X-KEY 必须带 IV；缺少时与切片一样按媒体序列号推导
+            iv = bytes.fromhex(init_section.key.iv.replace("0x", "")) if init_section.key.iv else None
+            sequence = getattr(segment, "media_sequence", None)
+            data = Decrypter.decrypt_aes_128(
+                data, self.key_manager.get(init_key_uri), iv, sequence=seg_idx if sequence is None else sequence
+            )
+        return data
+
+    @staticmethod
+    def _open_writer(seg_idx, temp_dir, merger=None, manifest=None):
+        if merger:
+            return merger.open_segment(seg_idx)
+        return TempSegmentWriter(temp_dir / f"seg_{seg_idx:04d}.ts", seg_idx, manifest)
+
+    def _create_decryptor(self, segment, key_uri, seg_idx):
+        """为切片创建增量解密器"""
+        key = self.key_manager.get(key_uri)
         iv = bytes.fromhex(segment.key.iv.replace("0x", "")) if segment.key.iv else None
-        
-        return Decrypter.decrypt_aes_128(content, key, iv)
+        # 没有 IV 时按 HLS 规范使用切片的媒体序列号
+        sequence = getattr(segment, "media_sequence", None)
+        return Decrypter.stream_aes_128(key, iv, sequence=seg_idx if sequence is None else sequence)
 
-    def _merge_files(self, ts_files):
-        """合并文件"""
+    def _output_path(self):
+        """生成最终输出文件路径"""
         output_filename = generate_filename(title=self.output_filename, ext=".mp4")
-        output_path = self.download_dir / output_filename
+        return self.download_dir / output_filename
 
-        with open(output_path, 'wb') as outfile:
+    def _merge_files(self, ts_files, output_name=None):
+        """合并文件"""
+        output_path = self.download_dir / output_name if output_name else self._output_path()
+
+        outfile = FFmpegRemuxer(output_path, self.remux) if self.remux else open(output_path, 'wb')
+        try:
             for ts_path in ts_files:
                 with open(ts_path, 'rb') as infile:
-                    outfile.write(infile.read())
+                    shutil.copyfileobj(infile, outfile)
+        finally:
+            outfile.close()
         return output_path
@@ -1,37 +1,214 @@
+import html
+import json
+import os
+import threading
 import time
 import re
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from webdriver_manager.chrome import ChromeDriverManager
+from pathlib import Path
+from urllib.parse import urlparse
+import requests
+from core.profiling import span
+from core.transport import default_transport
+from core.utils import HEADERS
+
+PAGE_HEADERS = {
+    **HEADERS,
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+}
+_H1_TITLE = re.compile(r'<h1\b[^>]*\bclass=["\'][^"\']*\btitle\b[^"\']*["\'][^>]*>(.*?)</h1>', re.I | re.S)
+_TITLE = re.compile(r'<title\b[^>]*>(.*?)</title>', re.I | re.S)
+_TAG = re.compile(r'<[^>]+>')
+
+
+class TierMemory:
+    """
+    按域名记住上次在哪一层解析成功 (http: 直接请求网页 / browser: 浏览器)，ttl 内同一网站的网页直接从该层开始
+    记为 http 的网站偶尔有网页直接请求找不到链接时只累计失败次数，连续 miss_limit 次才改记为 browser
+    保存在 ~/.cache/smart-downloader/extractor_tiers.json，多次运行之间保留；目录不可写时只在内存中记录
+    """
+
+    def __init__(self, path=None, ttl=7 * 24 * 3600, miss_limit=3):
+        """
+        :param path: 记录文件路径
+        :param ttl: 记录的有效期 (秒)，过期后重新从直接请求开始尝试
+        :param miss_limit: 记为 http 的网站连续多少个网页直接请求失败后改记为 browser
+        """
+        self.path = Path(path).expanduser() if path else (
+            Path.home() / ".cache" / "smart-downloader" / "extractor_tiers.json"
+        )
+        self.ttl = ttl
+        self.miss_limit = miss_limit
+        self._lock = threading.Lock()
+        try:
+            self._entries = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, domain):
+        with self._lock:
+            entry = self._entries.get(domain)
+        if entry and time.time() - entry.get("at", 0) < self.ttl:
+            return entry.get("tier")
+        return None
+
+    def remember(self, domain, tier):
+        """记录 domain 在 tier 层解析成功，同时清零直接请求的失败次数"""
+        with self._lock:
+            entry = self._entries.get(domain)
+            if (entry and entry.get("tier") == tier and not entry.get("misses")
+                    and time.time() - entry.get("at", 0) < self.ttl / 2):
+                return  # 记录还新，不必每个网页都写文件
+            self._entries[domain] = {"tier": tier, "at": time.time()}
+            self._save()
+
+    def miss(self, domain):
+        """
+        记录 domain 的一个网页直接请求没有找到链接
+        :return: 连续失败次数；domain 没有有效记录时返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(domain)
+            if not entry or time.time() - entry.get("at", 0) >= self.ttl:
+                return None
+            entry["misses"] = entry.get("misses", 0) + 1
+            self._save()
+            return entry["misses"]
+
+    def _save(self):
+        """原子地写入记录文件，调用方需持有 _lock"""
+        tmp_path = self.path.with_name(f"{self.path.name}.{threading.get_ident()}.tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(json.dumps(self._entries, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, self.path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+
+
+_memory = None
+_memory_lock = threading.Lock()
+
+
+def default_tier_memory():
+    """进程内共享的 TierMemory (批量队列中的多个网页同时解析时不会互相覆盖记录)"""
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            _memory = TierMemory()
+        return _memory
+
 
 class WebExtractor:
-    def __init__(self, headless=True):
-        self.options = Options()
-        if headless:
-            self.options.add_argument("--headless")
-        self.options.add_argument("--no-sandbox")
-        self.options.add_argument("--disable-dev-shm-usage")
-        self.options.add_argument("user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
-        
+    POLL_INTERVAL = 0.1  # 检查网络日志的间隔 (秒)
+    HTTP = "http"
+    BROWSER = "browser"
+
+    def __init__(self, headless=True, pool=None, wait_timeout=5, memory=None):
+        """
+        :param pool: BrowserPool，None 表示使用进程内共享的浏览器池
+        :param wait_timeout: 等待网页发出 m3u8 请求的最长时间 (秒)，超时后再从 DOM / 源码中查找
+        :param memory: TierMemory，None 表示使用进程内共享的记录
+        """
+        self.headless = headless
+        self.wait_timeout = wait_timeout
+        self.memory = memory or default_tier_memory()
+        self._pool = pool
+
+    @property
+    def pool(self):
+        # 只有需要浏览器时才导入 Selenium 并创建浏览器池，直接请求网页就能解析时不加载
+        if self._pool is None:
+            from core.browser_pool import default_browser_pool
+            self._pool = default_browser_pool(headless=self.headless)
+        return self._pool
+
     def extract_m3u8(self, url):
         """
-        从网页中提取 m3u8 地址和标题
+        从网页中提取 m3u8 地址和标题，分两层:
+        1. 直接请求网页，在 HTML / 内联 JSON 中按源码正则查找，不需要浏览器
+        2. 未找到时用浏览器解析 (见 _extract_with_browser)
+        按域名记住哪一层成功过，同一网站之后的网页直接从该层开始；
+        记为 http 的网站单个网页需要浏览器时仍保留 http 记录，连续 miss_limit 个网页如此才改为浏览器优先
         :return: (m3u8_url, title) 或 (None, None)
         """
-        print(f"正在加载网页: {url}")
-        driver = None
+        domain = urlparse(url).netloc.lower()
+        tier = self.memory.get(domain)
+        if tier == self.BROWSER:
+            print(f"{domain} 的网页之前需要浏览器才能解析，直接使用浏览器")
+        else:
+            with span("直接请求网页"):
+                found, title = self._extract_with_http(url)
+            if found:
+                self.memory.remember(domain, self.HTTP)
+                return found, title
+            print("网页源码中没有 m3u8 链接，改用浏览器解析")
+
+        with span("浏览器解析"):
+            found, title = self._extract_with_browser(url)
+        if found:
+            misses = self.memory.miss(domain) if tier == self.HTTP else None
+            if misses is not None and misses < self.memory.miss_limit:
+                print(f"{domain} 之前直接请求就能解析，连续 {misses} 个网页需要浏览器，暂不改为浏览器优先")
+            else:
+                self.memory.remember(domain, self.BROWSER)
+        return found, title
+
+    def _extract_with_http(self, url):
+        """直接请求网页，在源码中查找 m3u8 链接和标题"""
+        print(f"直接请求网页: {url}")
         try:
-            service = Service(ChromeDriverManager().install())
-            driver = webdriver.Chrome(service=service, options=self.options)
-            
+            response = default_transport().get(url, headers=PAGE_HEADERS, timeout=10)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"直接请求网页失败: {e}")
+            return None, None
+        # 响应头没有声明编码时 requests 默认 ISO-8859-1，会把中文标题解码成乱码
+        content_type = response.headers.get("Content-Type", "").lower()
+        encoding = response.encoding if "charset" in content_type else "utf-8"
+        page_source = response.content.decode(encoding or "utf-8", errors="replace")
+
+        found = self._match_m3u8(page_source)
+        if not found:
+            return None, None
+        title = self._title_from_html(page_source)
+        print(f"提取到的网页标题: {title}")
+        return found, title
+
+    def _extract_with_browser(self, url):
+        """
+        浏览器从池中借用；网页加载后监听网络请求，出现 m3u8 请求 (含 XHR / fetch 加载的) 即返回，
+        wait_timeout 内没有出现时再查找 DOM 和源码
+        """
+        from selenium.common.exceptions import WebDriverException
+
+        print(f"正在加载网页: {url}")
+        for attempt in range(2):
+            try:
+                with self.pool.browser() as driver:
+                    return self._extract(driver, url)
+            except WebDriverException as e:
+                # 复用的浏览器可能已经崩溃，换一个新浏览器重试一次
+                if attempt == 0:
+                    print(f"⚠️  浏览器异常，重新打开后重试: {str(e).splitlines()[0]}")
+                    continue
+                print(f"网页解析出错: {e}")
+            except Exception as e:
+                print(f"网页解析出错: {e}")
+            return None, None
+
+    def _extract(self, driver, url):
+        driver.get_log("performance")  # 丢弃之前网页遗留的日志
+        with span("加载网页"):
             driver.get(url)
-            time.sleep(5) # 等待加载
-            
+        with span("等待 m3u8 请求"):
+            found = self._wait_for_m3u8(driver)
+
+        with span("查找 m3u8"):
             # 尝试提取标题
             title = self._extract_title(driver)
             print(f"提取到的网页标题: {title}")
+            if found: return found, title
             
             # 策略 1: DOM 查找
             found = self._find_in_dom(driver)
@@ -40,18 +217,45 @@ class WebExtractor:
             # 策略 2: 源码正则
             found = self._find_in_source(driver)
             if found: return found, title
-            
-            return None, None
-            
-        except Exception as e:
-            print(f"网页解析出错: {e}")
-            return None, None
-        finally:
-            if driver:
-                driver.quit()
+        
+        return None, None
+
+    def _wait_for_m3u8(self, driver):
+        """轮询 Chrome 性能日志，发现第一个 m3u8 请求立即返回；超过 wait_timeout 返回 None"""
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            found = self._find_in_network_log(driver)
+            if found or time.monotonic() >= deadline:
+                return found
+            time.sleep(self.POLL_INTERVAL)
+
+    def _find_in_network_log(self, driver):
+        """在新增的性能日志中查找 m3u8 请求：URL 含 .m3u8，或响应类型为 mpegurl (地址不带后缀的播放列表)"""
+        for entry in driver.get_log("performance"):
+            try:
+                message = json.loads(entry["message"])["message"]
+            except (KeyError, TypeError, ValueError):
+                continue
+            method = message.get("method")
+            params = message.get("params") or {}
+            if method == "Network.requestWillBeSent":
+                request_url = (params.get("request") or {}).get("url", "")
+                mime_type = ""
+            elif method == "Network.responseReceived":
+                response = params.get("response") or {}
+                request_url = response.get("url", "")
+                mime_type = (response.get("mimeType") or "").lower()
+            else:
+                continue
+            if request_url.startswith("http") and (".m3u8" in request_url or "mpegurl" in mime_type):
+                print(f"在网络请求中找到: {request_url}")
+                return self._clean_url(request_url)
+        return None
 
     def _extract_title(self, driver):
         """提取网页标题作为文件名"""
+        from selenium.webdriver.common.by import By
+
         title = ""
         try:
             # 1. 优先尝试 h1 class="title"
@@ -65,15 +269,30 @@ class WebExtractor:
             if not title:
                 title = driver.title.strip()
                 
-            # 清理非法字符
-            if title:
-                title = re.sub(r'[\\/*?:"<>|]', "", title) # 移除文件名非法字符
-                title = title.replace(" ", "_") # 空格转下划线
+            title = self._clean_title(title)
                 
         except:
             pass
         return title if title else None
 
+    def _title_from_html(self, page_source):
+        """从 HTML 源码提取标题，规则与 _extract_title 相同: 优先 h1.title，其次 title 标签"""
+        for pattern in (_H1_TITLE, _TITLE):
+            match = pattern.search(page_source)
+            if match:
+                title = " ".join(html.unescape(_TAG.sub("", match.group(1))).split())
+                if title:
+                    return self._clean_title(title) or None
+        return None
+
+    @staticmethod
+    def _clean_title(title):
+        """清理非法字符"""
+        if title:
+            title = re.sub(r'[\\/*?:"<>|]', "", title) # 移除文件名非法字符
+            title = title.replace(" ", "_") # 空格转下划线
+        return title
+
     def _clean_url(self, url):
         """清洗 URL，处理嵌套情况"""
         # 如果 URL 包含参数且参数本身也是 url (如 ?url=http...)，提取真实地址
@@ -87,6 +306,8 @@ class WebExtractor:
 
     def _find_in_dom(self, driver):
         """查找 video/source 标签"""
+        from selenium.webdriver.common.by import By
+
         print("尝试从 DOM 查找视频链接...")
         try:
             video_elements = driver.find_elements(By.TAG_NAME, "video")
@@ -109,8 +330,10 @@ class WebExtractor:
     def _find_in_source(self, driver):
         """正则匹配源码"""
         print("尝试从页面源码正则匹配...")
-        page_source = driver.page_source
-        
+        return self._match_m3u8(driver.page_source)
+
+    def _match_m3u8(self, page_source):
+        """在网页源码 (含内联 JSON 中转义的 URL) 中正则查找 m3u8 链接"""
         # 标准匹配
         match = re.search(r'(https?://[^\s"\'<>]+?\.m3u8)', page_source)
         if match:
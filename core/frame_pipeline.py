@@ -0,0 +1,258 @@
+import queue
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def iter_png_stream(stream):
+    """把 image2pipe 输出的连续 PNG 数据按块结构切分为单张图片 (以 IEND 块结尾)"""
+    while True:
+        signature = stream.read(8)
+        if not signature:
+            return
+        if signature != PNG_SIGNATURE:
+            raise ValueError("帧数据不是 PNG 格式")
+        parts = [signature]
+        while True:
+            header = stream.read(8)
+            if len(header) < 8:
+                raise ValueError("PNG 帧数据不完整")
+            length, kind = struct.unpack(">I4s", header)
+            body = stream.read(length + 4)  # 数据 + CRC
+            if len(body) < length + 4:
+                raise ValueError("PNG 帧数据不完整")
+            parts.append(header)
+            parts.append(body)
+            if kind == b"IEND":
+                break
+        yield b"".join(parts)
+
+
+class StageStats:
+    """一个阶段处理的帧数与实际工作时间 (不含等待上下游的时间)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy = 0.0
+
+    @contextmanager
+    def timing(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.busy += time.perf_counter() - start
+
+    @property
+    def fps(self):
+        return self.frames / self.busy if self.busy > 0 else 0.0
+
+
+def stage_report(stages, elapsed):
+    """各阶段的 帧/秒 (按实际工作时间计算)，最慢的阶段即瓶颈；elapsed 为整体墙钟耗时"""
+    slowest = min(stages, key=lambda s: s.fps) if all(s.frames for s in stages) else None
+    parts = [f"{s.name} {s.fps:.1f} 帧/s ({s.busy:.1f}s)" for s in stages]
+    overall = stages[-1].frames / elapsed if elapsed > 0 else 0.0
+    text = f"各阶段速度: {' | '.join(parts)}，整体 {overall:.1f} 帧/s"
+    return f"{text}，瓶颈: {slowest.name}" if slowest else text
+
+
+class _Batch:
+    def __init__(self, path):
+        self.path = path              # 批次目录，含 in/ (原始帧) 和 out/ (增强后的帧)
+        self.frames = 0
+
+    @property
+    def input_dir(self):
+        return self.path / "in"
+
+    @property
+    def output_dir(self):
+        return self.path / "out"
+
+
+class FramePipeline:
+    """
+    流式逐帧处理：ffmpeg 把视频解码为 PNG 帧流 (image2pipe) 输出到管道，每 batch_size 帧落盘为一个批次交给增强程序，
+    增强后的帧按顺序写入编码 ffmpeg 的 stdin。解码、增强、编码三个阶段在各自的线程中并行，
+    阶段之间最多排队 queue_batches 个批次，磁盘上同时存在的帧数与视频长度无关。
+    Real-ESRGAN (ncnn) 只接受图片文件，批处理让每次启动程序加载一次模型就能处理一批帧。
+    """
+
+    def __init__(self, decode_cmd, enhance_batch, encode_cmd, batch_size=32, queue_batches=2, work_dir=None,
+                 progress=True):
+        """
+        :param decode_cmd: 解码命令，向 stdout 输出 image2pipe 格式的 PNG 帧流
+        :param enhance_batch: 增强一个批次的函数 enhance_batch(输入目录, 输出目录)，输出与输入同名的 PNG 文件
+        :param encode_cmd: 编码命令，从 stdin 读取 image2pipe 格式的 PNG 帧流
+        :param batch_size: 每个批次的帧数
+        :param queue_batches: 阶段之间最多排队的批次数
+        :param work_dir: 存放批次帧的临时目录的父目录，None 表示系统临时目录
+        :param progress: 是否打印已编码的帧数
+        """
+        self.decode_cmd = decode_cmd
+        self.enhance_batch = enhance_batch
+        self.encode_cmd = encode_cmd
+        self.batch_size = batch_size
+        self.queue_batches = queue_batches
+        self.work_dir = work_dir
+        self.progress = progress
+        self.stages = [StageStats("解码"), StageStats("增强"), StageStats("编码")]
+        self.elapsed = 0.0
+        self._abort = threading.Event()
+        self._errors = []
+        self._processes = []
+
+    @property
+    def frames(self):
+        return self.stages[-1].frames
+
+    def run(self):
+        """运行整个流水线，返回编码的帧数；任一阶段失败时停止其他阶段并抛出 RuntimeError"""
+        start = time.perf_counter()
+        to_enhance = queue.Queue(maxsize=self.queue_batches)
+        to_encode = queue.Queue(maxsize=self.queue_batches)
+        with tempfile.TemporaryDirectory(prefix="frames_", dir=self.work_dir) as temp_dir:
+            threads = [
+                threading.Thread(target=self._guard, args=(self._decode, Path(temp_dir), to_enhance),
+                                 name="frame-decode", daemon=True),
+                threading.Thread(target=self._guard, args=(self._enhance, to_enhance, to_encode),
+                                 name="frame-enhance", daemon=True),
+            ]
+            for thread in threads:
+                thread.start()
+            self._guard(self._encode, to_encode)
+            for thread in threads:
+                thread.join()
+        self.elapsed = time.perf_counter() - start
+        if self._errors:
+            raise RuntimeError(self._errors[0])
+        return self.frames
+
+    def report(self):
+        return stage_report(self.stages, self.elapsed)
+
+    def _guard(self, stage, *args):
+        try:
+            stage(*args)
+        except BaseException as e:
+            if not self._abort.is_set():
+                self._errors.append(str(e) or type(e).__name__)
+            self._abort.set()
+            for proc in self._processes:
+                if proc.poll() is None:
+                    proc.kill()
+            if not isinstance(e, Exception):
+                raise
+
+    def _put(self, q, item):
+        """放入下一阶段的队列，其他阶段失败时放弃"""
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._abort.is_set():
+            try:
+                return q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+        return None
+
+    def _popen(self, cmd, **kwargs):
+        stderr = tempfile.TemporaryFile()
+        proc = subprocess.Popen(cmd, stderr=stderr, **kwargs)
+        proc.stderr_file = stderr
+        self._processes.append(proc)
+        return proc
+
+    @staticmethod
+    def _check(proc, what):
+        returncode = proc.wait()
+        proc.stderr_file.seek(0)
+        error = proc.stderr_file.read().decode("utf-8", errors="replace")[-2000:].strip()
+        proc.stderr_file.close()
+        if returncode != 0:
+            raise RuntimeError(f"{what}失败 (退出码 {returncode}): {error}")
+
+    def _decode(self, temp_dir, out):
+        stats = self.stages[0]
+        proc = self._popen(self.decode_cmd, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+        frames = iter_png_stream(proc.stdout)
+        batch = None
+        while not self._abort.is_set():
+            with stats.timing():
+                frame = next(frames, None)
+                if frame is not None:
+                    if batch is None:
+                        batch = _Batch(temp_dir / f"batch_{stats.frames // self.batch_size:06d}")
+                        batch.input_dir.mkdir(parents=True)
+                        batch.output_dir.mkdir()
+                    batch.frames += 1
+                    (batch.input_dir / f"frame_{batch.frames:08d}.png").write_bytes(frame)
+                    stats.frames += 1
+            if batch is not None and (frame is None or batch.frames >= self.batch_size):
+                if not self._put(out, batch):
+                    break
+                batch = None
+            if frame is None:
+                break
+        proc.stdout.close()
+        self._check(proc, "解码")
+        self._put(out, None)
+
+    def _enhance(self, source, out):
+        stats = self.stages[1]
+        while True:
+            batch = self._get(source)
+            if batch is None:
+                break
+            with stats.timing():
+                self.enhance_batch(batch.input_dir, batch.output_dir)
+            shutil.rmtree(batch.input_dir, ignore_errors=True)
+            stats.frames += batch.frames
+            if not self._put(out, batch):
+                return
+        self._put(out, None)
+
+    def _encode(self, source):
+        stats = self.stages[2]
+        proc = self._popen(self.encode_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+        try:
+            while True:
+                batch = self._get(source)
+                if batch is None:
+                    break
+                with stats.timing():
+                    for i in range(1, batch.frames + 1):
+                        frame = batch.output_dir / f"frame_{i:08d}.png"
+                        if not frame.exists():
+                            raise RuntimeError(f"增强程序没有输出第 {stats.frames + 1} 帧")
+                        proc.stdin.write(frame.read_bytes())
+                        stats.frames += 1
+                shutil.rmtree(batch.path, ignore_errors=True)
+                if self.progress:
+                    print(f"\r进度: {stats.frames} 帧", end="", flush=True)
+        except BrokenPipeError:
+            pass  # 编码进程已退出，错误信息在下面的 _check 中报告
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            if self.progress and stats.frames:
+                print()
+        with stats.timing():
+            self._check(proc, "编码")
@@ -0,0 +1,133 @@
+import collections
+import math
+import threading
+import time
+
+
+class SegmentCancelled(Exception):
+    """切片请求已被取消 (对冲请求中较慢的一方)，不应重试"""
+
+
+class SegmentAttempt:
+    """
+    一次切片请求 (主请求或对冲请求)
+    记录开始/结束时间，cancel() 时关闭正在读取的响应，使阻塞在 socket 上的线程尽快退出
+    """
+
+    __slots__ = ("idx", "hedge", "started", "finished", "mirror", "avoid_mirror", "_cancelled", "_response", "_lock")
+
+    def __init__(self, idx, hedge=False):
+        self.idx = idx
+        self.hedge = hedge
+        self.started = None
+        self.finished = None
+        self.mirror = None        # 本次请求使用的切片源
+        self.avoid_mirror = None  # 对冲请求尽量避开原请求的源
+        self._cancelled = False  # 每个切片请求都会创建，不用 Event，读写由 _lock 保护
+        self._response = None
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def start(self):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.check()
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def bind(self, response):
+        """登记当前响应，取消时关闭它"""
+        with self._lock:
+            self._response = response
+        if self.cancelled:
+            response.close()
+        self.check()
+
+    def check(self):
+        if self.cancelled:
+            raise SegmentCancelled(f"切片 {self.idx} 已由另一请求完成")
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            response = self._response
+        if response is not None:
+            # 关闭响应要等正在读取它的线程让出缓冲区锁，放到后台线程里做，不阻塞调度
+            threading.Thread(target=self._close, args=(response,), name="hedge-cancel", daemon=True).start()
+
+    @staticmethod
+    def _close(response):
+        # 关闭响应即断开其连接 (不回到连接池)；读取线程每读一块都会 check()，最迟在读取超时后退出
+        try:
+            response.close()
+        except Exception:
+            pass
+
+
+class HedgePolicy:
+    """
+    对冲请求策略
+    - 在途切片耗时超过已完成切片耗时的 percentile 分位数时，再发一个相同的请求，先完成者胜出
+    - 下载进入最后 tail_fraction 的切片时，阈值降为中位数，尽快收尾
+    对冲请求走单独的小线程池，不排在普通切片后面，同时在途的对冲数不超过 max_in_flight。
+    """
+
+    MIN_SAMPLES = 20
+    SAMPLE_WINDOW = 200
+    MIN_DELAY = 1.0  # 秒，耗时低于此值的切片不对冲，避免对本来就很快的请求加倍负载
+    REFRESH_EVERY = 16  # 每新增多少个样本重新计算一次阈值 (排序)，而不是每完成一个切片都排序
+
+    def __init__(self, percentile=95, tail_fraction=0.05, max_in_flight=4):
+        """
+        :param percentile: 触发对冲的耗时分位数，0 表示关闭对冲
+        :param tail_fraction: 剩余切片占比不超过该值时进入收尾阶段
+        :param max_in_flight: 同时在途的对冲请求上限
+        """
+        self.percentile = percentile
+        self.tail_fraction = tail_fraction
+        self.max_in_flight = max_in_flight
+        self.fired = 0
+        self.won = 0
+        self._samples = collections.deque(maxlen=self.SAMPLE_WINDOW)
+        self._thresholds = {}  # tail -> (计算时的样本版本, 阈值)
+        self._version = 0
+
+    @property
+    def enabled(self):
+        return self.percentile > 0
+
+    @property
+    def ready(self):
+        """样本是否足够计算阈值；不足时调度器不必检查在途切片"""
+        return len(self._samples) >= self.MIN_SAMPLES
+
+    def observe(self, latency):
+        """记录一个成功切片的耗时"""
+        self._samples.append(latency)
+        self._version += 1
+
+    def in_tail(self, remaining, total):
+        return remaining <= max(1, math.ceil(total * self.tail_fraction))
+
+    def threshold(self, tail=False):
+        """当前的对冲阈值 (秒)，样本不足时返回 None"""
+        if not self.ready:
+            return None
+        cached = self._thresholds.get(tail)
+        if cached and self._version - cached[0] < self.REFRESH_EVERY:
+            return cached[1]
+        ordered = sorted(self._samples)
+        pct = min(50, self.percentile) if tail else self.percentile
+        value = max(self.MIN_DELAY, ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))])
+        self._thresholds[tail] = (self._version, value)
+        return value
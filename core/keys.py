@@ -0,0 +1,109 @@
+import threading
+import concurrent.futures
+from urllib.parse import urljoin
+
+from tenacity import retry, stop_after_attempt, wait_exponential
+
+from core.transport import default_transport
+
+
+
+class KeyManager:
+    """
+    AES-128 密钥管理
+    - single-flight: 同一个 key URI 同时只会有一个请求，其余线程等待同一个结果
+    - 预取: 播放列表解析完成后立即在后台按出现顺序拉取所有 key，避免密钥请求阻塞前几个切片
+    """
+
+    def __init__(self, prefetch_workers=4, transport=None):
+        """
+        :param transport: 请求密钥使用的 Transport，None 表示进程内默认的连接池
+        """
+        self._keys = {}      # uri -> key bytes
+        self._inflight = {}  # uri -> Future
+        self._lock = threading.Lock()
+        self._prefetch_workers = prefetch_workers
+        self._executor = None
+        self.fetch_count = 0
+        self._transport = transport
+
+    @staticmethod
+    def key_uri(segment, base_uri):
+        """切片对应的完整 key URI，未加密 (无 key 或 METHOD=NONE) 时返回 None"""
+        return KeyManager.resolve_key(segment.key, base_uri)
+
+    @staticmethod
+    def resolve_key(key, base_uri):
+        """EXT-X-KEY 对应的完整 key URI，未加密时返回 None"""
+        if not key or not key.uri or (key.method or "").upper() == "NONE":
+            return None
+        return key.uri if key.uri.startswith('http') else urljoin(base_uri, key.uri)
+
+    def get(self, key_uri):
+        """获取密钥，并发调用时只发起一次请求"""
+        with self._lock:
+            if key_uri in self._keys:
+                return self._keys[key_uri]
+            future = self._inflight.get(key_uri)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._inflight[key_uri] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            key = self._fetch(key_uri)
+        except Exception as e:
+            with self._lock:
+                self._inflight.pop(key_uri, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._keys[key_uri] = key
+            self._inflight.pop(key_uri, None)
+        future.set_result(key)
+        return key
+
+    def prefetch(self, segments, base_uri):
+        """在后台按出现顺序预取尚未获取的 key URI"""
+        self.prefetch_keys((segment.key for segment in segments), base_uri)
+
+    def prefetch_keys(self, keys, base_uri):
+        """同 prefetch，直接给出 EXT-X-KEY 列表 (如 Playlist.keys)，不需要先解析全部切片"""
+        uris = []
+        seen = set()
+        with self._lock:
+            known = set(self._keys) | set(self._inflight)
+        for key in keys:
+            uri = self.resolve_key(key, base_uri)
+            if uri and uri not in seen and uri not in known:
+                seen.add(uri)
+                uris.append(uri)
+        if not uris:
+            return
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._prefetch_workers, thread_name_prefix="key-prefetch"
+            )
+        print(f"预取 {len(uris)} 个解密密钥...")
+        for uri in uris:
+            # 失败时不做处理，切片解密时会再次通过 get() 获取
+            self._executor.submit(self.get, uri)
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=2, max=10),
+        reraise=True
+    )
+    def _fetch(self, key_uri):
+        key_resp = (self._transport or default_transport()).get(key_uri, timeout=15)
+        key_resp.raise_for_status()
+        self.fetch_count += 1
+        return key_resp.content
@@ -0,0 +1,129 @@
+import collections
+import threading
+import time
+
+from core.playlist import Playlist, strong_last_modified
+from core.transport import default_transport
+
+
+class LivePlaylistFeed:
+    """
+    直播 / EVENT 播放列表的增量轮询
+    后台线程按 target_duration 节奏带条件请求 (ETag / Last-Modified) 重新拉取媒体列表，
+    按媒体序列号去重，只把新出现的切片交给下载线程池，直到出现 EXT-X-ENDLIST 或达到录制时长。
+    """
+
+    def __init__(self, url, playlist, duration=None, key_manager=None, transport=None):
+        """
+        :param url: 媒体播放列表 URL
+        :param playlist: 首次拉取到的 Playlist
+        :param duration: 最长录制时长 (秒)，None 表示直到 EXT-X-ENDLIST
+        :param key_manager: KeyManager，新切片出现时预取其密钥
+        :param transport: 刷新列表使用的 Transport，None 表示进程内默认的连接池
+        """
+        self.url = url
+        self.target_duration = playlist.target_duration or 6
+        self.key_manager = key_manager
+        self.known = 0          # 已发现的切片数
+        self.ended = False      # 是否已出现 EXT-X-ENDLIST
+        self.finished = False   # 轮询是否已结束
+        self.skipped = 0        # 因录制跟不上而错过的切片数
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._deadline = time.monotonic() + duration if duration else None
+        self._last_seq = None
+        self._etag = None
+        self._last_modified = None
+        self._transport = transport or default_transport()
+        self._thread = threading.Thread(target=self._poll_loop, name="live-poller", daemon=True)
+        self._enqueue(playlist)
+
+    def start(self):
+        if self.ended:
+            self.finished = True
+        else:
+            self._thread.start()
+
+    def stop(self):
+        """停止轮询，已发现的切片仍会被下载"""
+        self._stop.set()
+
+    def segments(self):
+        """
+        生成 (idx, segment)
+        暂时没有新切片时生成 None，轮询结束且队列取空后结束
+        """
+        while True:
+            finished = self.finished
+            with self._lock:
+                item = self._queue.popleft() if self._queue else None
+            if item is not None:
+                yield item
+            elif finished:
+                return
+            else:
+                yield None
+
+    def _poll_loop(self):
+        changed = True
+        try:
+            while not self.ended:
+                # 列表有更新时等待一个 target_duration，否则等一半 (RFC 8216 6.3.4)
+                wait = self.target_duration if changed else self.target_duration / 2
+                if self._deadline:
+                    wait = min(wait, max(self._deadline - time.monotonic(), 0))
+                if self._stop.wait(wait):
+                    break
+                if self._deadline and time.monotonic() >= self._deadline:
+                    print("\n⏱️  已达到录制时长，停止刷新直播列表")
+                    break
+                try:
+                    changed = self._poll() > 0
+                except Exception as e:
+                    print(f"\n⚠️  刷新直播列表失败，稍后重试: {e}")
+                    changed = False
+        finally:
+            self.finished = True
+
+    def _poll(self):
+        """条件请求媒体列表，返回新增切片数"""
+        headers = {}
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified:
+            headers["If-Modified-Since"] = self._last_modified
+        response = self._transport.get(self.url, headers=headers, timeout=15)
+        if response.status_code == 304:
+            return 0
+        response.raise_for_status()
+        self._etag = response.headers.get("ETag")
+        self._last_modified = strong_last_modified(response.headers)
+        playlist = Playlist(response.text, uri=self.url)
+        self.target_duration = playlist.target_duration or self.target_duration
+        return self._enqueue(playlist)
+
+    def _enqueue(self, playlist):
+        first_seq = playlist.media_sequence or 0
+        new_segments = []
+        for offset, segment in enumerate(playlist.segments):
+            seq = first_seq + offset
+            if self._last_seq is not None:
+                if seq <= self._last_seq:
+                    continue
+                if seq > self._last_seq + 1 and not new_segments:
+                    missed = seq - self._last_seq - 1
+                    self.skipped += missed
+                    print(f"\n⚠️  直播列表已滚动，错过了 {missed} 个切片")
+            new_segments.append(segment)
+            self._last_seq = seq
+
+        if new_segments and self.key_manager:
+            self.key_manager.prefetch(new_segments, self.url)
+        with self._lock:
+            for segment in new_segments:
+                self._queue.append((self.known, segment))
+                self.known += 1
+        if playlist.is_endlist:
+            self.ended = True
+        return len(new_segments)
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class JobManifest:
+    """
+    下载任务清单
+    保存在输出目录中 (.<job_id>.manifest.json)，记录播放列表、所选子流 (及下载中途切换到的子流) 以及每个切片的状态/字节数/校验和，
+    任务中断后可据此只补齐缺失或校验失败的切片。
+    """
+
+    VERSION = 1
+    SAVE_INTERVAL = 1.0  # 秒，增量进度的最短落盘间隔
+
+    def __init__(self, path, url):
+        self.path = Path(path)
+        self.url = url
+        self.job_id = self.make_job_id(url)
+        self.variant_url = None
+        self.output_name = None
+        self.total = None
+        self.switches = []       # 中途切换的子流 [(起始切片序号, 媒体列表 URL)]
+        self.merged = 0          # stream 模式: 已按序写入 .part 文件的切片数
+        self.merged_bytes = 0    # stream 模式: .part 文件中有效数据的字节数
+        self.segments = {}       # idx -> {"status", "bytes", "sha1", "path"}
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+
+    @staticmethod
+    def make_job_id(url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def for_job(cls, download_dir, url):
+        """定位某个播放列表 URL 对应的清单文件"""
+        job_id = cls.make_job_id(url)
+        return cls(Path(download_dir) / f".{job_id}.manifest.json", url)
+
+    @staticmethod
+    def file_checksum(path):
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def load(self):
+        """读取已有清单，成功返回 True"""
+        if not self.path.exists():
+            return False
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            print(f"⚠️  任务清单损坏，忽略: {e}")
+            return False
+        if data.get("version") != self.VERSION or data.get("url") != self.url:
+            return False
+        self.variant_url = data.get("variant_url")
+        self.output_name = data.get("output_name")
+        self.total = data.get("total")
+        self.switches = [(idx, url) for idx, url in data.get("switches", [])]
+        self.merged = data.get("merged", 0)
+        self.merged_bytes = data.get("merged_bytes", 0)
+        self.segments = {int(k): v for k, v in data.get("segments", {}).items()}
+        return True
+
+    def has_progress(self):
+        return self.merged > 0 or any(s["status"] != "failed" for s in self.segments.values())
+
+    def completed_count(self):
+        """已完成（无需重新下载）的切片数"""
+        with self._lock:
+            return self.merged + sum(
+                1 for idx, s in self.segments.items() if idx >= self.merged and s["status"] in ("done", "spilled")
+            )
+
+    def mark_done(self, idx, nbytes, sha1, path, status="done"):
+        """记录切片已落盘 (concat 模式的临时文件 / stream 模式的溢写文件)"""
+        with self._lock:
+            self.segments[idx] = {"status": status, "bytes": nbytes, "sha1": sha1, "path": str(path)}
+        self.save()
+
+    def mark_switch(self, idx, variant_url):
+        """记录从第 idx 个切片起改用另一个子流，立即落盘 (之后写入的切片都来自新子流)"""
+        with self._lock:
+            self.switches.append((idx, variant_url))
+        self.save(force=True)
+
+    def mark_failed(self, idx):
+        with self._lock:
+            self.segments[idx] = {"status": "failed", "bytes": 0, "sha1": None, "path": None}
+        self.save()
+
+    def mark_merged(self, next_index, merged_bytes, entries=()):
+        """
+        记录 .part 文件中已按序写入的前缀
+        :param entries: [(idx, bytes, sha1)] 本次新写入的切片
+        """
+        with self._lock:
+            self.merged = next_index
+            self.merged_bytes = merged_bytes
+            for idx, nbytes, sha1 in entries:
+                self.segments[idx] = {"status": "merged", "bytes": nbytes, "sha1": sha1, "path": None}
+
+    def save_due(self):
+        return time.monotonic() - self._last_save >= self.SAVE_INTERVAL
+
+    def save(self, force=False):
+        """原子写入清单文件（先写临时文件再替换），非强制时按 SAVE_INTERVAL 节流"""
+        if not force and not self.save_due():
+            return
+        with self._lock:
+            data = {
+                "version": self.VERSION,
+                "url": self.url,
+                "variant_url": self.variant_url,
+                "output_name": self.output_name,
+                "total": self.total,
+                "switches": self.switches,
+                "merged": self.merged,
+                "merged_bytes": self.merged_bytes,
+                "segments": {str(k): v for k, v in sorted(self.segments.items())},
+            }
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, self.path)
+            self._last_save = time.monotonic()
+
+    def reset(self):
+        """丢弃所有进度（保留 url）"""
+        with self._lock:
+            self.variant_url = None
+            self.output_name = None
+            self.total = None
+            self.switches = []
+            self.merged = 0
+            self.merged_bytes = 0
+            self.segments = {}
+
+    def delete(self):
+        self.path.unlink(missing_ok=True)
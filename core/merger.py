@@ -0,0 +1,317 @@
+import hashlib
+import itertools
+import os
+import shutil
+import threading
+from pathlib import Path
+
+
+class SegmentSuperseded(Exception):
+    """同一切片已由另一个写入器提交，本写入器的数据不再需要"""
+
+
+class SegmentWriter:
+    """
+    单个切片的增量写入器，由 StreamingMerger.open_segment 创建
+    - 打开时恰好是下一个期望序号的切片直接写入输出文件 (direct)
+    - 其余切片先写入内存缓冲，合并器缓冲超过上限时改为写入溢写文件
+    写入完成调用 commit()，出错调用 abort()
+    同一切片可以有多个写入器 (对冲请求)，先提交者胜出
+    """
+
+    def __init__(self, merger, idx, direct, checksum=False):
+        self.idx = idx
+        self.direct = direct
+        self.nbytes = 0
+        self.offset = 0           # direct 模式下在输出文件中的起始位置
+        self.buffer = None if direct else bytearray()
+        self.spill_path = None
+        self.spill_file = None
+        self.superseded = False   # direct 写入器被同一切片的其他写入器取代
+        self._merger = merger
+        self._sha1 = hashlib.sha1() if checksum else None
+
+    @property
+    def sha1(self):
+        return self._sha1.hexdigest() if self._sha1 else None
+
+    def write(self, data):
+        """写入一段数据，data 可以是 bytes / bytearray / memoryview，调用返回后即可复用"""
+        self.nbytes += len(data)
+        if self._sha1:
+            self._sha1.update(data)
+        if self.direct:
+            self._merger._direct_write(self, data)
+        elif self.spill_file:
+            self.spill_file.write(data)
+        else:
+            self._merger._buffer_write(self, data)
+
+    def commit(self):
+        self._merger._commit(self)
+
+    def abort(self):
+        self._merger._abort(self)
+
+
+class TempSegmentWriter:
+    """concat 模式的切片写入器：直接写入临时目录中的切片文件，接口与 SegmentWriter 相同"""
+
+    def __init__(self, path, idx, manifest=None):
+        self.path = Path(path)
+        self.idx = idx
+        self.nbytes = 0
+        self.manifest = manifest
+        # 按线程区分临时文件，同一切片的对冲请求互不干扰
+        self._tmp_path = self.path.with_name(f"{self.path.name}.{threading.get_ident()}.tmp")
+        self._file = open(self._tmp_path, 'wb')
+        self._sha1 = hashlib.sha1() if manifest else None
+
+    def write(self, data):
+        self.nbytes += len(data)
+        if self._sha1:
+            self._sha1.update(data)
+        self._file.write(data)
+
+    def commit(self):
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        if self.manifest:
+            self.manifest.mark_done(self.idx, self.nbytes, self._sha1.hexdigest(), self.path)
+
+    def abort(self):
+        self._file.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+
+class StreamingMerger:
+    """
+    流式按序合并切片
+    下一个期望序号的切片一到就追加写入输出文件；乱序到达的切片先放入内存重排缓冲区，
+    缓冲区超过上限时才把新到的乱序切片溢写到磁盘。
+    """
+
+    def __init__(self, output_path, spill_dir, max_buffer_bytes=64 * 1024 * 1024, start_index=0,
+                 resume_bytes=0, manifest=None, sink=None):
+        """
+        :param output_path: 输出文件路径
+        :param spill_dir: 溢写目录（乱序切片超出内存上限时落盘）
+        :param max_buffer_bytes: 重排缓冲区内存上限 (字节)
+        :param start_index: 第一个期望写入的切片序号
+        :param resume_bytes: 续传时输出文件中已有的有效字节数，其后的内容会被截断
+        :param manifest: JobManifest，提供时同步记录合并进度与溢写文件
+        :param sink: 代替输出文件的写入端 (如 FFmpegRemuxer)，只需支持 write / flush / close；
+                     不可回退，因此所有切片都先完整缓冲后再按序写入，也不支持 resume_bytes
+        """
+        self.output_path = Path(output_path)
+        self.spill_dir = Path(spill_dir)
+        self.max_buffer_bytes = max_buffer_bytes
+        self.manifest = manifest
+        self.next_index = start_index
+        self.buffer_bytes = 0
+        self.peak_buffer_bytes = 0
+        self.written_count = start_index
+        self.written_bytes = resume_bytes
+        self.spilled_count = 0
+        self._pending = {}  # idx -> (bytearray | Path | None (跳过), 字节数, sha1)
+        self._head_writer = None  # 正在直接写入输出文件的 SegmentWriter
+        self._spill_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._seekable = sink is None
+        if sink is not None:
+            if resume_bytes:
+                raise ValueError("sink 不支持续写")
+            self._file = sink
+        elif resume_bytes:
+            self._file = open(self.output_path, 'r+b')
+            self._file.truncate(resume_bytes)
+            self._file.seek(resume_bytes)
+        else:
+            self._file = open(self.output_path, 'wb')
+
+    def open_segment(self, idx):
+        """为切片创建写入器，可在任意线程调用"""
+        with self._lock:
+            direct = (self._seekable and idx == self.next_index
+                      and self._head_writer is None and idx not in self._pending)
+            writer = SegmentWriter(self, idx, direct, checksum=self.manifest is not None)
+            if direct:
+                writer.offset = self.written_bytes
+                self._head_writer = writer
+            return writer
+
+    def add(self, idx, content):
+        """一次性提交整个切片的内容"""
+        writer = self.open_segment(idx)
+        writer.write(content)
+        writer.commit()
+
+    def skip(self, idx):
+        """放弃某个切片 (如直播中已过期无法重试)，合并时跳过，后续切片不再等待它"""
+        with self._lock:
+            if idx < self.next_index or idx in self._pending:
+                return
+            self._pending[idx] = (None, 0, None)
+            self._drain([])
+
+    def add_spilled(self, idx, path, nbytes, sha1):
+        """登记上次中断前已溢写到磁盘的切片"""
+        with self._lock:
+            if idx < self.next_index or idx in self._pending:
+                return
+            self._pending[idx] = (Path(path), nbytes, sha1)
+            self._drain([])
+
+    def is_complete(self, total):
+        return self.next_index >= total
+
+    def close(self, skip_gaps=False):
+        """
+        关闭输出文件
+        若因缺口仍有乱序切片留在内存中，先把它们溢写到磁盘，以便之后续传
+        :param skip_gaps: 不再等待缺失的切片，把剩余切片按序直接写出 (用于无法续传的直播录制)
+        """
+        with self._lock:
+            if skip_gaps:
+                for idx in sorted(self._pending):
+                    if idx in self._pending:
+                        self.next_index = idx
+                        self._drain([])
+            for idx, (item, nbytes, sha1) in list(self._pending.items()):
+                if item is not None and not isinstance(item, Path):
+                    self.buffer_bytes -= nbytes
+                    spill_path = self._spill_path(idx)
+                    spill_path.write_bytes(item)
+                    self._pending[idx] = (spill_path, nbytes, sha1)
+                    self._record_spill(idx, spill_path, nbytes, sha1)
+            self._file.close()
+        return self.output_path
+
+    def _spill_path(self, idx):
+        return self.spill_dir / f"seg_{idx:04d}.ts"
+
+    def _record_spill(self, idx, path, nbytes, sha1):
+        self.spilled_count += 1
+        if self.manifest:
+            self.manifest.mark_done(idx, nbytes, sha1, path, status="spilled")
+
+    def _direct_write(self, writer, data):
+        with self._lock:
+            if writer.superseded:
+                raise SegmentSuperseded(f"切片 {writer.idx} 已由其他请求写入")
+            self._file.write(data)
+
+    def _supersede(self, writer):
+        """放弃正在直接写入的 writer：回退它已写入输出文件的部分，之后它的写入都会失败"""
+        writer.superseded = True
+        self._file.seek(writer.offset)
+        self._file.truncate()
+        self._head_writer = None
+
+    def _buffer_write(self, writer, data):
+        """乱序切片写入内存缓冲，超过上限时把该切片转为写入溢写文件"""
+        with self._lock:
+            if self.buffer_bytes + len(data) <= self.max_buffer_bytes:
+                writer.buffer += data
+                self.buffer_bytes += len(data)
+                self.peak_buffer_bytes = max(self.peak_buffer_bytes, self.buffer_bytes)
+                return
+            self.buffer_bytes -= len(writer.buffer)
+            writer.spill_path = self.spill_dir / f"seg_{writer.idx:04d}.{next(self._spill_ids)}.tmp"
+        writer.spill_file = open(writer.spill_path, 'wb')
+        writer.spill_file.write(writer.buffer)
+        writer.spill_file.write(data)
+        writer.buffer = None
+
+    def _commit(self, writer):
+        if writer.spill_file:
+            writer.spill_file.close()
+        idx = writer.idx
+        with self._lock:
+            if writer.superseded:
+                return
+            if writer.direct:
+                self._head_writer = None
+                self._discard(self._pending.pop(idx, None))
+                self.written_count += 1
+                self.written_bytes += writer.nbytes
+                self.next_index += 1
+                self._drain([(idx, writer.nbytes, writer.sha1)])
+                return
+
+            if idx < self.next_index or idx in self._pending:
+                # 同一切片已由其他写入器提交
+                self._release(writer)
+                return
+
+            if self._head_writer is not None and self._head_writer.idx == idx:
+                # 对冲请求先完成，取代仍在直接写入的慢请求
+                self._supersede(self._head_writer)
+
+            if writer.spill_file:
+                spill_path = self._spill_path(idx)
+                os.replace(writer.spill_path, spill_path)
+                self._pending[idx] = (spill_path, writer.nbytes, writer.sha1)
+                self._record_spill(idx, spill_path, writer.nbytes, writer.sha1)
+            else:
+                self._pending[idx] = (writer.buffer, writer.nbytes, writer.sha1)
+            self._drain([])
+
+    def _abort(self, writer):
+        if writer.spill_file:
+            writer.spill_file.close()
+        with self._lock:
+            if writer.superseded:
+                return
+            if writer.direct:
+                # 回退已写入输出文件的部分
+                self._file.seek(writer.offset)
+                self._file.truncate()
+                self._head_writer = None
+                self._drain([])
+            else:
+                self._release(writer)
+
+    def _release(self, writer):
+        """释放未被采用的写入器占用的缓冲/溢写文件"""
+        if writer.spill_path:
+            writer.spill_path.unlink(missing_ok=True)
+        elif writer.buffer is not None:
+            self.buffer_bytes -= len(writer.buffer)
+            writer.buffer = None
+
+    def _discard(self, pending_item):
+        if pending_item is None:
+            return
+        item, nbytes, _ = pending_item
+        if item is None:
+            return
+        if isinstance(item, Path):
+            item.unlink(missing_ok=True)
+        else:
+            self.buffer_bytes -= nbytes
+
+    def _drain(self, entries):
+        """连续写出已就绪的切片；有切片正在直接写入输出文件时不动"""
+        while self._head_writer is None and self.next_index in self._pending:
+            idx = self.next_index
+            item, nbytes, sha1 = self._pending.pop(idx)
+            self.next_index += 1
+            if item is None:
+                continue
+            if isinstance(item, Path):
+                with open(item, 'rb') as infile:
+                    shutil.copyfileobj(infile, self._file)
+                item.unlink()
+            else:
+                self.buffer_bytes -= nbytes
+                self._file.write(item)
+            self.written_count += 1
+            self.written_bytes += nbytes
+            entries.append((idx, nbytes, sha1))
+
+        if self.manifest and entries:
+            self.manifest.mark_merged(self.next_index, self.written_bytes, entries)
+            if self.manifest.save_due():
+                self._file.flush()
+                self.manifest.save()
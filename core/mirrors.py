@@ -0,0 +1,149 @@
+import threading
+import time
+from urllib.parse import urljoin, urlparse
+
+
+class Mirror:
+    """一个切片源 (主源、用户指定的镜像或冗余子流)"""
+
+    def __init__(self, base_uri, segments=None, primary_uri=None):
+        """
+        :param base_uri: 该源的媒体列表 URL (或以 / 结尾的目录 URL)
+        :param segments: 冗余子流自己的切片列表 (与主列表一一对应)；None 表示按主列表的切片路径换到该源
+        :param primary_uri: 主源的媒体列表 URL，用于把主列表中的切片地址映射到该源
+        """
+        self.base_uri = base_uri
+        self.host = urlparse(base_uri).netloc
+        self.segments = segments
+        self.primary_uri = primary_uri
+        self.throughput = None    # 字节/秒 (EWMA)
+        self.completed = 0
+        self.failures = 0
+        self.bytes = 0
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self._consecutive_failures = 0
+
+    def resolve(self, segment, idx):
+        """
+        :return: (切片 URL, 用于解密的 segment, 解析 key URI 的 base)
+        """
+        if self.segments is not None:
+            own = self.segments[idx]
+            return urljoin(self.base_uri, own.uri), own, self.base_uri
+        # 切片可能来自中途切换后的其他子流，按它所在的列表解析相对路径
+        segment_base = getattr(segment, "base_uri", None) or self.primary_uri or self.base_uri
+        if self.primary_uri is None:
+            return urljoin(segment_base, segment.uri), segment, segment_base
+
+        # 用户指定的镜像: 主列表里的切片地址换成镜像地址，密钥仍从主源获取
+        url = urljoin(segment_base, segment.uri)
+        primary_dir = urljoin(self.primary_uri, ".")
+        if url.startswith(primary_dir):
+            return urljoin(self.base_uri, ".") + url[len(primary_dir):], segment, segment_base
+        parsed = urlparse(url)
+        if parsed.netloc == urlparse(self.primary_uri).netloc:
+            mirror = urlparse(self.base_uri)
+            return parsed._replace(scheme=mirror.scheme, netloc=mirror.netloc).geturl(), segment, segment_base
+        return url, segment, segment_base  # 切片在第三方地址，无法换源
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.cooldown_until
+
+
+class MirrorSet:
+    """
+    多源切片调度
+    - 新请求分配给 "吞吐量 / (在途数 + 1)" 最高的源，快的源分到更多切片；没有测量过的源按最快的源估计，保证每个源都被试到
+    - 请求失败的源进入指数递增的冷却期，期间新请求 (包括重试) 自动转到其他源
+    - 对冲请求可以避开原请求所用的源
+    """
+
+    EWMA_ALPHA = 0.2
+    BASE_COOLDOWN = 2.0
+    MAX_COOLDOWN = 60.0
+
+    def __init__(self, primary_uri):
+        self.primary = Mirror(primary_uri)
+        self.mirrors = [self.primary]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.mirrors)
+
+    def add_base(self, base_uri):
+        """添加用户指定的镜像地址 (同一媒体列表在其他主机上的 URL 或目录)"""
+        if any(m.base_uri == base_uri for m in self.mirrors):
+            return
+        self.mirrors.append(Mirror(base_uri, primary_uri=self.primary.base_uri))
+
+    def add_redundant(self, base_uri, segments):
+        """添加冗余子流 (切片布局与主列表相同)"""
+        if any(m.base_uri == base_uri for m in self.mirrors):
+            return
+        self.mirrors.append(Mirror(base_uri, segments=list(segments)))
+
+    def drop_redundant(self):
+        """移除冗余子流 (切换子流后它们的切片不再对应)"""
+        with self._lock:
+            self.mirrors = [m for m in self.mirrors if m.segments is None]
+
+    @property
+    def total_bytes(self):
+        with self._lock:
+            return sum(m.bytes for m in self.mirrors)
+
+    def has_healthy(self):
+        with self._lock:
+            return any(m.healthy for m in self.mirrors)
+
+    def acquire(self, avoid=None):
+        """选择一个源并占用在途名额；avoid 为尽量避开的源"""
+        with self._lock:
+            candidates = [m for m in self.mirrors if m.healthy] or [
+                min(self.mirrors, key=lambda m: m.cooldown_until)
+            ]
+            if avoid is not None and len(candidates) > 1:
+                candidates = [m for m in candidates if m is not avoid]
+            known = [m.throughput for m in self.mirrors if m.throughput]
+            optimistic = max(known) if known else 1.0
+            mirror = max(candidates, key=lambda m: (m.throughput or optimistic) / (m.in_flight + 1))
+            mirror.in_flight += 1
+            return mirror
+
+    def release(self, mirror, nbytes=0, elapsed=None, failed=False):
+        """
+        归还在途名额
+        :param elapsed: 成功时的耗时 (秒)，用于更新吞吐量
+        :param failed: 请求失败，该源进入冷却期
+        """
+        with self._lock:
+            mirror.in_flight -= 1
+            if failed:
+                mirror.failures += 1
+                mirror._consecutive_failures += 1
+                cooldown = min(self.MAX_COOLDOWN, self.BASE_COOLDOWN * 2 ** (mirror._consecutive_failures - 1))
+                mirror.cooldown_until = time.monotonic() + cooldown
+            elif elapsed is not None:
+                mirror.completed += 1
+                mirror.bytes += nbytes
+                mirror._consecutive_failures = 0
+                rate = nbytes / max(elapsed, 1e-3)
+                mirror.throughput = rate if mirror.throughput is None else (
+                    self.EWMA_ALPHA * rate + (1 - self.EWMA_ALPHA) * mirror.throughput
+                )
+
+    def report(self):
+        with self._lock:
+            return [
+                {
+                    "host": m.host,
+                    "uri": m.base_uri,
+                    "completed": m.completed,
+                    "failures": m.failures,
+                    "mb": round(m.bytes / 1024 / 1024, 1),
+                    "throughput_mbps": round(m.throughput / 1024 / 1024, 2) if m.throughput else None,
+                }
+                for m in self.mirrors
+            ]
@@ -0,0 +1,378 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections.abc import Sequence
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import urljoin
+
+_ATTRIBUTE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+_URI_LINE = re.compile(r'^[ \t]*[^#\s]', re.M)
+_KEY_LINE = re.compile(r'^#EXT-X-KEY:(.*)$', re.M)
+_MAP_LINE = re.compile(r'^[ \t]*#EXT-X-MAP:', re.M)
+
+
+def parse_attributes(value):
+    """解析属性列表 (KEY=VALUE,...)，带引号的值去掉引号"""
+    return {name: v[1:-1] if v.startswith('"') else v for name, v in _ATTRIBUTE.findall(value)}
+
+
+class Key:
+    __slots__ = ("method", "uri", "iv")
+
+    def __init__(self, method, uri=None, iv=None):
+        self.method = method
+        self.uri = uri
+        self.iv = iv
+
+    @classmethod
+    def parse(cls, value):
+        attrs = parse_attributes(value)
+        return cls(attrs.get("METHOD"), attrs.get("URI"), attrs.get("IV"))
+
+
+class InitSection:
+    """
+    EXT-X-MAP 指定的媒体初始化段 (fMP4 的 ftyp/moov)，属性名与 m3u8 库一致 (uri / byterange / base_uri)
+    byterange 统一为 "长度@偏移" 字符串 (省略偏移时为 0)；key 为标签出现时生效的 EXT-X-KEY，初始化段按它加密
+    地址和字节范围相同的初始化段视为同一个
+    """
+
+    __slots__ = ("uri", "byterange", "base_uri", "key")
+
+    def __init__(self, uri, byterange=None, base_uri=None, key=None):
+        self.uri = uri
+        self.byterange = byterange
+        self.base_uri = base_uri
+        self.key = key
+
+    @property
+    def absolute_uri(self):
+        return urljoin(self.base_uri, self.uri) if self.base_uri else self.uri
+
+    def __eq__(self, other):
+        if not isinstance(other, InitSection):
+            return NotImplemented
+        return (self.absolute_uri, self.byterange) == (other.absolute_uri, other.byterange)
+
+    def __hash__(self):
+        return hash((self.absolute_uri, self.byterange))
+
+    @classmethod
+    def parse(cls, value, base_uri=None, key=None):
+        attrs = parse_attributes(value)
+        byterange = attrs.get("BYTERANGE")
+        if byterange and "@" not in byterange:
+            byterange += "@0"
+        return cls(attrs.get("URI"), byterange, base_uri, key)
+
+
+class Segment:
+    """
+    媒体列表中的一个切片，属性名与 m3u8 库一致
+    (uri / duration / key / byterange / media_sequence / base_uri / init_section)
+    byterange 统一为 "长度@偏移" 字符串，省略的偏移已按上一个切片的结束位置补全；
+    init_section 为切片所用的 InitSection (没有 EXT-X-MAP 时为 None)
+    """
+
+    __slots__ = ("uri", "duration", "title", "key", "byterange", "media_sequence", "base_uri", "init_section")
+
+    def __init__(self, uri, duration=None, title=None, key=None, byterange=None, media_sequence=None,
+                 base_uri=None, init_section=None):
+        self.uri = uri
+        self.duration = duration
+        self.title = title
+        self.key = key
+        self.byterange = byterange
+        self.media_sequence = media_sequence
+        self.base_uri = base_uri
+        self.init_section = init_section
+
+    @property
+    def absolute_uri(self):
+        return urljoin(self.base_uri, self.uri) if self.base_uri else self.uri
+
+
+class StreamInfo:
+    __slots__ = ("bandwidth", "resolution", "codecs")
+
+    def __init__(self, bandwidth=None, resolution=None, codecs=None):
+        self.bandwidth = bandwidth
+        self.resolution = resolution  # (宽, 高) 或 None
+        self.codecs = codecs
+
+
+class VariantStream:
+    """主列表中的一个 EXT-X-STREAM-INF 子流"""
+
+    __slots__ = ("uri", "stream_info", "base_uri")
+
+    def __init__(self, uri, stream_info, base_uri=None):
+        self.uri = uri
+        self.stream_info = stream_info
+        self.base_uri = base_uri
+
+    @property
+    def absolute_uri(self):
+        return urljoin(self.base_uri, self.uri) if self.base_uri else self.uri
+
+    @classmethod
+    def parse(cls, value, uri, base_uri):
+        attrs = parse_attributes(value)
+        bandwidth = attrs.get("BANDWIDTH")
+        resolution = attrs.get("RESOLUTION")
+        if resolution:
+            width, _, height = resolution.lower().partition("x")
+            resolution = (int(width), int(height)) if width.isdigit() and height.isdigit() else None
+        return cls(uri, StreamInfo(int(bandwidth) if bandwidth and bandwidth.isdigit() else None,
+                                   resolution or None, attrs.get("CODECS")), base_uri)
+
+
+class SegmentList(Sequence):
+    """
+    按需解析的切片列表：按下标 / 迭代访问到哪里才解析到哪里，调度器边取切片边解析
+    len() 由预先扫描的 URI 行数给出，不触发解析；多个线程同时访问是安全的
+    """
+
+    def __init__(self, source, count):
+        self._items = []
+        self._source = source
+        self._count = count
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            stop = index.stop
+            if stop is None or stop < 0 or (index.start or 0) < 0:
+                self._fill(self._count)
+            else:
+                self._fill(stop)
+            return self._items[index]
+        self._fill(self._count if index < 0 else index + 1)
+        return self._items[index]
+
+    def __iter__(self):
+        i = 0
+        while True:
+            if i >= len(self._items):
+                self._fill(i + 1)
+                if i >= len(self._items):
+                    return
+            yield self._items[i]
+            i += 1
+
+    def _fill(self, n):
+        """解析到至少 n 个切片 (或列表结束)"""
+        if len(self._items) >= n or self._source is None:
+            return
+        with self._lock:
+            while len(self._items) < n and self._source is not None:
+                segment = next(self._source, None)
+                if segment is None:
+                    self._source = None
+                    self._count = len(self._items)
+                else:
+                    self._items.append(segment)
+
+
+class Playlist:
+    """
+    轻量的 m3u8 解析器，只处理下载流程用到的标签:
+    EXTINF / EXT-X-KEY / EXT-X-BYTERANGE / EXT-X-MAP / EXT-X-MEDIA-SEQUENCE / EXT-X-TARGETDURATION /
+    EXT-X-STREAM-INF / EXT-X-ENDLIST，其余标签忽略
+    - 构造时只读列表头部；媒体列表的切片在访问 segments 时逐个解析 (见 SegmentList)
+    - 对外属性与 m3u8 库的 M3U8 对象一致 (segments / playlists / is_variant / is_endlist /
+      media_sequence / target_duration / keys)
+    """
+
+    def __init__(self, text, uri=None):
+        """
+        :param text: 播放列表内容
+        :param uri: 播放列表 URL，用于解析相对路径
+        """
+        self.uri = uri
+        self.base_uri = uri
+        self.media_sequence = None
+        self.target_duration = None
+        self.is_endlist = "#EXT-X-ENDLIST" in text
+        self.playlists = []
+        self._keys = None
+        self._text = text
+        lines = iter(text.splitlines())
+        first = self._read_header(lines)
+        self.is_variant = first is not None and first.startswith("#EXT-X-STREAM-INF:")
+        if self.is_variant:
+            self._read_variants(first, lines)
+            self.segments = SegmentList(iter(()), 0)
+        else:
+            count = len(_URI_LINE.findall(text))
+            self.segments = SegmentList(self._iter_segments(first, lines), count)
+
+    @property
+    def keys(self):
+        """列表中出现的所有加密方式 (按出现顺序去重)，不需要解析切片"""
+        if self._keys is None:
+            seen = {}
+            for value in _KEY_LINE.findall(self._text):
+                seen.setdefault(value.strip(), None)
+            self._keys = [Key.parse(value) for value in seen]
+        return self._keys
+
+    @property
+    def has_init_section(self):
+        """切片是否带 EXT-X-MAP 初始化段 (fMP4)，不需要解析切片"""
+        return _MAP_LINE.search(self._text) is not None
+
+    def _read_header(self, lines):
+        """读取到第一个切片或子流相关的行为止，返回该行 (列表为空时返回 None)"""
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+                self.media_sequence = int(line[22:])
+            elif line.startswith("#EXT-X-TARGETDURATION:"):
+                self.target_duration = float(line[22:])
+            elif line[0] != "#" or line.startswith(("#EXTINF:", "#EXT-X-KEY:", "#EXT-X-BYTERANGE:",
+                                                     "#EXT-X-MAP:", "#EXT-X-STREAM-INF:")):
+                return line
+        return None
+
+    def _read_variants(self, first, lines):
+        info = first
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("#EXT-X-STREAM-INF:"):
+                info = line
+            elif line[0] != "#" and info:
+                self.playlists.append(VariantStream.parse(info[18:], line, self.base_uri))
+                info = None
+
+    def _iter_segments(self, first, lines):
+        key = duration = title = byterange = init_section = None
+        range_uri, range_end = None, 0  # 上一个字节范围切片的 URI 和结束位置
+        sequence = self.media_sequence or 0
+        base_uri = self.base_uri
+        line = first
+        while line is not None:
+            if not line:
+                pass
+            elif line[0] != "#":
+                if byterange is not None:
+                    length, sep, offset = byterange.partition("@")
+                    if not sep:
+                        # 省略偏移时紧接同一资源上一个切片的结束位置 (RFC 8216 4.3.2.2)
+                        offset = range_end if line == range_uri else 0
+                    range_uri, range_end = line, int(offset) + int(length)
+                    byterange = f"{length}@{offset}"
+                yield Segment(line, duration, title, key, byterange, sequence, base_uri, init_section)
+                sequence += 1
+                duration = title = byterange = None
+            elif line.startswith("#EXTINF:"):
+                value, _, title = line[8:].partition(",")
+                duration = float(value)
+                title = title or None
+            elif line.startswith("#EXT-X-KEY:"):
+                key = Key.parse(line[11:])
+            elif line.startswith("#EXT-X-BYTERANGE:"):
+                byterange = line[17:]
+            elif line.startswith("#EXT-X-MAP:"):
+                init_section = InitSection.parse(line[11:], base_uri, key)
+            line = next(lines, None)
+            if line is not None:
+                line = line.strip()
+
+
+def strong_last_modified(headers):
+    """
+    Last-Modified 只有秒级精度，与 Date 在同一秒内时列表可能还会再变 (RFC 7232 2.2.2)，
+    此时不用它做条件请求，否则会错过同一秒内的更新
+    """
+    last_modified = headers.get("Last-Modified")
+    date = headers.get("Date")
+    if not last_modified or not date:
+        return None
+    try:
+        if (parsedate_to_datetime(date) - parsedate_to_datetime(last_modified)).total_seconds() < 1:
+            return None
+    except (TypeError, ValueError):
+        return None
+    return last_modified
+
+
+class PlaylistCache:
+    """
+    磁盘上的播放列表缓存，多次运行之间保留
+    只保存带 ETag / Last-Modified 的响应；再次请求同一地址时带条件请求头，服务器返回 304 时直接使用缓存的内容
+    """
+
+    MAX_ENTRIES = 256
+
+    def __init__(self, path=None):
+        """
+        :param path: 缓存目录，默认 ~/.cache/smart-downloader/playlists
+        """
+        self.path = Path(path).expanduser() if path else Path.home() / ".cache" / "smart-downloader" / "playlists"
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def load(self, url):
+        """返回缓存条目 dict (url / final_url / etag / last_modified / text)，没有时返回 None"""
+        try:
+            return json.loads(self._entry_path(url).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url, final_url, headers, text):
+        etag = headers.get("ETag")
+        last_modified = strong_last_modified(headers)
+        path = self._entry_path(url)
+        if not etag and not last_modified:
+            path.unlink(missing_ok=True)
+            return
+        entry = {"url": url, "final_url": final_url, "etag": etag, "last_modified": last_modified,
+                 "text": text, "stored_at": time.time()}
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        try:
+            tmp_path.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            return
+        self._evict()
+
+    def _entry_path(self, url):
+        return self.path / (hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".json"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    continue
+        if len(entries) <= self.MAX_ENTRIES:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.MAX_ENTRIES]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
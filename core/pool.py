@@ -0,0 +1,146 @@
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+
+_NO_TASK = object()
+
+
+class BandwidthLimiter:
+    """
+    令牌桶限速，多个任务共享时即为全局带宽上限
+    每读取一块数据调用 consume(字节数)，令牌不足时阻塞，由 TCP 反压把实际下载速度限制在 rate 附近
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: 字节/秒
+        :param burst: 桶容量 (字节)，默认 0.1 秒的流量，至少 64KB，避免启动时的突发越过上限太多
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or max(64 * 1024, self.rate / 10))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        """取走 nbytes 个令牌，不足时等待 (允许透支，欠账由之后的请求等待偿还)"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class SegmentPool:
+    """
+    跨任务共享的切片线程池
+    - 固定数量的工作线程，即所有任务同时处理的切片数上限
+    - 按优先级 (数值大者优先) 取任务，同优先级先提交先执行，高优先级任务的切片不会排在低优先级任务后面
+    - 任务可以带 key (通常是主机) 和该 key 的并发上限: 某个 key 正在执行的任务数达到上限时跳过它的任务，
+      先执行其他 key 的任务，工作线程不会全部阻塞在一个已经用满并发名额的主机上
+    - submit 返回标准的 concurrent.futures.Future，可直接用于 concurrent.futures.wait / cancel
+    """
+
+    LIMIT_POLL = 0.5  # 秒，只剩受限的任务时重新检查并发上限的间隔 (上限也可能由池外的请求改变)
+
+    def __init__(self, max_workers=32, name="segment"):
+        self.max_workers = max_workers
+        self._queues = {}     # key -> 任务堆 [(-priority, seq, future, fn, args, kwargs)]
+        self._limits = {}     # key -> 返回当前并发上限的函数
+        self._running = collections.Counter()  # key -> 正在执行的任务数
+        self._pending = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True) for i in range(max_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn, *args, priority=0, key=None, limit=None, **kwargs):
+        """
+        :param key: 任务所属的 key (如主机名)，None 表示不受限
+        :param limit: 返回该 key 当前并发上限的函数 (如主机的自适应并发数)，同一 key 以最后一次提供的为准
+        """
+        future = concurrent.futures.Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("线程池已关闭")
+            heapq.heappush(self._queues.setdefault(key, []), (-priority, next(self._seq), future, fn, args, kwargs))
+            if limit is not None:
+                self._limits[key] = limit
+            self._pending += 1
+            self._cond.notify()
+        return future
+
+    def pending(self):
+        """排队中 (尚未开始) 的任务数"""
+        with self._cond:
+            return self._pending
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self._cond:
+            self._shutdown = True
+            if cancel_futures:
+                for queue in self._queues.values():
+                    for item in queue:
+                        item[2].cancel()
+                self._queues.clear()
+                self._pending = 0
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=exc[0] is None, cancel_futures=exc[0] is not None)
+
+    def _next_key(self):
+        """可以执行的队首任务中优先级最高的那个所属的 key；没有可执行的任务时返回 _NO_TASK"""
+        best = _NO_TASK
+        for key, queue in self._queues.items():
+            limit = self._limits.get(key)
+            if limit is not None and self._running[key] >= max(1, limit()):
+                continue
+            if best is _NO_TASK or queue[0] < self._queues[best][0]:
+                best = key
+        return best
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    key = self._next_key()
+                    if key is not _NO_TASK:
+                        break
+                    if self._shutdown and not self._pending:
+                        return
+                    self._cond.wait(self.LIMIT_POLL if self._pending else None)
+                queue = self._queues[key]
+                _, _, future, fn, args, kwargs = heapq.heappop(queue)
+                if not queue:
+                    del self._queues[key]
+                self._pending -= 1
+                self._running[key] += 1
+            try:
+                if future.set_running_or_notify_cancel():  # 否则已被取消
+                    try:
+                        result = fn(*args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+            finally:
+                with self._cond:
+                    self._running[key] -= 1
+                    self._cond.notify_all()
@@ -0,0 +1,150 @@
+import io
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+_active = None  # 当前激活的 PhaseTimer，span() 记录到这里
+
+
+class PhaseTimer:
+    """
+    按阶段记录墙钟耗时：span(name) 包住的代码计时一次，可嵌套，子阶段记为 "父阶段/子阶段"
+    嵌套关系按线程分别维护；批量任务在多个线程中并行时，同名阶段的耗时会累加 (可能超过总耗时)
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._totals = {}  # 阶段 -> [次数, 总耗时]，按首次开始的顺序
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @contextmanager
+    def span(self, name):
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(name)
+        path = "/".join(stack)
+        with self._lock:
+            # 开始时登记，汇总表中父阶段排在子阶段之前
+            entry = self._totals.setdefault(path, [0, 0.0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            with self._lock:
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def rows(self):
+        """[(阶段, 次数, 总耗时秒, 占总耗时比例)]"""
+        wall = self.elapsed
+        with self._lock:
+            items = list(self._totals.items())
+        return [(path, count, total, total / wall if wall > 0 else 0.0) for path, (count, total) in items]
+
+    def table(self):
+        """阶段耗时汇总表 (文本)"""
+        rows = self.rows()
+        # 子阶段按嵌套深度缩进
+        labels = ["  " * path.count("/") + path.rsplit("/", 1)[-1] for path, *_ in rows]
+        width = max([len(label) for label in labels] + [4]) + 4
+        lines = [f"{'阶段':<{width}}{'次数':>8}{'耗时 s':>10}{'占比':>8}"]
+        for label, (_, count, total, share) in zip(labels, rows):
+            lines.append(f"{label:<{width}}{count:>8}{total:>10.3f}{share:>8.1%}")
+        lines.append(f"{'总耗时':<{width}}{'':>8}{self.elapsed:>10.3f}")
+        return "\n".join(lines)
+
+
+def span(name):
+    """在当前激活的 PhaseTimer 中记录一个阶段；没有激活时什么也不做"""
+    timer = _active
+    return timer.span(name) if timer is not None else nullcontext()
+
+
+class Profiler:
+    """
+    cProfile 采样主线程和之后新建的所有线程 (下载线程池、对冲线程等)，结束时合并为一份统计
+    - Python 3.12+ 的 cProfile 基于 sys.monitoring，一个 Profile 就覆盖所有线程，且同一时间只能启用一个
+    - 更早的版本中 Profile 只对启用它的线程生效，每个新线程启动时启用自己的 Profile
+    """
+
+    PER_THREAD = sys.version_info < (3, 12)
+
+    def __init__(self):
+        import cProfile  # 只有 --profile 时才需要
+        import pstats
+
+        self._cprofile = cProfile
+        self._pstats = pstats
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._main = None
+
+    def start(self):
+        self._main = self._new_profile()
+        if self.PER_THREAD:
+            threading.setprofile(self._thread_bootstrap)
+        self._main.enable()
+
+    def stop(self):
+        self._main.disable()
+        if self.PER_THREAD:
+            threading.setprofile(None)
+        with self._lock:
+            profiles = list(self._profiles)
+        for profile in profiles[1:]:
+            profile.disable()
+        stats = self._pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            try:
+                stats.add(profile)
+            except TypeError:  # 线程还没有执行任何函数，没有统计数据
+                continue
+        return stats
+
+    def _new_profile(self):
+        profile = self._cprofile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def _thread_bootstrap(self, frame, event, arg):
+        # 新线程启动时调用一次，换成该线程自己的 cProfile
+        self._new_profile().enable()
+
+
+@contextmanager
+def profile_run(profile_path=None, top=40):
+    """
+    在一次运行期间激活 PhaseTimer，结束时打印各阶段耗时汇总表
+    :param profile_path: 同时用 cProfile 采样，统计写入该文件 (可用 snakeviz / pstats 查看)，
+                         阶段汇总表和累计耗时最高的函数写入同名 .txt 文件；None 表示只计时
+    :param top: .txt 文件中列出的函数数
+    """
+    global _active
+    timer = PhaseTimer()
+    previous, _active = _active, timer
+    profiler = Profiler() if profile_path else None
+    if profiler:
+        profiler.start()
+    try:
+        yield timer
+    finally:
+        stats = profiler.stop() if profiler else None
+        _active = previous
+        table = timer.table()
+        print(f"\n⏱️  阶段耗时\n{table}")
+        if stats is not None:
+            stats.dump_stats(profile_path)
+            out = io.StringIO()
+            stats.stream = out
+            stats.sort_stats("cumulative").print_stats(top)
+            with open(f"{profile_path}.txt", "w", encoding="utf-8") as f:
+                f.write(table + "\n\n" + out.getvalue())
+            print(f"📊 性能分析已保存: {profile_path} ({profile_path}.txt)")
@@ -0,0 +1,138 @@
+import re
+
+_CONTENT_RANGE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+|\*)")
+
+
+class IncompleteBody(IOError):
+    """响应体比预期的字节数短"""
+
+
+def parse_byterange(value):
+    """EXT-X-BYTERANGE 的 "长度@偏移" -> (偏移, 长度)，没有或无效时返回 None"""
+    if not value:
+        return None
+    length, _, offset = value.partition("@")
+    try:
+        return int(offset or 0), int(length)
+    except ValueError:
+        return None
+
+
+def range_header(offset, length):
+    return f"bytes={offset}-{offset + length - 1}"
+
+
+def split_range(offset, length, parts):
+    """把 [offset, offset + length) 均分为 parts 段 [(偏移, 长度)]"""
+    size = -(-length // parts)
+    return [(start, min(size, offset + length - start)) for start in range(offset, offset + length, size)]
+
+
+def range_skip(status, headers, offset):
+    """
+    Range 请求的响应体开头需要跳过的字节数 (同步与异步引擎共用)
+    服务器忽略 Range 返回 200 时为 offset；返回 206 但范围起点与请求不一致时抛出 ValueError
+    """
+    if status != 206:
+        return offset
+    match = _CONTENT_RANGE.match(headers.get("Content-Range", ""))
+    if match and int(match.group(1)) != offset:
+        raise ValueError(f"服务器返回的范围与请求不一致: {headers.get('Content-Range')}")
+    return 0
+
+
+def iter_range(response, offset, length, chunk_size=64 * 1024):
+    """
+    读取 Range 请求的响应体，恰好生成 length 个字节
+    服务器忽略 Range 返回 200 时跳过前 offset 个字节；返回的范围与请求不一致时抛出 ValueError
+    """
+    skip = range_skip(response.status_code, response.headers, offset)
+    remaining = length
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        if skip:
+            if len(chunk) <= skip:
+                skip -= len(chunk)
+                continue
+            chunk = chunk[skip:]
+            skip = 0
+        if len(chunk) >= remaining:
+            yield chunk[:remaining]
+            return
+        remaining -= len(chunk)
+        yield chunk
+    raise IncompleteBody(f"响应体不完整: 还差 {remaining} 字节")
+
+
+class ChunkReader:
+    """把一个响应的数据块按字节数依次分给多个切片 (合并请求时使用)"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._rest = b""
+
+    def take(self, n=None):
+        """生成接下来的 n 个字节；n 为 None 时生成剩余的全部数据"""
+        if n is None:
+            if self._rest:
+                yield self._rest
+                self._rest = b""
+            yield from self._chunks
+            return
+        while n > 0:
+            if not self._rest:
+                self._rest = next(self._chunks, b"")
+                if not self._rest:
+                    raise IncompleteBody(f"响应体不完整: 还差 {n} 字节")
+            chunk = self._rest[:n]
+            self._rest = self._rest[len(chunk):]
+            n -= len(chunk)
+            yield chunk
+
+
+class SegmentGroup:
+    """
+    同一资源上字节范围首尾相接的若干相邻切片，合并为一次 Range 请求下载
+    重试 / 对冲时跳过已经完成的切片
+    """
+
+    def __init__(self, items):
+        self.items = items    # [(idx, segment)]
+        self.results = {}     # idx -> 临时文件路径 (stream 模式为 None)
+
+    @property
+    def indices(self):
+        return [idx for idx, _ in self.items]
+
+    def pending(self):
+        return [(idx, segment) for idx, segment in self.items if idx not in self.results]
+
+
+def coalesce_jobs(jobs, max_bytes):
+    """
+    把 (idx, segment) 序列中连续、URI 相同且字节范围首尾相接的切片合并为 (首个 idx, SegmentGroup)，
+    单个切片原样生成；合并后的请求不超过 max_bytes。None (直播暂无新切片) 原样传递
+    """
+    group = []
+    end = size = 0
+    for job in jobs:
+        if job is not None:
+            idx, segment = job
+            span = parse_byterange(segment.byterange)
+            if (group and span and idx == group[-1][0] + 1 and span[0] == end and size + span[1] <= max_bytes
+                    and segment.uri == group[-1][1].uri and segment.base_uri == group[-1][1].base_uri):
+                group.append(job)
+                end += span[1]
+                size += span[1]
+                continue
+        if group:
+            yield group[0] if len(group) == 1 else (group[0][0], SegmentGroup(group))
+            group = []
+        if job is None:
+            yield None
+        elif span and span[1] < max_bytes:
+            group = [job]
+            end, size = span[0] + span[1], span[1]
+        else:
+            yield job
+    if group:
+        yield group[0] if len(group) == 1 else (group[0][0], SegmentGroup(group))
@@ -0,0 +1,65 @@
+import shutil
+import subprocess
+import tempfile
+
+
+class FFmpegRemuxer:
+    """
+    实时封装：把按序到达的 MPEG-TS 数据通过 stdin 交给 `ffmpeg -c copy`，直接输出 MP4 / fMP4
+    不重新编码，也不需要下载完成后再读一遍整个文件。
+    - mp4: 普通 MP4，结束时由 ffmpeg 把 moov 移到文件头 (faststart)，便于边下边播和拖动
+    - fmp4: 分片 MP4，边写边可用，完全单遍
+    对外提供与文件对象相同的 write / flush / close 接口，可作为 StreamingMerger 的输出端。
+    """
+
+    MOVFLAGS = {
+        "mp4": "+faststart",
+        "fmp4": "frag_keyframe+empty_moov+default_base_moof",
+    }
+
+    def __init__(self, output_path, fmt="mp4"):
+        if fmt not in self.MOVFLAGS:
+            raise ValueError(f"不支持的封装格式: {fmt}")
+        self.output_path = output_path
+        self._stderr = tempfile.TemporaryFile()
+        cmd = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "mpegts", "-i", "pipe:0",
+            "-c", "copy",
+            "-movflags", self.MOVFLAGS[fmt],
+            "-f", "mp4", str(output_path),
+        ]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr)
+
+    @staticmethod
+    def available():
+        return shutil.which("ffmpeg") is not None
+
+    def write(self, data):
+        try:
+            self._proc.stdin.write(data)
+        except BrokenPipeError:
+            self._proc.wait()
+            raise RuntimeError(f"ffmpeg 封装进程已退出: {self._error_tail()}")
+
+    def flush(self):
+        try:
+            self._proc.stdin.flush()
+        except BrokenPipeError:
+            pass  # 在下一次 write / close 时报告错误
+
+    def close(self):
+        """关闭输入并等待 ffmpeg 写完文件，失败时抛出 RuntimeError"""
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self._proc.wait()
+        error = self._error_tail()
+        self._stderr.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg 封装失败 (退出码 {returncode}): {error}")
+
+    def _error_tail(self, limit=2000):
+        self._stderr.seek(0)
+        return self._stderr.read().decode("utf-8", errors="replace")[-limit:].strip()
@@ -0,0 +1,238 @@
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+from core.concurrency import AdaptiveConcurrency
+from core.downloader import M3U8Downloader
+from core.manifest import JobManifest
+from core.pool import BandwidthLimiter, SegmentPool
+from core.utils import get_download_dir
+
+
+class DownloadQueue:
+    """
+    多任务下载队列
+    - 所有任务共享一个切片线程池 (全局并发上限)、一套按主机的自适应并发控制 (同一主机的并发上限对所有任务生效)
+      和一个令牌桶 (总带宽上限)
+    - 同时运行 max_jobs 个任务，按优先级 (数值大者优先)、再按加入顺序启动；高优先级任务的切片在线程池中优先执行
+    - 队列保存在输出目录的 .download_queue.json 中，中断后重新运行会继续未完成的任务 (切片级断点续传)
+    """
+
+    VERSION = 1
+    FILENAME = ".download_queue.json"
+
+    def __init__(self, output_dir=None, max_jobs=3, workers=32, min_workers=2, max_workers=8, rate_limit=None,
+                 **downloader_options):
+        """
+        :param output_dir: 输出目录，队列文件也保存在这里
+        :param max_jobs: 同时运行的任务数
+        :param workers: 共享线程池大小，即所有任务同时下载的切片数上限
+        :param min_workers: 每个主机的最小并发切片请求数
+        :param max_workers: 每个主机的最大并发切片请求数 (所有任务合计)
+        :param rate_limit: 总下载速度上限 (字节/秒)，None 表示不限
+        :param downloader_options: 传给每个 M3U8Downloader 的其他参数 (merge_mode / remux 等)
+        """
+        self.download_dir = get_download_dir(custom_path=output_dir)
+        self.path = self.download_dir / self.FILENAME
+        self.max_jobs = max_jobs
+        self.workers = workers
+        self.max_workers = max_workers
+        self.concurrency = AdaptiveConcurrency(
+            min_workers=min_workers, max_workers=max_workers, initial_workers=min(10, max_workers)
+        )
+        self.bandwidth = BandwidthLimiter(rate_limit) if rate_limit else None
+        self.downloader_options = downloader_options
+        self.jobs = []
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def add(self, url, priority=0, title=None):
+        """
+        加入一个任务；同一链接已在队列中时只更新其优先级 (已失败的任务重新排队)
+        :return: 任务 dict
+        """
+        job_id = JobManifest.make_job_id(url)
+        with self._lock:
+            for job in self.jobs:
+                if job["id"] == job_id:
+                    job["priority"] = priority
+                    if job["status"] == "failed":
+                        job["status"] = "pending"
+                        job["error"] = None
+                    break
+            else:
+                self._seq += 1
+                job = {
+                    "id": job_id,
+                    "url": url,
+                    "title": title,
+                    "priority": priority,
+                    "seq": self._seq,
+                    "status": "pending",
+                    "output": None,
+                    "error": None,
+                    "added_at": time.time(),
+                    "finished_at": None,
+                }
+                self.jobs.append(job)
+            self._save()
+        return job
+
+    def pending(self):
+        with self._lock:
+            return [job for job in self.jobs if job["status"] == "pending"]
+
+    def run(self):
+        """
+        运行队列直到没有待处理的任务 (运行期间 add 的任务也会被执行)
+        :return: 本次运行结束的任务列表
+        """
+        pool = SegmentPool(max_workers=self.workers)
+        results = queue.Queue()
+        finished = []
+        running = 0
+        started = time.monotonic()
+
+        def runner(job):
+            try:
+                output, error = self._run_job(job, pool)
+            except Exception as e:
+                output, error = None, str(e)
+            results.put((job, output, error))
+
+        try:
+            while True:
+                while running < self.max_jobs:
+                    job = self._next_job()
+                    if job is None:
+                        break
+                    print(f"\n▶️  开始任务 [{job['id']}] (优先级 {job['priority']}): {job['url']}")
+                    # 守护线程: 中断时不等待正在下载的任务，进度已由各任务清单保存
+                    threading.Thread(target=runner, args=(job,), name=f"job-{job['id']}", daemon=True).start()
+                    running += 1
+                if not running:
+                    break
+                job, output, error = results.get()
+                running -= 1
+                self._finish(job, output, error)
+                finished.append(job)
+        except KeyboardInterrupt:
+            print("\n⏹️  队列已中断，未完成的任务下次运行时继续")
+            raise
+        finally:
+            # 中断时正在运行的任务保持 running 状态，下次加载时重新排队
+            pool.shutdown(wait=False, cancel_futures=True)
+            with self._lock:
+                self._save()
+
+        self._report(finished, time.monotonic() - started)
+        return finished
+
+    def _next_job(self):
+        with self._lock:
+            pending = [job for job in self.jobs if job["status"] == "pending"]
+            if not pending:
+                return None
+            job = min(pending, key=lambda j: (-j["priority"], j["seq"]))
+            job["status"] = "running"
+            self._save()
+            return job
+
+    def _run_job(self, job, pool):
+        url, title = job["url"], job["title"]
+        if ".m3u8" not in url or url.strip().endswith(".html"):
+            url, title = self._extract(url)
+            if not url:
+                return None, "未能在网页中找到 m3u8 链接"
+            title = job["title"] or title
+        downloader = M3U8Downloader(
+            url,
+            output_dir=str(self.download_dir),
+            output_filename=title,
+            max_workers=self.max_workers,
+            resume=not self.downloader_options.get("live"),
+            pool=pool,
+            concurrency=self.concurrency,
+            bandwidth=self.bandwidth,
+            priority=job["priority"],
+            **self.downloader_options,
+        )
+        return downloader.run()
+
+    def _extract(self, page_url):
+        """网页链接在任务运行时解析；浏览器来自共享的浏览器池，池的大小限制同时打开的浏览器数"""
+        from core.extractor import WebExtractor
+
+        return WebExtractor().extract_m3u8(page_url)
+
+    def _finish(self, job, output, error):
+        with self._lock:
+            job["status"] = "done" if output else "failed"
+            job["output"] = output
+            job["error"] = error
+            job["finished_at"] = time.time()
+            self._save()
+        if output:
+            print(f"\n✅ 任务 [{job['id']}] 完成: {output}")
+        else:
+            print(f"\n❌ 任务 [{job['id']}] 失败: {error}")
+
+    def _report(self, finished, elapsed):
+        done = sum(1 for job in finished if job["status"] == "done")
+        print(f"\n队列运行结束: 完成 {done} 个，失败 {len(finished) - done} 个，耗时 {elapsed:.1f} 秒")
+        for host, stats in self.concurrency.report().items():
+            print(f"并发控制 [{host}]: 稳定在 {stats['settled']} (平均 {stats['average']}, "
+                  f"峰值 {stats['peak']}, 限流/错误 {stats['throttled']} 次)")
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            print(f"⚠️  下载队列文件损坏，忽略: {e}")
+            return
+        if data.get("version") != self.VERSION:
+            return
+        self.jobs = data.get("jobs", [])
+        interrupted = 0
+        for job in self.jobs:
+            if job["status"] == "running":
+                job["status"] = "pending"
+                interrupted += 1
+        self._seq = max((job["seq"] for job in self.jobs), default=0)
+        remaining = sum(1 for job in self.jobs if job["status"] == "pending")
+        if remaining:
+            print(f"🔁 下载队列中有 {remaining} 个未完成的任务" + (f" (其中 {interrupted} 个上次被中断)" if interrupted else ""))
+
+    def _save(self):
+        """原子写入队列文件，调用方持有 self._lock"""
+        data = {"version": self.VERSION, "jobs": self.jobs}
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+
+def read_batch_file(path):
+    """
+    读取批量任务文件：每行一个链接，可在链接后用空白分隔一个整数优先级；空行和 # 开头的行忽略
+    :return: [(url, priority)]
+    """
+    entries = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split()
+        priority = 0
+        if len(parts) > 1:
+            try:
+                priority = int(parts[1])
+            except ValueError:
+                print(f"⚠️  无法解析优先级，按 0 处理: {line}")
+        entries.append((parts[0], priority))
+    return entries
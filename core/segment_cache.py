@@ -0,0 +1,179 @@
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+
+class CacheCorrupted(Exception):
+    """缓存条目的校验和不匹配"""
+
+
+class CacheEntry:
+    """
+    一个命中的缓存条目，按块读取原始切片数据 (未解密的响应内容)
+    读完最后一块时校验 sha1，不匹配则删除该条目并抛出 CacheCorrupted
+    """
+
+    def __init__(self, cache, path, digest, size):
+        self.path = path
+        self.size = size
+        self._cache = cache
+        self._digest = digest
+
+    def chunks(self, chunk_size=64 * 1024):
+        h = hashlib.sha1()
+        with open(self.path, 'rb') as f:
+            f.seek(SegmentCache.HEADER_SIZE)
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+                yield chunk
+        if h.digest() != self._digest:
+            self._cache._discard(self.path)
+            raise CacheCorrupted(f"切片缓存校验失败: {self.path.name}")
+
+
+class CacheWriter:
+    """流式写入一个缓存条目：先写临时文件，commit 时回填 sha1 并原子替换"""
+
+    def __init__(self, cache, path):
+        self.path = path
+        self.nbytes = 0
+        self._cache = cache
+        self._tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        self._tmp_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(b"\0" * SegmentCache.HEADER_SIZE)
+        self._sha1 = hashlib.sha1()
+
+    def write(self, data):
+        self.nbytes += len(data)
+        self._sha1.update(data)
+        self._file.write(data)
+
+    def commit(self):
+        self._file.seek(0)
+        self._file.write(self._sha1.digest())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        self._cache._added(self.nbytes + SegmentCache.HEADER_SIZE)
+
+    def abort(self):
+        self._file.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+
+class SegmentCache:
+    """
+    磁盘切片缓存，多个任务 / 进程共享同一目录
+    - 以 (切片 URL, 字节范围, 密钥 URI) 的 sha1 为文件名，保存未解密的响应内容，命中时照常解密，
+      因此不同任务的 IV / 输出方式不影响复用
+    - 每个条目开头保存内容的 sha1，读取时校验，损坏的条目自动删除
+    - 总大小超过上限时按最近使用时间 (命中时刷新 mtime) 淘汰最旧的条目
+    """
+
+    HEADER_SIZE = 20  # sha1 摘要
+    EVICT_TARGET = 0.9  # 淘汰到上限的 90%，避免每次写入都扫描目录
+
+    def __init__(self, path=None, max_bytes=10 * 1024 ** 3):
+        """
+        :param path: 缓存目录，默认 ~/.cache/smart-downloader/segments
+        :param max_bytes: 缓存总大小上限 (字节)
+        """
+        self.path = Path(path).expanduser() if path else Path.home() / ".cache" / "smart-downloader" / "segments"
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.stored = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._size = sum(size for _, size, _ in self._entries())
+
+    @staticmethod
+    def make_key(url, byterange=None, key_uri=None):
+        return hashlib.sha1(f"{url}\n{byterange or ''}\n{key_uri or ''}".encode("utf-8")).hexdigest()
+
+    def open(self, key):
+        """查找条目，命中返回 CacheEntry (并刷新其最近使用时间)，否则返回 None"""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                digest = f.read(self.HEADER_SIZE)
+            size = path.stat().st_size - self.HEADER_SIZE
+            os.utime(path)
+        except OSError:
+            return None
+        if len(digest) != self.HEADER_SIZE:
+            return None
+        return CacheEntry(self, path, digest, size)
+
+    def writer(self, key):
+        return CacheWriter(self, self._entry_path(key))
+
+    def record(self, hit, nbytes=0):
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.hit_bytes += nbytes
+            else:
+                self.misses += 1
+
+    def report(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_mb": round(self.hit_bytes / 1024 / 1024, 1),
+                "stored": self.stored,
+                "evicted": self.evicted,
+                "size_mb": round(self._size / 1024 / 1024, 1),
+            }
+
+    def _entry_path(self, key):
+        return self.path / key[:2] / key
+
+    def _entries(self):
+        """[(路径, 字节数, mtime)]，忽略临时文件"""
+        entries = []
+        for sub in os.scandir(self.path):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((Path(entry.path), st.st_size, st.st_mtime))
+        return entries
+
+    def _added(self, nbytes):
+        with self._lock:
+            self.stored += 1
+            self._size += nbytes
+            if self._size <= self.max_bytes:
+                return
+            # 其他进程也可能在写入同一目录，淘汰前按磁盘上的实际情况重新统计
+            entries = sorted(self._entries(), key=lambda e: e[2])
+            self._size = sum(size for _, size, _ in entries)
+            target = self.max_bytes * self.EVICT_TARGET
+            for path, size, _ in entries:
+                if self._size <= target:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                self._size -= size
+                self.evicted += 1
+
+    def _discard(self, path):
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except OSError:
+            return
+        with self._lock:
+            self._size -= size
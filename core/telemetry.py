@@ -0,0 +1,302 @@
+import bisect
+import collections
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
+PHASES = ("connect", "ttfb", "transfer", "decrypt", "write")
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)            # 秒
+SIZE_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)  # 字节
+
+
+def new_trace(idx, url):
+    """一个切片的计时记录，下载过程中逐步填写各阶段耗时 (秒)"""
+    trace = dict.fromkeys(PHASES, 0.0)
+    trace.update(idx=idx, url=url, bytes=0)
+    return trace
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class _HostStats:
+    def __init__(self):
+        self.segments = 0
+        self.bytes = 0
+        self.errors = 0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.duration = _Histogram(DURATION_BUCKETS)
+        self.size = _Histogram(SIZE_BUCKETS)
+
+
+class _JobState:
+    def __init__(self, url, total, done):
+        self.url = url
+        self.total = total
+        self.done = done
+        self.failed = 0
+        self.bytes = 0
+        self.status = "running"
+        self.started = time.monotonic()
+        self.recent = collections.deque()  # (时间, 字节数)，最近 RATE_WINDOW 秒完成的切片
+
+
+class Telemetry:
+    """
+    下载遥测：逐切片记录各阶段耗时 (建连 / 首字节 / 传输 / 解密 / 写入)、字节数、重试与错误，
+    按主机 (CDN) 汇总，并给出每个任务的当前速度和预计剩余时间
+    - trace_path: 每个事件写一行 JSON (JSON Lines)，供离线分析
+    - serve(port): 在后台线程提供 Prometheus 文本格式的 /metrics 和 JSON 格式的 /status
+    多个任务 (批量队列) 可共享同一个实例，事件和指标按任务 ID 区分
+    """
+
+    RATE_WINDOW = 10.0  # 速度与剩余时间按最近多少秒完成的切片计算
+
+    def __init__(self, trace_path=None):
+        """
+        :param trace_path: JSON Lines 跟踪文件路径 (追加写入)，None 表示不写文件
+        """
+        self.trace_path = trace_path
+        self.retries = 0
+        self._hosts = collections.defaultdict(_HostStats)
+        self._errors = collections.Counter()       # (主机, 错误类型) -> 次数
+        self._jobs = {}                            # 任务 ID -> _JobState
+        self._recorded = set()                     # 已记录的 (任务 ID, idx)，对冲请求双方都完成时只记一次
+        self._pending_retries = collections.Counter()  # (任务 ID, idx) -> 出错后重试的次数
+        self._lock = threading.Lock()
+        self._file = open(trace_path, "a", encoding="utf-8", buffering=1) if trace_path else None
+        self._server = None
+
+    def job_started(self, job_id, url, total, done=0):
+        with self._lock:
+            self._jobs[job_id] = _JobState(url, total, done)
+        self._emit("job_start", job=job_id, url=url, total=total, done=done)
+
+    def progress(self, job_id, completed, total):
+        """切片完成时由下载器调用，直播模式下 total 会增长"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.done, job.total = completed, total
+
+    def segment_done(self, job_id, trace, hedge=False, cached=False):
+        """记录一个成功写入的切片；trace 由 new_trace 创建并填写"""
+        key = (job_id, trace["idx"])
+        host = urlparse(trace["url"]).netloc
+        elapsed = sum(trace[phase] for phase in PHASES)
+        now = time.monotonic()
+        with self._lock:
+            if key in self._recorded:
+                return
+            self._recorded.add(key)
+            retries = self._pending_retries.pop(key, 0)
+            job = self._jobs.get(job_id)
+            if job:
+                job.bytes += trace["bytes"]
+                job.recent.append((now, trace["bytes"]))
+            if not cached:
+                stats = self._hosts[host]
+                stats.segments += 1
+                stats.bytes += trace["bytes"]
+                for phase in PHASES:
+                    stats.phases[phase] += trace[phase]
+                stats.duration.observe(elapsed)
+                stats.size.observe(trace["bytes"])
+        self._emit("segment", job=job_id, host=host, seconds=round(elapsed, 6), retries=retries,
+                   hedge=hedge, cached=cached, **{k: round(v, 6) if isinstance(v, float) else v
+                                                 for k, v in trace.items()})
+
+    def segment_error(self, job_id, indices, url, error):
+        """一次切片请求出错 (之后可能重试成功)"""
+        host = urlparse(url).netloc if url else None
+        kind = type(error).__name__
+        with self._lock:
+            self._errors[(host, kind)] += 1
+            self.retries += len(indices)
+            if host:
+                self._hosts[host].errors += 1
+            for idx in indices:
+                self._pending_retries[(job_id, idx)] += 1
+        self._emit("error", job=job_id, indices=list(indices), host=host, error=kind, message=str(error)[:200])
+
+    def segment_failed(self, job_id, idx):
+        """切片重试用尽，最终失败"""
+        with self._lock:
+            self._pending_retries.pop((job_id, idx), None)
+            job = self._jobs.get(job_id)
+            if job:
+                job.failed += 1
+        self._emit("failed", job=job_id, idx=idx)
+
+    def job_finished(self, job_id, output=None, error=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.status = "done" if output else "failed"
+            self._recorded = {key for key in self._recorded if key[0] != job_id}
+        self._emit("job_end", job=job_id, output=str(output) if output else None, error=error,
+                   **self.job_status(job_id))
+
+    def job_status(self, job_id):
+        """任务的进度、当前速度 (字节/秒、切片/秒) 和预计剩余时间 (秒，无法估计时为 None)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return {}
+            return self._job_status(job)
+
+    def snapshot(self):
+        """全部任务与主机的汇总 (/status 的内容)"""
+        with self._lock:
+            return {
+                "jobs": {job_id: {"url": job.url, **self._job_status(job)} for job_id, job in self._jobs.items()},
+                "hosts": {
+                    host: {
+                        "segments": s.segments,
+                        "mb": round(s.bytes / 1024 / 1024, 2),
+                        "errors": s.errors,
+                        # 各阶段的平均耗时 (毫秒)
+                        **{f"{phase}_ms": round(s.phases[phase] / s.segments * 1000, 1) if s.segments else None
+                           for phase in PHASES},
+                    }
+                    for host, s in self._hosts.items()
+                },
+                "errors": [{"host": host, "error": kind, "count": n} for (host, kind), n in self._errors.items()],
+                "retries": self.retries,
+            }
+
+    def prometheus(self):
+        """Prometheus 文本格式 (0.0.4) 的指标"""
+        lines = []
+
+        def metric(name, kind, doc, samples):
+            lines.append(f"# HELP smart_downloader_{name} {doc}")
+            lines.append(f"# TYPE smart_downloader_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"smart_downloader_{name}{{{label_text}}} {value}" if label_text
+                             else f"smart_downloader_{name} {value}")
+
+        def histogram(name, doc, items):
+            lines.append(f"# HELP smart_downloader_{name} {doc}")
+            lines.append(f"# TYPE smart_downloader_{name} histogram")
+            for host, h in items:
+                cumulative = 0
+                for bound, count in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cumulative += count
+                    lines.append(f'smart_downloader_{name}_bucket{{host="{_escape(host)}",le="{bound}"}} {cumulative}')
+                lines.append(f'smart_downloader_{name}_sum{{host="{_escape(host)}"}} {h.sum}')
+                lines.append(f'smart_downloader_{name}_count{{host="{_escape(host)}"}} {cumulative}')
+
+        with self._lock:
+            hosts = list(self._hosts.items())
+            jobs = [(job_id, job, self._job_status(job)) for job_id, job in self._jobs.items()]
+            errors = list(self._errors.items())
+            metric("segments_total", "counter", "下载完成的切片数",
+                   [({"host": host}, s.segments) for host, s in hosts])
+            metric("bytes_total", "counter", "下载的字节数", [({"host": host}, s.bytes) for host, s in hosts])
+            metric("phase_seconds_total", "counter", "切片各阶段累计耗时",
+                   [({"host": host, "phase": phase}, round(s.phases[phase], 6)) for host, s in hosts for phase in PHASES])
+            metric("errors_total", "counter", "切片请求错误数",
+                   [({"host": host or "", "error": kind}, n) for (host, kind), n in errors])
+            metric("retries_total", "counter", "切片重试次数", [({}, self.retries)])
+            histogram("segment_duration_seconds", "单个切片的总耗时", [(host, s.duration) for host, s in hosts])
+            histogram("segment_size_bytes", "单个切片的字节数", [(host, s.size) for host, s in hosts])
+        metric("job_segments", "gauge", "任务的切片总数", [({"job": job_id}, job.total) for job_id, job, _ in jobs])
+        metric("job_completed_segments", "gauge", "任务已完成的切片数",
+               [({"job": job_id}, job.done) for job_id, job, _ in jobs])
+        metric("job_failed_segments", "gauge", "任务最终失败的切片数",
+               [({"job": job_id}, job.failed) for job_id, job, _ in jobs])
+        metric("job_rate_bytes", "gauge", "任务最近的下载速度 (字节/秒)",
+               [({"job": job_id}, status["bytes_per_second"]) for job_id, _, status in jobs])
+        metric("job_eta_seconds", "gauge", "任务预计剩余时间",
+               [({"job": job_id}, status["eta_seconds"]) for job_id, _, status in jobs
+                if status["eta_seconds"] is not None])
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """在后台线程启动 HTTP 服务: /metrics (Prometheus) 与 /status (JSON)，返回实际监听的端口"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/metrics":
+                    body, content_type = telemetry.prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+                elif path == "/status":
+                    body, content_type = json.dumps(telemetry.snapshot(), ensure_ascii=False).encode("utf-8"), \
+                        "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="telemetry", daemon=True).start()
+        return self._server.server_address[1]
+
+    def close(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._file:
+            with self._lock:
+                self._file.close()
+                self._file = None
+
+    def _job_status(self, job):
+        now = time.monotonic()
+        while job.recent and now - job.recent[0][0] > self.RATE_WINDOW:
+            job.recent.popleft()
+        # 刚开始时窗口内的样本覆盖的时间不足 RATE_WINDOW，按实际经过的时间计算
+        window = min(self.RATE_WINDOW, now - job.started)
+        rate = sum(nbytes for _, nbytes in job.recent) / window if window > 0 else 0.0
+        segment_rate = len(job.recent) / window if window > 0 else 0.0
+        remaining = max(0, job.total - job.done) if job.total is not None else None
+        eta = None
+        if job.status != "running":
+            eta = 0.0
+        elif remaining is not None and segment_rate > 0:
+            eta = round(remaining / segment_rate, 1)
+        return {
+            "status": job.status,
+            "total": job.total,
+            "done": job.done,
+            "failed": job.failed,
+            "mb": round(job.bytes / 1024 / 1024, 2),
+            "bytes_per_second": round(rate),
+            "segments_per_second": round(segment_rate, 2),
+            "eta_seconds": eta,
+        }
+
+    def _emit(self, event, **fields):
+        if self._file is None:
+            return
+        line = json.dumps({"ts": round(time.time(), 6), "event": event, **fields}, ensure_ascii=False)
+        with self._lock:
+            if self._file:
+                self._file.write(line + "\n")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,376 @@
+import collections
+import threading
+import time
+import weakref
+from urllib.parse import urlparse
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from core.playlist import PlaylistCache
+from core.utils import HEADERS
+
+# 连接池不校验证书 (verify=False)，禁用 SSL 警告
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+DEFAULT_POOL_SIZE = 64  # 默认并发 32 + 对冲 8 仍有余量
+
+httpx = None  # 可选依赖，只有 HTTP/2 需要，启用时才导入 (见 _load_httpx)
+
+
+def _load_httpx():
+    global httpx
+    if httpx is None:
+        try:
+            import httpx as module
+        except ImportError:
+            return None
+        httpx = module
+    return httpx
+
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0   # 新建的 TCP 连接 (HTTPS 即 TLS 握手) 数
+        self.cache_hits = 0
+        self.not_modified = 0  # 播放列表条件请求返回 304 的次数
+
+
+class _H2Response:
+    """把 httpx 响应包装成下载器使用的 requests.Response 接口 (iter_content / raise_for_status / 上下文管理)"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+
+    @property
+    def content(self):
+        return self._response.read()
+
+    @property
+    def text(self):
+        self._response.read()
+        return self._response.text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def iter_content(self, chunk_size=64 * 1024):
+        try:
+            yield from self._response.iter_bytes(chunk_size)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _StoredResponse:
+    """磁盘缓存中未变化的播放列表 (条件请求返回 304 时使用)"""
+
+    status_code = 200
+
+    def __init__(self, url, text, headers):
+        self.url = url
+        self.text = text
+        self.headers = headers
+
+    @property
+    def content(self):
+        return self.text.encode("utf-8")
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=64 * 1024):
+        content = self.content
+        for start in range(0, len(content), chunk_size):
+            yield content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Transport:
+    """
+    下载流程共用的 HTTP 传输层
+    - 一个 keep-alive 连接池 (每个主机的连接数 = 切片并发数)，校验、列表、密钥、切片请求复用同一批连接，
+      每个主机只需少量 DNS 解析和 TCP / TLS 握手；需要更大的连接池时原地扩容 (ensure_pool_size)
+    - 可选 HTTP/2 (需要 httpx[http2])，一个连接上多路复用所有切片请求
+    - 小型响应缓存：URL 校验时取到的播放列表 (含重定向后的地址) 直接供之后的解析使用，不再重复请求
+    - 播放列表磁盘缓存 (PlaylistCache)：下次运行时带 ETag / Last-Modified 条件请求，未变化时不再传输列表内容
+    - 按主机统计请求数与新建连接数，用于确认连接复用情况
+    - 每个响应带 timings: 本次请求新建连接的耗时 (DNS 解析、TCP 建连，HTTPS 含 TLS 握手)，以及其余到收到响应头的耗时
+      (首字节)；复用连接时建连为 0，HTTP/2 连接无法区分，全部计入首字节
+    """
+
+    CACHE_TTL = 30.0       # 秒
+    CACHE_ENTRIES = 16
+    CACHE_MAX_BYTES = 2 * 1024 * 1024  # 超过该大小的响应不缓存
+
+    def __init__(self, pool_size=32, http2=False, playlist_cache=None):
+        """
+        :param pool_size: 每个主机的最大连接数，通常等于切片并发数
+        :param http2: 使用 HTTP/2 (未安装 httpx[http2] 时回退为 HTTP/1.1 连接池)
+        :param playlist_cache: PlaylistCache，cache=True 的请求带条件请求头；None 表示不使用
+        """
+        self.pool_size = pool_size
+        self.playlist_cache = playlist_cache
+        self._stats = collections.defaultdict(HostStats)
+        self._cache = collections.OrderedDict()  # url -> (response, 过期时间)
+        self._lock = threading.Lock()
+        self._timing = threading.local()  # 当前线程正在进行的请求中新建连接的耗时
+        self.http2 = False
+        self._client = None
+        self._h2_streams = weakref.WeakSet()
+        if http2:
+            self.enable_http2()
+        self.session = self._create_session(pool_size)
+
+    def ensure_pool_size(self, pool_size):
+        """
+        把每个主机的连接数上限扩大到 pool_size (不会缩小)
+        在同一个 Transport 上换用更大的连接池，已缓存的响应、统计和持有该 Transport 的对象都不受影响；
+        旧连接池中的空闲连接随之关闭
+        """
+        with self._lock:
+            if pool_size <= self.pool_size:
+                return
+            self.pool_size = pool_size
+            previous = self.session.get_adapter("https://")
+            self._mount_pool(self.session, pool_size)
+        previous.close()
+
+    def enable_http2(self):
+        """改用 HTTP/2 连接 (未安装 httpx[http2] 时保持 HTTP/1.1)，返回是否启用"""
+        with self._lock:
+            if self._client is None:
+                if _load_httpx() is None:
+                    print("⚠️  未安装 httpx[http2]，HTTP/2 不可用，使用 HTTP/1.1 连接池")
+                else:
+                    self._client = self._create_h2_client(self.pool_size)
+                    self.http2 = self._client is not None
+            return self.http2
+
+    def get(self, url, headers=None, timeout=15, stream=False, cache=False):
+        """
+        GET 请求，返回 requests.Response 兼容的对象
+        :param stream: 流式读取 (调用方负责 close 或使用 with)
+        :param cache: 先查响应缓存，未命中时请求并缓存 (只用于播放列表，不能与 stream 同时使用)；
+                      配置了 playlist_cache 时带条件请求头，未变化则使用磁盘上的内容
+        """
+        host = urlparse(url).netloc
+        stored = None
+        if cache:
+            cached = self._cached(url)
+            if cached is not None:
+                with self._lock:
+                    self._stats[host].cache_hits += 1
+                return cached
+            if self.playlist_cache is not None:
+                stored = self.playlist_cache.load(url)
+                if stored is not None:
+                    headers = {**(headers or {}), **PlaylistCache.conditional_headers(stored)}
+        with self._lock:
+            self._stats[host].requests += 1
+
+        timing = self._timing
+        timing.connect = 0.0
+        started = time.perf_counter()
+        if self._client is not None:
+            response = self._h2_get(url, headers, timeout, stream and not cache)
+        else:
+            response = self.session.get(url, headers=headers, timeout=timeout, stream=stream and not cache)
+        timings = {"connect": timing.connect, "ttfb": max(0.0, time.perf_counter() - started - timing.connect)}
+        if stored is not None and response.status_code == 304:
+            with self._lock:
+                self._stats[host].not_modified += 1
+            response.close()
+            response = _StoredResponse(stored["final_url"], stored["text"], response.headers)
+        elif cache and response.status_code == 200 and self.playlist_cache is not None:
+            self.playlist_cache.store(url, response.url or url, response.headers, response.text)
+        response.timings = timings
+        if cache and response.status_code == 200:
+            self._store(url, response)
+        return response
+
+    def report(self):
+        """各主机的请求数、新建连接数、复用率和缓存命中数"""
+        with self._lock:
+            items = list(self._stats.items())
+        return {
+            host: {
+                "requests": s.requests,
+                "connections": s.connections,
+                "reuse": round(1 - s.connections / s.requests, 3) if s.requests else None,
+                "cache_hits": s.cache_hits,
+                "not_modified": s.not_modified,
+            }
+            for host, s in items
+        }
+
+    def close(self):
+        self.session.close()
+        if self._client is not None:
+            self._client.close()
+
+    def _connection_opened(self, host):
+        with self._lock:
+            self._stats[host].connections += 1
+
+    def _connection_timing(self, connect):
+        """新建连接的耗时计入当前线程正在进行的请求 (urllib3 在发起请求的线程中建连)"""
+        timing = self._timing
+        timing.connect = getattr(timing, "connect", 0.0) + connect
+
+    def _cached(self, url):
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._cache[url]
+                return None
+            self._cache.move_to_end(url)
+            return entry[0]
+
+    def _store(self, url, response):
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > self.CACHE_MAX_BYTES:
+            return
+        content = response.content  # 读取完整内容，连接随即归还连接池
+        if len(content) > self.CACHE_MAX_BYTES:
+            return
+        expires = time.monotonic() + self.CACHE_TTL
+        with self._lock:
+            # 重定向后的地址也能命中
+            for key in {url, getattr(response, "url", url)}:
+                self._cache[key] = (response, expires)
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.CACHE_ENTRIES:
+                self._cache.popitem(last=False)
+
+    def _create_session(self, pool_size):
+        session = requests.Session()
+        session.verify = False
+        session.headers.update(HEADERS)
+        self._mount_pool(session, pool_size)
+        return session
+
+    def _mount_pool(self, session, pool_size):
+        # 直接替换 Session 自带的两个前缀的适配器: mount() 会暂时移出较短的前缀再放回，扩容时其他线程的请求可能找不到适配器
+        adapter = _PooledAdapter(self, pool_connections=16, pool_maxsize=pool_size)
+        session.adapters["http://"] = adapter
+        session.adapters["https://"] = adapter
+
+    def _create_h2_client(self, pool_size):
+        try:
+            return httpx.Client(
+                http2=True, verify=False, headers=HEADERS, follow_redirects=True,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            )
+        except ImportError:  # 安装了 httpx 但没有 h2
+            print("⚠️  未安装 h2 (pip install httpx[http2])，HTTP/2 不可用，使用 HTTP/1.1 连接池")
+            return None
+
+    def _h2_get(self, url, headers, timeout, stream):
+        try:
+            request = self._client.build_request("GET", url, headers=headers, timeout=timeout)
+            response = self._client.send(request, stream=True)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        # httpx 不暴露新建连接事件，按响应所用的网络流对象区分连接
+        network_stream = response.extensions.get("network_stream")
+        if network_stream is not None:
+            with self._lock:
+                new = network_stream not in self._h2_streams
+                self._h2_streams.add(network_stream)
+            if new:
+                self._connection_opened(urlparse(url).netloc)
+        wrapped = _H2Response(response)
+        if not stream:
+            wrapped.content
+            response.close()
+        return wrapped
+
+
+class _PooledAdapter(HTTPAdapter):
+    """连接池中的新建连接计入统计和所属请求的耗时"""
+
+    def __init__(self, transport, **kwargs):
+        self._transport = transport
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _pool_class(HTTPConnectionPool, HTTPConnection, self._transport),
+            "https": _pool_class(HTTPSConnectionPool, HTTPSConnection, self._transport),
+        }
+
+
+def _pool_class(pool_base, connection_base, transport):
+    class Connection(connection_base):
+        def connect(self):
+            host, port = self.host, self.port
+            transport._connection_opened(f"{host}:{port}" if port not in (80, 443) else host)
+            started = time.perf_counter()
+            try:
+                super().connect()
+            finally:
+                transport._connection_timing(time.perf_counter() - started)
+
+    class Pool(pool_base):
+        ConnectionCls = Connection
+
+    return Pool
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_transport(pool_size=32, http2=False):
+    """
+    进程内共享的 Transport，URL 校验、播放列表和切片请求默认都走它
+    首次创建时连接池至少为 DEFAULT_POOL_SIZE，足够默认并发的切片和对冲请求，之后请求更大的连接池或 HTTP/2 时
+    在原对象上扩容/启用，不重新创建 (校验时建立的连接、缓存的播放列表和统计都保留)
+    播放列表使用默认目录的磁盘缓存，目录不可写时不使用
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            try:
+                playlist_cache = PlaylistCache()
+            except OSError:
+                playlist_cache = None
+            _default = Transport(pool_size=max(pool_size, DEFAULT_POOL_SIZE), http2=http2,
+                                 playlist_cache=playlist_cache)
+        else:
+            _default.ensure_pool_size(pool_size)
+            if http2:
+                _default.enable_http2()
+        return _default
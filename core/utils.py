@@ -1,14 +1,9 @@
 import os
 import shutil
 import uuid
-import requests
-import urllib3
 from pathlib import Path
 from urllib.parse import urlparse
 
-# 禁用 SSL 警告
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
 # 全局配置
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
@@ -43,16 +38,16 @@ def validate_url(url):
         "Upgrade-Insecure-Requests": "1"
     })
     
+    # requests 较重，只在需要联网校验时导入 (transport 同时关闭 SSL 警告)
+    import requests
+    from core.transport import default_transport
+
     try:
-        # 增加超时时间到 15秒，并禁用 verify (应对自签名证书)
-        response = requests.get(
-            url, 
-            headers=check_headers, 
-            timeout=15, 
-            stream=True, 
-            verify=False 
-        )
-        response.close() # 只要能建立连接即可，不需要下载内容
+        # 走下载器共用的连接池，连接留给之后的请求复用；播放列表顺便缓存，解析时不再重复请求
+        is_playlist = ".m3u8" in url and not url.strip().endswith(".html")
+        response = default_transport().get(url, headers=check_headers, timeout=15, stream=not is_playlist,
+                                           cache=is_playlist)
+        response.close() # 网页只要能建立连接即可，不需要下载内容
             
         if 400 <= response.status_code < 600:
             # 403/404 可能是反爬误判，如果是网页，放行让 Selenium 尝试
@@ -103,9 +98,12 @@ def get_download_dir(custom_path=None, subdir="tx"):
         
     return download_dir
 
-def create_temp_dir(base_dir):
-    """创建临时目录"""
-    temp_dir = base_dir / f"temp_{uuid.uuid4().hex}"
+def create_temp_dir(base_dir, name=None):
+    """
+    创建临时目录
+    :param name: 目录名（可选，默认随机生成），传入固定名称时可跨进程复用同一目录
+    """
+    temp_dir = base_dir / (name or f"temp_{uuid.uuid4().hex}")
     temp_dir.mkdir(exist_ok=True)
     return temp_dir
 
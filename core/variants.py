@@ -0,0 +1,206 @@
+import concurrent.futures
+import time
+from urllib.parse import urljoin
+
+from core.playlist import Playlist
+from core.ranges import iter_range, parse_byterange, range_header
+
+
+class Variant:
+    """主列表中的一个子流及其 (可选的) 实测数据"""
+
+    def __init__(self, stream, url):
+        self.stream = stream
+        self.url = url
+        info = stream.stream_info
+        self.bandwidth = info.bandwidth or 0
+        self.resolution = info.resolution  # (宽, 高) 或 None
+        self.codecs = info.codecs or ""
+        self.playlist = None
+        self.bitrate = None      # 实测码率: 每秒媒体时长对应的字节数
+        self.throughput = None   # 探测时的下载速度 (字节/秒)
+        self.probe_bytes = 0
+        self.probe_time = 0.0
+
+    @property
+    def height(self):
+        return self.resolution[1] if self.resolution else None
+
+    @property
+    def label(self):
+        res = f"{self.resolution[0]}x{self.resolution[1]}" if self.resolution else "未知分辨率"
+        return f"{res} @ {self.bandwidth / 1000:.0f} kbps"
+
+    @property
+    def bytes_per_second(self):
+        """每秒媒体时长的字节数，未探测时按声明的 BANDWIDTH 估算"""
+        return self.bitrate or self.bandwidth / 8
+
+    def remaining_duration(self, start_idx):
+        return sum(seg.duration or 0 for seg in self.playlist.segments[start_idx:])
+
+
+class VariantSelector:
+    """
+    子流选择策略
+    - 默认选最高带宽 (旧行为)
+    - max_height / codec / max_bandwidth 依次过滤候选，再选其中带宽最高的
+    - deadline: 用各候选的前几个切片实测下载速度和真实码率，选能在期限内下完的最高码率子流；
+      下载过程中若预计超时，在切片边界切换到更低码率的子流 (要求切片数与媒体序列号一致)
+    """
+
+    CHECK_INTERVAL = 5.0   # 秒，切换检查的最短间隔
+    SWITCH_MARGIN = 1.05   # 预计耗时超过期限的 5% 才切换
+
+    def __init__(self, max_height=None, codec=None, max_bandwidth=None, deadline=None, probe_segments=3):
+        """
+        :param max_height: 目标分辨率 (高度)，优先选不超过该高度的最高子流
+        :param codec: CODECS 前缀，如 avc1 / hvc1，只选包含该编码的子流
+        :param max_bandwidth: 声明带宽上限 (bps)
+        :param deadline: 期望在多少秒内下载完成，提供时探测各子流的下载速度
+        :param probe_segments: 每个候选子流探测的切片数
+        """
+        self.max_height = max_height
+        self.codec = codec
+        self.max_bandwidth = max_bandwidth
+        self.deadline = deadline
+        self.probe_segments = probe_segments
+        self.current = None
+        self.alternatives = []  # 可在中途切换的更低码率子流 (按码率从高到低)
+        self._last_check = 0.0
+
+    def candidates(self, master, master_url):
+        """按策略过滤并按带宽从高到低排序的候选子流"""
+        variants = [Variant(p, urljoin(master_url, p.uri)) for p in master.playlists]
+        variants.sort(key=lambda v: v.bandwidth, reverse=True)
+        filtered = variants
+        if self.codec:
+            codec = self.codec.lower()
+            matched = [v for v in filtered if any(c.strip().lower().startswith(codec) for c in v.codecs.split(","))]
+            if matched:
+                filtered = matched
+            else:
+                print(f"⚠️  没有编码为 {self.codec} 的子流，忽略编码要求")
+        if self.max_height:
+            matched = [v for v in filtered if v.height is not None and v.height <= self.max_height]
+            # 都高于目标分辨率时选最接近的 (最低的)
+            filtered = matched or [min(filtered, key=lambda v: v.height or 0)]
+        if self.max_bandwidth:
+            matched = [v for v in filtered if v.bandwidth <= self.max_bandwidth]
+            filtered = matched or [min(filtered, key=lambda v: v.bandwidth)]
+        return filtered
+
+    def select(self, master, master_url, session):
+        """
+        选择子流并加载其媒体列表
+        :return: 选中的 Variant (playlist 已加载)
+        """
+        candidates = self.candidates(master, master_url)
+        if not self.deadline:
+            chosen = candidates[0]
+            chosen.playlist = self._load(session, chosen.url)
+            self.current = chosen
+            return chosen
+
+        for variant in candidates:
+            variant.playlist = self._load(session, variant.url)
+            self._probe(session, variant)
+        # 下载速度取决于链路而不是子流，用所有探测的总字节数 / 总耗时估算，减小单次探测的波动
+        probed = [v for v in candidates if v.throughput]
+        throughput = (sum(v.probe_bytes for v in probed) / sum(v.probe_time for v in probed)) if probed else None
+
+        print(f"{'子流':<28}{'实测码率':>12}{'下载速度':>12}{'预计耗时':>12}")
+        chosen = None
+        for variant in candidates:
+            estimate = self.estimate(variant, 0, throughput)
+            print(f"{variant.label:<28}{variant.bytes_per_second * 8 / 1000:>9.0f} kbps"
+                  f"{(variant.throughput or 0) / 1024 / 1024:>8.2f} MB/s{estimate:>10.0f} s")
+            if chosen is None and estimate <= self.deadline:
+                chosen = variant
+        if chosen is None:
+            chosen = candidates[-1]
+            print(f"⚠️  没有子流能在 {self.deadline:.0f} 秒内下载完成，选择码率最低的子流")
+        self.current = chosen
+        self.alternatives = [
+            v for v in candidates
+            if v.bytes_per_second < chosen.bytes_per_second and self._aligned(chosen.playlist, v.playlist)
+        ]
+        return chosen
+
+    @staticmethod
+    def estimate(variant, start_idx, throughput):
+        """按实测速度估算从 start_idx 开始下载完该子流所需的秒数"""
+        if not throughput:
+            return float("inf")
+        return variant.remaining_duration(start_idx) * variant.bytes_per_second / throughput
+
+    def maybe_switch(self, next_idx, downloaded_bytes, elapsed, pending_bytes=0, spent=0.0):
+        """
+        下载过程中检查是否会超过期限，需要时返回应切换到的更低码率子流，否则返回 None
+        :param next_idx: 下一个待提交的切片序号
+        :param downloaded_bytes: 开始下载切片以来已下载的字节数
+        :param elapsed: 开始下载切片以来的秒数 (与 downloaded_bytes 一起估算下载速度)
+        :param pending_bytes: 已提交但尚未下载完的切片的预计字节数 (切换对它们不起作用)
+        :param spent: 开始下载切片之前已用去的秒数 (解析列表、探测子流)，计入期限
+        """
+        if not self.deadline or not self.alternatives or elapsed < self.CHECK_INTERVAL or downloaded_bytes <= 0:
+            return None
+        now = time.monotonic()
+        if now - self._last_check < self.CHECK_INTERVAL:
+            return None
+        self._last_check = now
+
+        throughput = downloaded_bytes / elapsed
+        remaining = self.deadline - spent - elapsed - pending_bytes / throughput
+        if self.estimate(self.current, next_idx, throughput) <= remaining + self.deadline * (self.SWITCH_MARGIN - 1):
+            return None
+        for variant in self.alternatives:
+            if self.estimate(variant, next_idx, throughput) <= remaining:
+                break
+        else:
+            variant = self.alternatives[-1]
+        self.alternatives = [v for v in self.alternatives if v.bytes_per_second < variant.bytes_per_second]
+        self.current = variant
+        return variant
+
+    @staticmethod
+    def _aligned(a, b):
+        """两个子流的切片能否在边界处互换 (切片数与媒体序列号一致)"""
+        return len(a.segments) == len(b.segments) and (a.media_sequence or 0) == (b.media_sequence or 0)
+
+    @staticmethod
+    def _load(session, url):
+        response = session.get(url, timeout=15, cache=True)
+        response.raise_for_status()
+        return Playlist(response.text, uri=url)
+
+    def _probe(self, session, variant):
+        """并发下载前几个切片，测量下载速度和真实码率"""
+        segments = variant.playlist.segments[:self.probe_segments]
+        if not segments:
+            return
+
+        def fetch(segment):
+            # EXT-X-BYTERANGE 切片只请求自己的范围，否则会把整个资源文件算作一个切片
+            span = parse_byterange(segment.byterange)
+            headers = {"Range": range_header(*span)} if span else None
+            with session.get(urljoin(variant.url, segment.uri), headers=headers, timeout=15, stream=True) as response:
+                response.raise_for_status()
+                if span:
+                    return sum(len(chunk) for chunk in iter_range(response, *span))
+                return len(response.content)
+
+        start = time.monotonic()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(segments)) as executor:
+                nbytes = sum(executor.map(fetch, segments))
+        except Exception as e:
+            print(f"⚠️  探测子流失败 ({variant.label}): {e}")
+            return
+        elapsed = max(time.monotonic() - start, 1e-3)
+        duration = sum(seg.duration or 0 for seg in segments)
+        variant.probe_bytes = nbytes
+        variant.probe_time = elapsed
+        variant.throughput = nbytes / elapsed
+        if duration:
+            variant.bitrate = nbytes / duration
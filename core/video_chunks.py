@@ -0,0 +1,116 @@
+import json
+import os
+import subprocess
+from pathlib import Path
+
+
+def split_at_keyframes(input_path, out_dir, chunk_seconds):
+    """
+    不重新编码地把视频轨切成约 chunk_seconds 秒的分段 (source_00000.mkv ...)
+    stream copy 只能在关键帧处切分，每段从关键帧开始，可以独立解码；音轨不切分，拼接时从原视频复制
+    :return: 按顺序排列的分段路径
+    """
+    out_dir = Path(out_dir)
+    cmd = [
+        "ffmpeg", "-v", "error", "-y",
+        "-i", str(input_path),
+        "-map", "0:v:0",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_time", str(chunk_seconds),
+        "-reset_timestamps", "1",
+        str(out_dir / "source_%05d.mkv"),
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"切分视频失败: {result.stderr.strip()}")
+    return sorted(out_dir.glob("source_*.mkv"))
+
+
+def concat_chunks(chunk_paths, audio_source, output_path, work_dir):
+    """用 concat demuxer 不重新编码地拼接各分段的视频轨，并复制原视频的音轨"""
+    list_path = Path(work_dir) / "concat.txt"
+    lines = []
+    for path in chunk_paths:
+        escaped = str(Path(path).resolve()).replace("'", "'\\''")
+        lines.append(f"file '{escaped}'")
+    list_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    cmd = [
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "concat", "-safe", "0", "-i", str(list_path),
+        "-i", str(audio_source),
+        "-map", "0:v",
+        "-map", "1:a?",
+        "-c", "copy",
+        "-movflags", "+faststart",
+        str(output_path),
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"拼接分段失败: {result.stderr.strip()}")
+
+
+class ChunkManifest:
+    """
+    分段增强的进度清单，保存在工作目录中 (manifest.json)
+    记录输入视频的指纹 (路径 / 大小 / 修改时间) 与增强参数、切分出的分段以及已完成的分段，
+    进程中断后只重新处理未完成的分段；输入或参数变化时清单失效
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, fingerprint):
+        """
+        :param path: 清单文件路径
+        :param fingerprint: 输入视频与增强参数的指纹 (dict)，见 make_fingerprint
+        """
+        self.path = Path(path)
+        self.fingerprint = fingerprint
+        self.sources = []   # 切分出的分段文件名 (按顺序)
+        self.done = {}      # 分段序号 -> {"file", "bytes", "frames"}
+
+    @staticmethod
+    def make_fingerprint(input_path, **params):
+        stat = Path(input_path).stat()
+        return {"input": str(input_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, **params}
+
+    def load(self):
+        """读取已有清单，与当前输入和参数一致时返回 True"""
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print(f"⚠️  分段清单损坏，忽略: {e}")
+            return False
+        if data.get("version") != self.VERSION or data.get("fingerprint") != self.fingerprint:
+            return False
+        self.sources = data.get("sources", [])
+        self.done = {int(k): v for k, v in data.get("done", {}).items()}
+        return True
+
+    def is_done(self, idx):
+        """分段已完成且输出文件仍然完整 (大小一致)"""
+        entry = self.done.get(idx)
+        if not entry:
+            return False
+        try:
+            return (self.path.parent / entry["file"]).stat().st_size == entry["bytes"]
+        except OSError:
+            return False
+
+    def mark_done(self, idx, path, frames):
+        self.done[idx] = {"file": Path(path).name, "bytes": Path(path).stat().st_size, "frames": frames}
+        self.save()
+
+    def save(self):
+        """原子写入清单文件 (先写临时文件再替换)"""
+        data = {
+            "version": self.VERSION,
+            "fingerprint": self.fingerprint,
+            "sources": self.sources,
+            "done": {str(k): v for k, v in sorted(self.done.items())},
+        }
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.path)
@@ -9,9 +9,14 @@ import sys
 import subprocess
 import argparse
 import shutil
+import time
 from pathlib import Path
 import tempfile
 
+from core.frame_pipeline import FramePipeline, StageStats, stage_report
+from core.profiling import profile_run, span
+from core.video_chunks import ChunkManifest, concat_chunks, split_at_keyframes
+
 
 class VideoEnhancer:
     def __init__(self):
@@ -30,7 +35,9 @@ class VideoEnhancer:
         if not shutil.which("ffmpeg"):
             raise FileNotFoundError("ffmpeg 未安装，请先运行: brew install ffmpeg")
     
-    def enhance_video(self, input_path: str, output_path: str = None, scale: int = 2, model: str = "realesrgan-x4plus"):
+    def enhance_video(self, input_path: str, output_path: str = None, scale: int = 2, model: str = "realesrgan-x4plus",
+                      pipeline: str = "stream", batch_frames: int = 32, chunk_seconds: float = 0, workers: int = 2,
+                      resume: bool = False):
         """
         增强视频质量
         
@@ -42,6 +49,13 @@ class VideoEnhancer:
                 - realesrgan-x4plus: 通用模型（推荐）
                 - realesrgan-x4plus-anime: 动画专用
                 - realesr-animevideov3: 动画视频专用（速度快）
+            pipeline: 处理方式
+                - stream: 解码 / 增强 / 编码通过管道并行，按批处理帧，临时文件只占 batch_frames 帧的空间（默认）
+                - frames: 先把全部帧提取为 PNG，整体增强后再合成
+            batch_frames: stream 方式每批增强的帧数
+            chunk_seconds: 大于 0 时在关键帧处切分为约该时长的分段，多个进程并行增强后无损拼接 (stream 方式)
+            workers: 分段模式并行的进程数
+            resume: 分段模式复用上次中断时已完成的分段
         """
         input_path = Path(input_path).resolve()
         
@@ -58,8 +72,36 @@ class VideoEnhancer:
         print(f"   输出: {output_path}")
         print(f"   放大倍数: {scale}x")
         print(f"   模型: {model}")
+        print(f"   处理方式: {pipeline}" + (f"，{chunk_seconds:g} 秒分段 x {workers} 进程" if chunk_seconds else ""))
         print(f"   使用设备: Apple M3 Pro GPU")
         
+        with span("探测视频参数"):
+            fps, orig_width, orig_height = self._probe(input_path)
+        new_width = int(orig_width) * scale
+        new_height = int(orig_height) * scale
+        
+        if chunk_seconds:
+            ok = self._enhance_chunked(input_path, output_path, scale, model, fps, (new_width, new_height), batch_frames,
+                                       chunk_seconds, workers, resume)
+        elif pipeline == "stream":
+            ok = self._enhance_stream(input_path, output_path, scale, model, fps, (new_width, new_height), batch_frames)
+        else:
+            ok = self._enhance_frames(input_path, output_path, scale, model, fps, (new_width, new_height))
+        if not ok:
+            return None
+        
+        print(f"\n✅ 视频增强完成: {output_path}")
+        
+        input_size = input_path.stat().st_size / (1024 * 1024)
+        output_size = output_path.stat().st_size / (1024 * 1024)
+        print(f"   原始大小: {input_size:.2f} MB")
+        print(f"   增强后大小: {output_size:.2f} MB")
+        print(f"   分辨率: {orig_width}x{orig_height} → {new_width}x{new_height}")
+        
+        return str(output_path)
+    
+    def _enhance_frames(self, input_path, output_path, scale, model, fps, size):
+        """提取全部帧 -> 整体增强 -> 合成视频"""
         with tempfile.TemporaryDirectory() as temp_dir:
             temp_dir = Path(temp_dir)
             frames_dir = temp_dir / "frames"
@@ -73,74 +115,186 @@ class VideoEnhancer:
                 "-qscale:v", "2",
                 str(frames_dir / "frame_%08d.png")
             ]
-            subprocess.run(cmd, capture_output=True, check=True)
+            with span("提取视频帧"):
+                subprocess.run(cmd, capture_output=True, check=True)
             
             frame_count = len(list(frames_dir.glob("*.png")))
             print(f"   提取了 {frame_count} 帧")
             
             print(f"\n🎨 步骤 2/3: AI 增强帧...")
-            cmd = [
-                str(self.realesrgan_path),
-                "-i", str(frames_dir),
-                "-o", str(enhanced_dir),
-                "-s", str(scale),
-                "-n", model,
-                "-m", str(self.models_path),
-                "-f", "png"
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            with span("AI 增强帧"):
+                result = subprocess.run(self._realesrgan_cmd(frames_dir, enhanced_dir, scale, model),
+                                        capture_output=True, text=True)
             if result.returncode != 0:
                 print(f"❌ 增强失败: {result.stderr}")
-                return None
+                return False
             
             enhanced_count = len(list(enhanced_dir.glob("*.png")))
             print(f"   增强了 {enhanced_count} 帧")
             
             print(f"\n🎬 步骤 3/3: 合成视频...")
-            
-            probe_cmd = [
-                "ffprobe", "-v", "error",
-                "-select_streams", "v:0",
-                "-show_entries", "stream=r_frame_rate,width,height",
-                "-of", "csv=p=0",
-                str(input_path)
-            ]
-            probe_result = subprocess.run(probe_cmd, capture_output=True, text=True, check=True)
-            fps, orig_width, orig_height = probe_result.stdout.strip().split(',')
-            
-            new_width = int(orig_width) * scale
-            new_height = int(orig_height) * scale
-            
-            cmd = [
-                "ffmpeg",
-                "-framerate", fps,
-                "-i", str(enhanced_dir / "frame_%08d.png"),
-                "-i", str(input_path),
-                "-map", "0:v",
-                "-map", "1:a?",
-                "-c:v", "libx264",
-                "-preset", "medium",
-                "-crf", "23",
-                "-c:a", "copy",
-                "-s", f"{new_width}x{new_height}",
-                "-y",
-                str(output_path)
-            ]
-            
-            subprocess.run(cmd, capture_output=True, check=True)
-            
-            print(f"\n✅ 视频增强完成: {output_path}")
-            
-            input_size = input_path.stat().st_size / (1024 * 1024)
-            output_size = output_path.stat().st_size / (1024 * 1024)
-            print(f"   原始大小: {input_size:.2f} MB")
-            print(f"   增强后大小: {output_size:.2f} MB")
-            print(f"   分辨率: {orig_width}x{orig_height} → {new_width}x{new_height}")
-            
-            return str(output_path)
+            cmd = self._encode_cmd(["-framerate", fps, "-i", str(enhanced_dir / "frame_%08d.png")],
+                                   output_path, size, audio_source=input_path)
+            with span("合成视频"):
+                subprocess.run(cmd, capture_output=True, check=True)
+            return True
+    
+    def _enhance_stream(self, input_path, output_path, scale, model, fps, size, batch_frames):
+        """解码 -> 按批增强 -> 编码，三个阶段通过管道并行 (见 core/frame_pipeline.py)"""
+        print(f"\n🔀 解码 → AI 增强 → 编码 并行处理 (每批 {batch_frames} 帧)...")
+        pipeline = self._stream_pipeline(input_path, output_path, scale, model, fps, size, batch_frames,
+                                         audio_source=input_path)
+        try:
+            with span("流式增强"):
+                pipeline.run()
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            output_path.unlink(missing_ok=True)  # 不保留不完整的视频
+            return False
+        finally:
+            print(f"📊 {pipeline.report()}")
+        print(f"   处理了 {pipeline.frames} 帧")
+        return True
     
-    def batch_enhance(self, input_dir: str, output_dir: str = None, scale: int = 2, model: str = "realesrgan-x4plus"):
+    def _stream_pipeline(self, input_path, output_path, scale, model, fps, size, batch_frames, audio_source=None,
+                         threads=None, progress=True):
+        """创建流式处理 input_path 的 FramePipeline；threads 限制解码和编码 ffmpeg 的线程数 (None 表示自动)"""
+        thread_args = ["-threads", str(threads)] if threads else []
+        decode_cmd = [
+            "ffmpeg", "-v", "error", *thread_args, "-i", str(input_path),
+            "-map", "0:v:0",
+            "-f", "image2pipe", "-c:v", "png", "-compression_level", "1",
+            "pipe:1"
+        ]
+        encode_cmd = self._encode_cmd(["-f", "image2pipe", "-framerate", fps, "-c:v", "png", "-i", "pipe:0"],
+                                      output_path, size, audio_source, threads)
+        
+        def enhance_batch(in_dir, out_dir):
+            result = subprocess.run(self._realesrgan_cmd(in_dir, out_dir, scale, model), capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"增强失败: {result.stderr.strip()}")
+        
+        return FramePipeline(decode_cmd, enhance_batch, encode_cmd, batch_size=batch_frames,
+                             work_dir=Path(output_path).parent, progress=progress)
+    
+    def _enhance_chunked(self, input_path, output_path, scale, model, fps, size, batch_frames, chunk_seconds,
+                         workers, resume):
+        """
+        在关键帧处切分为约 chunk_seconds 秒的分段，workers 个进程并行流式增强各分段，最后不重新编码地拼接
+        工作目录 (.<输出文件名>.chunks) 中的清单记录已完成的分段，resume 时只处理未完成的分段
+        """
+        import concurrent.futures  # 只有分段模式需要进程池
+
+        work_dir = output_path.parent / f".{output_path.name}.chunks"
+        manifest = ChunkManifest(work_dir / "manifest.json", ChunkManifest.make_fingerprint(
+            input_path, scale=scale, model=model, chunk_seconds=chunk_seconds, fps=fps, size=list(size)))
+        if resume and manifest.load() and manifest.sources:
+            done = sum(1 for idx in range(len(manifest.sources)) if manifest.is_done(idx))
+            print(f"\n🔁 断点续传: {done}/{len(manifest.sources)} 个分段已完成")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            work_dir.mkdir(parents=True)
+            print(f"\n📹 在关键帧处切分为约 {chunk_seconds:g} 秒的分段...")
+            with span("切分视频"):
+                sources = split_at_keyframes(input_path, work_dir, chunk_seconds)
+            manifest.sources = [path.name for path in sources]
+            manifest.save()
+        
+        total = len(manifest.sources)
+        pending = [idx for idx in range(total) if not manifest.is_done(idx)]
+        # 每个进程的 ffmpeg 只用分到的 CPU 核，避免多个进程的编码线程互相争抢
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        print(f"🔀 {total} 个分段，{len(pending)} 个待处理，{workers} 个进程并行 (每批 {batch_frames} 帧)...")
+        
+        stages = [StageStats("解码"), StageStats("增强"), StageStats("编码")]
+        failed = []
+        start = time.perf_counter()
+        with span("并行增强分段"):
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(_enhance_chunk, work_dir / manifest.sources[idx], work_dir / f"enhanced_{idx:05d}.mp4",
+                                    scale, model, fps, size, batch_frames, threads): idx
+                    for idx in pending
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    idx = futures[future]
+                    try:
+                        frames, stage_rows = future.result()
+                    except Exception as e:
+                        failed.append(idx)
+                        print(f"❌ 分段 {idx + 1}/{total} 失败: {e}")
+                        continue
+                    manifest.mark_done(idx, work_dir / f"enhanced_{idx:05d}.mp4", frames)
+                    for stats, (_, stage_frames, busy) in zip(stages, stage_rows):
+                        stats.frames += stage_frames
+                        stats.busy += busy
+                    completed = sum(1 for i in range(total) if manifest.is_done(i))
+                    print(f"✅ 分段 {idx + 1}/{total} 完成 ({frames} 帧)，进度 {completed}/{total}")
+        if stages[-1].frames:
+            # 各阶段速度为单个进程的速度，整体速度为所有进程合计
+            print(f"📊 {stage_report(stages, time.perf_counter() - start)}")
+        if failed:
+            print(f"❌ {len(failed)} 个分段失败，已完成的分段保存在 {work_dir}，使用 --resume 继续")
+            return False
+        
+        print(f"\n🎬 拼接 {total} 个分段...")
+        with span("拼接分段"):
+            try:
+                concat_chunks([work_dir / manifest.done[idx]["file"] for idx in range(total)],
+                              input_path, output_path, work_dir)
+            except RuntimeError as e:
+                print(f"❌ {e}")
+                output_path.unlink(missing_ok=True)
+                return False
+        shutil.rmtree(work_dir, ignore_errors=True)
+        print(f"   处理了 {sum(entry['frames'] for entry in manifest.done.values())} 帧")
+        return True
+    
+    def _realesrgan_cmd(self, input_dir, output_dir, scale, model):
+        return [
+            str(self.realesrgan_path),
+            "-i", str(input_dir),
+            "-o", str(output_dir),
+            "-s", str(scale),
+            "-n", model,
+            "-m", str(self.models_path),
+            "-f", "png"
+        ]
+    
+    @staticmethod
+    def _probe(input_path):
+        """返回 (帧率, 宽, 高)，帧率为 ffprobe 给出的分数字符串"""
+        probe_cmd = [
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=r_frame_rate,width,height",
+            "-of", "csv=p=0",
+            str(input_path)
+        ]
+        probe_result = subprocess.run(probe_cmd, capture_output=True, text=True, check=True)
+        orig_width, orig_height, fps = probe_result.stdout.strip().split(',')[:3]
+        return fps, orig_width, orig_height
+    
+    @staticmethod
+    def _encode_cmd(frames_input, output_path, size, audio_source=None, threads=None):
+        """帧序列 (frames_input 给出的输入) + audio_source 的音轨 (None 表示不要音轨) -> H.264 视频"""
+        audio_args = ["-i", str(audio_source), "-map", "0:v", "-map", "1:a?", "-c:a", "copy"] if audio_source else []
+        return [
+            "ffmpeg",
+            *frames_input,
+            *audio_args,
+            "-c:v", "libx264",
+            "-preset", "medium",
+            "-crf", "23",
+            *(["-threads", str(threads)] if threads else []),
+            "-s", f"{size[0]}x{size[1]}",
+            "-y",
+            str(output_path)
+        ]
+    
+    def batch_enhance(self, input_dir: str, output_dir: str = None, scale: int = 2, model: str = "realesrgan-x4plus",
+                      pipeline: str = "stream", batch_frames: int = 32, chunk_seconds: float = 0, workers: int = 2,
+                      resume: bool = False):
         """
         批量增强目录中的所有视频
         
@@ -149,6 +303,9 @@ class VideoEnhancer:
             output_dir: 输出目录（可选）
             scale: 放大倍数
             model: 模型名称
+            pipeline: 处理方式 (stream / frames)
+            batch_frames: stream 方式每批增强的帧数
+            chunk_seconds / workers / resume: 分段并行模式的参数，见 enhance_video
         """
         input_dir = Path(input_dir).resolve()
         
@@ -178,13 +335,22 @@ class VideoEnhancer:
             print(f"\n[{i}/{len(video_files)}] 处理: {video_file.name}")
             output_path = output_dir / f"{video_file.stem}_{scale}x_enhanced.mp4"
             
-            result = self.enhance_video(str(video_file), str(output_path), scale, model)
+            result = self.enhance_video(str(video_file), str(output_path), scale, model, pipeline, batch_frames,
+                                        chunk_seconds, workers, resume)
             if result:
                 success_count += 1
         
         print(f"\n🎉 批量处理完成: {success_count}/{len(video_files)} 成功")
 
 
+def _enhance_chunk(source, target, scale, model, fps, size, batch_frames, threads):
+    """在工作进程中流式增强一个分段 (只有视频轨)，返回 (帧数, [(阶段, 帧数, 工作时间)])"""
+    pipeline = VideoEnhancer()._stream_pipeline(source, target, scale, model, fps, size, batch_frames,
+                                                threads=threads, progress=False)
+    pipeline.run()
+    return pipeline.frames, [(s.name, s.frames, s.busy) for s in pipeline.stages]
+
+
 def main():
     parser = argparse.ArgumentParser(description="视频增强工具 - 使用 AI 提升视频清晰度")
     parser.add_argument("input", help="输入视频文件或目录路径")
@@ -195,16 +361,36 @@ def main():
                        choices=["realesrgan-x4plus", "realesrgan-x4plus-anime", "realesr-animevideov3"],
                        help="模型类型 (默认: realesrgan-x4plus)")
     parser.add_argument("-b", "--batch", action="store_true", help="批量处理目录中的所有视频")
+    parser.add_argument("--pipeline", choices=["stream", "frames"], default="stream",
+                       help="处理方式: stream 解码/增强/编码通过管道并行，临时文件只占一批帧 (默认), frames 先提取全部帧再整体增强")
+    parser.add_argument("--batch-frames", type=int, default=32,
+                       help="stream 方式每批增强的帧数，越大增强程序启动次数越少、临时文件越多 (默认: 32)")
+    parser.add_argument("--chunk-seconds", type=float, default=0,
+                       help="长视频分段模式: 在关键帧处切分为约该秒数的分段，多进程并行增强后无损拼接 (默认: 0，不分段)")
+    parser.add_argument("--workers", type=int, default=2,
+                       help="分段模式并行处理分段的进程数 (默认: 2)")
+    parser.add_argument("--resume", action="store_true",
+                       help="分段模式断点续传: 复用上次中断时已完成的分段")
+    parser.add_argument("--profile", metavar="FILE", default=None,
+                       help="用 cProfile 分析运行过程，统计写入 FILE，阶段耗时与热点函数写入 FILE.txt")
     
     args = parser.parse_args()
+    if args.chunk_seconds and args.pipeline != "stream":
+        parser.error("--chunk-seconds 只支持 --pipeline stream")
+    if args.workers < 1:
+        parser.error("--workers 至少为 1")
     
     try:
-        enhancer = VideoEnhancer()
-        
-        if args.batch:
-            enhancer.batch_enhance(args.input, args.output, args.scale, args.model)
-        else:
-            enhancer.enhance_video(args.input, args.output, args.scale, args.model)
+        # 结束时打印各步骤耗时汇总
+        with profile_run(args.profile):
+            enhancer = VideoEnhancer()
+            
+            if args.batch:
+                enhancer.batch_enhance(args.input, args.output, args.scale, args.model, args.pipeline, args.batch_frames,
+                                       args.chunk_seconds, args.workers, args.resume)
+            else:
+                enhancer.enhance_video(args.input, args.output, args.scale, args.model, args.pipeline, args.batch_frames,
+                                       args.chunk_seconds, args.workers, args.resume)
             
     except Exception as e:
         print(f"❌ 错误: {e}")
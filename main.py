@@ -1,21 +1,135 @@
 import argparse
 import sys
-from core.extractor import WebExtractor
-from core.downloader import M3U8Downloader
-from core.utils import validate_url
+from core.profiling import profile_run, span
+
+# 其余模块在用到的分支里才导入: Selenium (网页解析)、aiohttp (async 引擎)、requests / tenacity / pycryptodome (下载)
+# 加载都较慢，直接 m3u8 链接或 --help 不需要全部加载 (见 benchmarks/bench_startup.py)
 
 def main():
     parser = argparse.ArgumentParser(description="智能 m3u8 下载器 (模块化版)")
-    parser.add_argument("input", help="m3u8 URL 或 包含视频的网页 URL")
+    parser.add_argument("input", nargs="?", help="m3u8 URL 或 包含视频的网页 URL (使用 --batch 时可省略)")
     parser.add_argument("-o", "--output", help="指定输出目录 (默认: ~/Downloads/tx)", default=None)
+    parser.add_argument("--merge-mode", choices=["stream", "concat"], default="stream",
+                        help="合并方式: stream 边下载边写入 (默认), concat 下载完成后统一拼接")
+    parser.add_argument("--buffer-mb", type=int, default=64,
+                        help="stream 模式乱序切片内存缓冲上限，单位 MB (默认: 64)")
+    parser.add_argument("--remux", choices=["mp4", "fmp4"], default=None,
+                        help="边下载边通过 ffmpeg 封装为真正的 MP4 (faststart) 或分片 MP4，不重新编码；未安装 ffmpeg 时回退为 TS 拼接")
+    parser.add_argument("--live", action="store_true",
+                        help="直播录制: 持续刷新直播/EVENT 列表，新切片边下边写，直到 EXT-X-ENDLIST 或 Ctrl+C")
+    parser.add_argument("--live-duration", type=float, default=None,
+                        help="直播模式的最长录制时长，单位秒 (默认: 不限)")
+    parser.add_argument("--hedge-percentile", type=float, default=95,
+                        help="切片耗时超过已完成切片的该分位数时再发一个相同请求，先完成者胜出；0 表示关闭 (默认: 95)")
+    parser.add_argument("--mirror", action="append", default=[], metavar="URL",
+                        help="同一媒体列表在其他主机/CDN 上的地址，可重复指定；切片按各源实测吞吐分摊，出错自动切换")
+    parser.add_argument("--no-mirror-discovery", action="store_true",
+                        help="不把主列表中属性相同的冗余子流当作镜像源")
+    parser.add_argument("--max-height", type=int, default=None,
+                        help="多级列表选择不超过该高度的最高子流，如 720 (默认: 最高画质)")
+    parser.add_argument("--codec", default=None,
+                        help="只选 CODECS 以该前缀开头的子流，如 avc1 / hvc1")
+    parser.add_argument("--max-bandwidth", type=int, default=None,
+                        help="只选声明带宽不超过该值的子流，单位 bps")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="期望在多少分钟内下载完成: 实测各子流的下载速度选能按时完成的最高码率，预计超时时中途降级")
+    parser.add_argument("--min-workers", type=int, default=2,
+                        help="每个主机的最小并发切片请求数 (默认: 2)")
+    parser.add_argument("--max-workers", type=int, default=32,
+                        help="每个主机的最大并发切片请求数，实际并发在上下限之间自适应调整 (默认: 32)")
+    parser.add_argument("--resume", action="store_true",
+                        help="断点续传: 复用输出目录中同一链接未完成的任务进度，只下载缺失的切片")
+    parser.add_argument("--engine", choices=["thread", "async"], default="thread",
+                        help="下载引擎: thread 线程池 (默认，功能完整), async 基于 asyncio/aiohttp，可同时进行上千个切片请求")
+    parser.add_argument("--concurrency", type=int, default=512,
+                        help="async 引擎同时进行的切片请求数上限 (默认: 512)")
+    parser.add_argument("--http2", action="store_true",
+                        help="使用 HTTP/2 连接池，一个连接上多路复用全部切片请求 (需要 pip install httpx[http2])")
+    parser.add_argument("--segment-cache", nargs="?", const="", default=None, metavar="DIR",
+                        help="启用磁盘切片缓存，重复下载同一链接或批量任务间共享切片时不再请求网络 (默认目录: ~/.cache/smart-downloader/segments)")
+    parser.add_argument("--segment-cache-gb", type=float, default=10,
+                        help="切片缓存总大小上限，单位 GB，超出时淘汰最久未使用的切片 (默认: 10)")
+    parser.add_argument("--limit-rate", type=float, default=None,
+                        help="总下载速度上限，单位 MB/s (默认: 不限)")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="把每个切片各阶段的耗时 (建连/首字节/传输/解密/写入)、字节数、重试与错误逐行写入 JSON Lines 文件")
+    parser.add_argument("--metrics-port", type=int, default=None, metavar="PORT",
+                        help="在 127.0.0.1:PORT 提供 Prometheus 格式的 /metrics 和 JSON 格式的 /status (下载速度、剩余时间、按主机统计)")
+    parser.add_argument("--profile", metavar="FILE", default=None,
+                        help="用 cProfile 分析整个运行过程，统计写入 FILE (snakeviz / pstats 可读)，阶段耗时与热点函数写入 FILE.txt")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="批量下载: 文件每行一个链接，可跟一个整数优先级；任务加入输出目录中的持久化队列后统一调度")
+    parser.add_argument("--priority", type=int, default=0,
+                        help="与 --batch 同时给出的 input 链接的优先级，数值大者优先 (默认: 0)")
+    parser.add_argument("--jobs", type=int, default=3,
+                        help="批量模式同时运行的任务数 (默认: 3)")
+    parser.add_argument("--workers", type=int, default=32,
+                        help="批量模式所有任务共享的切片线程数 (默认: 32)")
     args = parser.parse_args()
-    
+    if args.min_workers > args.max_workers:
+        parser.error("--min-workers 不能大于 --max-workers")
+    if not args.input and not args.batch:
+        parser.error("需要提供 input 链接或 --batch 文件")
+    if args.batch and (args.live or args.mirror):
+        parser.error("--batch 不支持 --live / --mirror")
+    # async 引擎没有对应实现的选项，给出非默认值时报错而不是静默忽略 (并发由 --concurrency 控制)
+    if args.engine == "async" and (args.batch or args.live or args.resume or args.mirror or args.remux
+                                   or args.deadline or args.limit_rate or args.segment_cache is not None
+                                   or args.trace or args.metrics_port is not None or args.http2
+                                   or args.no_mirror_discovery
+                                   or any(getattr(args, name) != parser.get_default(name)
+                                          for name in ("hedge_percentile", "min_workers", "max_workers"))):
+        parser.error("async 引擎不支持 --batch / --live / --resume / --mirror / --remux / --deadline / --limit-rate"
+                     " / --segment-cache / --trace / --metrics-port / --http2 / --hedge-percentile"
+                     " / --min-workers / --max-workers / --no-mirror-discovery")
+
+    telemetry = None
+    if args.trace or args.metrics_port is not None:
+        from core.telemetry import Telemetry
+        telemetry = Telemetry(trace_path=args.trace)
+        if args.metrics_port is not None:
+            port = telemetry.serve(args.metrics_port)
+            print(f"📈 指标服务: http://127.0.0.1:{port}/metrics (JSON: /status)")
+
+    segment_cache = None
+    if args.segment_cache is not None:
+        from core.segment_cache import SegmentCache
+        segment_cache = SegmentCache(args.segment_cache or None, max_bytes=int(args.segment_cache_gb * 1024 ** 3))
+
+    options = dict(
+        merge_mode=args.merge_mode,
+        max_buffer_mb=args.buffer_mb,
+        remux=args.remux,
+        hedge_percentile=args.hedge_percentile,
+        discover_mirrors=not args.no_mirror_discovery,
+        max_height=args.max_height,
+        codec=args.codec,
+        max_bandwidth=args.max_bandwidth,
+        deadline=args.deadline * 60 if args.deadline else None,
+        http2=args.http2,
+        segment_cache=segment_cache,
+        telemetry=telemetry,
+    )
+    rate_limit = args.limit_rate * 1024 * 1024 if args.limit_rate else None
+    # 结束时打印各阶段耗时汇总 (--profile 时同时写入 cProfile 统计)
+    with profile_run(args.profile):
+        if args.batch:
+            with span("批量下载"):
+                run_batch(args, options, rate_limit)
+        else:
+            run_single(args, options, rate_limit)
+
+def run_single(args, options, rate_limit):
+    """单个链接: 校验 -> (网页解析) -> 下载"""
     target_url = args.input
     output_dir = args.output
     
     # 0. 基础有效性检测
+    from core.utils import validate_url
+
     print("正在检查 URL 有效性...")
-    is_valid, message = validate_url(target_url)
+    with span("校验 URL"):
+        is_valid, message = validate_url(target_url)
     if not is_valid:
         print(f"❌ URL 无效: {message}")
         sys.exit(1)
@@ -27,8 +141,10 @@ def main():
         video_title = None # 直接 m3u8 没有标题
     else:
         print("识别为网页链接，开始尝试解析...")
-        extractor = WebExtractor()
-        extracted_url, extracted_title = extractor.extract_m3u8(target_url)
+        from core.extractor import WebExtractor
+        with span("网页解析"):
+            extractor = WebExtractor()
+            extracted_url, extracted_title = extractor.extract_m3u8(target_url)
         
         if extracted_url:
             print(f"✅ 成功提取 m3u8 URL: {extracted_url}")
@@ -46,14 +162,79 @@ def main():
     if output_dir:
         print(f"目标输出目录: {output_dir}")
     
-    downloader = M3U8Downloader(target_url, output_dir=output_dir, output_filename=video_title)
-    result, error = downloader.run()
-    
+    if args.engine == "async":
+        from core.async_downloader import AsyncM3U8Downloader
+        downloader = AsyncM3U8Downloader(
+            target_url,
+            output_dir=output_dir,
+            output_filename=video_title,
+            max_concurrency=args.concurrency,
+            merge_mode=args.merge_mode,
+            max_buffer_mb=args.buffer_mb,
+            max_height=args.max_height,
+            codec=args.codec,
+            max_bandwidth=args.max_bandwidth,
+        )
+        with span("下载"):
+            result, error = downloader.run_sync()
+        finish(result, error)
+        return
+
+    from core.downloader import M3U8Downloader
+    from core.pool import BandwidthLimiter
+    downloader = M3U8Downloader(
+        target_url,
+        output_dir=output_dir,
+        output_filename=video_title,
+        resume=args.resume,
+        live=args.live,
+        live_duration=args.live_duration,
+        mirrors=args.mirror,
+        min_workers=args.min_workers,
+        max_workers=args.max_workers,
+        bandwidth=BandwidthLimiter(rate_limit) if rate_limit else None,
+        **options,
+    )
+    with span("下载"):
+        result, error = downloader.run()
+    finish(result, error)
+
+def finish(result, error):
     if result:
         print(f"🎉 任务全部完成！文件位于: {result}")
     else:
         print(f"❌ 任务失败: {error}")
         sys.exit(1)
 
+def run_batch(args, options, rate_limit):
+    """批量模式: 把链接加入持久化队列，共享线程池 / 主机并发 / 带宽上限运行全部未完成的任务"""
+    from core.scheduler import DownloadQueue, read_batch_file
+
+    queue = DownloadQueue(
+        output_dir=args.output,
+        max_jobs=args.jobs,
+        workers=args.workers,
+        min_workers=args.min_workers,
+        max_workers=args.max_workers,
+        rate_limit=rate_limit,
+        **options,
+    )
+    entries = read_batch_file(args.batch)
+    if args.input:
+        entries.append((args.input, args.priority))
+    for url, priority in entries:
+        queue.add(url, priority=priority)
+    pending = len(queue.pending())
+    print(f"📋 下载队列: {queue.path} ({pending} 个待处理任务)")
+    if not pending:
+        return
+
+    try:
+        finished = queue.run()
+    except KeyboardInterrupt:
+        sys.exit(130)
+    if any(job["status"] != "done" for job in finished):
+        sys.exit(1)
+
 if __name__ == "__main__":
     main()
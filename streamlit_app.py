@@ -1,3 +1,4 @@
+import argparse
 import streamlit as st
 import time
 import tkinter as tk
@@ -5,8 +6,14 @@ from tkinter import filedialog
 from core.extractor import WebExtractor
 from core.downloader import M3U8Downloader
 from core.utils import validate_url
+from core.profiling import profile_run, span
 from pathlib import Path
 
+# streamlit run streamlit_app.py -- --profile gui.prof
+_parser = argparse.ArgumentParser()
+_parser.add_argument("--profile", default=None)
+cli_args, _ = _parser.parse_known_args()
+
 st.set_page_config(page_title="M3U8 智能下载器", page_icon="🎬")
 
 st.title("🎬 M3U8 智能下载器")
@@ -34,78 +41,95 @@ with st.container():
         # 临时移除 Tkinter 目录选择功能，改用手动输入
         # if st.button("📂 选择文件夹"): ... 
 
+resume = st.checkbox("断点续传", value=True, help="如果同一视频之前下载中断，只补齐缺失的切片")
+
 # 2. 状态显示区域
 status_container = st.empty()
 progress_bar = st.empty()
 
+def show_phases(timer):
+    """在页面上显示本次运行各阶段的耗时"""
+    with st.expander("⏱️ 阶段耗时"):
+        st.table([
+            {"阶段": path, "次数": count, "耗时 (秒)": round(total, 3), "占比": f"{share:.1%}"}
+            for path, count, total, share in timer.rows()
+        ])
+        st.caption(f"总耗时 {timer.elapsed:.3f} 秒" + (f"，cProfile 统计: {cli_args.profile}" if cli_args.profile else ""))
+
 # 3. 核心逻辑
 if st.button("🚀 开始下载", type="primary"):
     if not url:
         st.error("❌ 请输入视频地址")
     else:
-        # 0. 验证 URL
-        status_container.info("正在验证 URL...")
-        is_valid, msg = validate_url(url)
+        with profile_run(cli_args.profile) as timer:
+            # 0. 验证 URL
+            status_container.info("正在验证 URL...")
+            with span("校验 URL"):
+                is_valid, msg = validate_url(url)
         
-        if not is_valid:
-            st.error(f"❌ URL 无效: {msg}")
-        else:
-            try:
-                # 1. 解析 (如果是网页)
-                target_url = url
-                video_title = None
+            if not is_valid:
+                st.error(f"❌ URL 无效: {msg}")
+            else:
+                try:
+                    # 1. 解析 (如果是网页)
+                    target_url = url
+                    video_title = None
                 
-                if ".m3u8" not in url or url.strip().endswith(".html"):
-                    status_container.warning("识别为网页，正在启动浏览器解析 (可能需要几秒钟)...")
-                    extractor = WebExtractor()
-                    extracted, title = extractor.extract_m3u8(url)
-                    if extracted:
-                        target_url = extracted
-                        video_title = title
-                        st.success(f"✅ 成功提取 m3u8: {target_url}")
-                        if title:
-                            st.info(f"📄 识别到视频标题: {title}")
-                    else:
-                        st.error("❌ 未能在网页中找到 m3u8 链接")
-                        st.stop()
+                    if ".m3u8" not in url or url.strip().endswith(".html"):
+                        status_container.warning("识别为网页，正在启动浏览器解析 (可能需要几秒钟)...")
+                        with span("网页解析"):
+                            extractor = WebExtractor()
+                            extracted, title = extractor.extract_m3u8(url)
+                        if extracted:
+                            target_url = extracted
+                            video_title = title
+                            st.success(f"✅ 成功提取 m3u8: {target_url}")
+                            if title:
+                                st.info(f"📄 识别到视频标题: {title}")
+                        else:
+                            st.error("❌ 未能在网页中找到 m3u8 链接")
+                            st.stop()
 
-                # 2. 下载
-                status_container.info("正在准备下载...")
+                    # 2. 下载
+                    status_container.info("正在准备下载...")
                 
-                # 定义进度回调
-                p_bar = progress_bar.progress(0)
+                    # 定义进度回调
+                    p_bar = progress_bar.progress(0)
                 
-                def on_progress(current, total):
-                    percent = int(current / total * 100)
-                    p_bar.progress(percent)
-                    status_container.info(f"⬇️ 正在下载切片: {current}/{total} ({percent}%)")
+                    def on_progress(current, total):
+                        percent = int(current / total * 100)
+                        p_bar.progress(percent)
+                        status_container.info(f"⬇️ 正在下载切片: {current}/{total} ({percent}%)")
 
-                downloader = M3U8Downloader(target_url, output_dir=st.session_state.output_dir, output_filename=video_title)
-                result_path, error_msg = downloader.run(progress_callback=on_progress)
+                    downloader = M3U8Downloader(target_url, output_dir=st.session_state.output_dir, output_filename=video_title, resume=resume)
+                    with span("下载"):
+                        result_path, error_msg = downloader.run(progress_callback=on_progress)
                 
-                if result_path:
-                    p_bar.progress(100)
-                    status_container.empty()
-                    st.success(f"🎉 下载完成！")
-                    st.balloons()
-                    st.code(result_path, language="bash")
-                    st.info(f"文件已保存到: {st.session_state.output_dir}")
-                else:
-                    st.error(f"❌ 下载失败: {error_msg}")
-                    with st.expander("可能有用的排查建议"):
-                        st.markdown("""
-                        1. 检查网络连接是否正常
-                        2. 确认视频地址是否已失效（有些 m3u8 有时效性）
-                        3. 如果是加密视频，可能需要特定的 Headers 或 Key
-                        """)
+                    if result_path:
+                        p_bar.progress(100)
+                        status_container.empty()
+                        st.success(f"🎉 下载完成！")
+                        st.balloons()
+                        st.code(result_path, language="bash")
+                        st.info(f"文件已保存到: {st.session_state.output_dir}")
+                    else:
+                        st.error(f"❌ 下载失败: {error_msg}")
+                        with st.expander("可能有用的排查建议"):
+                            st.markdown("""
+                            1. 检查网络连接是否正常
+                            2. 确认视频地址是否已失效（有些 m3u8 有时效性）
+                            3. 如果是加密视频，可能需要特定的 Headers 或 Key
+                            4. 勾选「断点续传」后重新下载，只会补齐失败的切片
+                            """)
 
-            except PermissionError as e:
-                st.error(str(e))
-                st.toast("⚠️ 目录权限错误，请检查路径", icon="🚫")
-            except Exception as e:
-                st.error(f"❌ 发生未知错误: {str(e)}")
-                with st.expander("查看详细错误信息"):
-                    st.exception(e)
+                except PermissionError as e:
+                    st.error(str(e))
+                    st.toast("⚠️ 目录权限错误，请检查路径", icon="🚫")
+                except Exception as e:
+                    st.error(f"❌ 发生未知错误: {str(e)}")
+                    with st.expander("查看详细错误信息"):
+                        st.exception(e)
+        show_phases(timer)
 
 # 页脚
 st.markdown("---")